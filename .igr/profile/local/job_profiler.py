@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Sampling memory, CPU and I/O profiler for cluster jobs.
+
+When JOB_PROFILER holds the path to this file, the jobscript starts it in
+the background before running the job. It samples the whole process tree
+of the jobscript at a fixed interval: resident memory, CPU usage and bytes
+read/written. The time series is written next to the first log file of the
+job (`<log>.profile.tsv`, or `logs/profiles/<rule>.<jobid>.profile.tsv` for
+rules without log), and sampling stops with the jobscript.
+
+The summary command gathers all time series, and draws the memory curves
+of each rule in a SVG file. For each rule, it reports when the memory peak
+occurs, relatively to the job duration: early peaks come from loading the
+inputs, late peaks from the computation itself.
+
+Environment variables:
+    JOB_PROFILER            Path to this file, enables profiling
+    JOB_PROFILER_INTERVAL   Delay between two samples, in seconds
+                            (default: 1)
+
+Usage:
+    job_profiler.py sample <jobscript> <pid>
+    job_profiler.py summary [directory] [--output profiles.svg]
+
+You can test this module with:
+pytest -vv job_profiler.py
+"""
+import argparse
+import glob
+import html
+import json
+import os
+import re
+import sys
+import time
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+HEADER = ["time_s", "processes", "rss_mb", "cpu_percent", "read_mb",
+          "write_mb"]
+COLORS = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b",
+          "#e377c2", "#7f7f7f", "#bcbd22", "#17becf"]
+
+
+def _interval() -> float:
+    return float(os.environ.get("JOB_PROFILER_INTERVAL", 1))
+
+
+def read_properties(jobscript: str) -> Dict[str, Any]:
+    """Read the job properties embedded in a Snakemake jobscript"""
+    with open(jobscript) as stream:
+        match = re.search(r"^# properties = (.*)$", stream.read(), re.M)
+    return json.loads(match.group(1)) if match else {}
+
+
+def profile_path(properties: Dict[str, Any]) -> str:
+    """Return the path of the time series, next to the job's log"""
+    logs = properties.get("log") or []
+    if logs:
+        return "{}.profile.tsv".format(os.path.splitext(logs[0])[0])
+    return os.path.join("logs", "profiles", "{}.{}.profile.tsv".format(
+        properties.get("rule", "job"), properties.get("jobid", os.getpid())
+    ))
+
+
+##############################
+# Sampling
+##############################
+def _processes() -> Dict[int, Tuple[int, List[str]]]:
+    """Return the parent and the stat fields of all processes"""
+    processes = {}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open("/proc/{}/stat".format(pid)) as stream:
+                fields = stream.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        processes[int(pid)] = (int(fields[1]), fields)
+    return processes
+
+
+def _io_bytes(pid: int) -> Tuple[int, int]:
+    """Return the bytes read and written by a process, if readable"""
+    counters = {}
+    try:
+        with open("/proc/{}/io".format(pid)) as stream:
+            for line in stream:
+                key, value = line.split(":")
+                counters[key] = int(value)
+    except (OSError, ValueError):
+        pass
+    return counters.get("read_bytes", 0), counters.get("write_bytes", 0)
+
+
+def tree(root: int, processes: Dict[int, Tuple[int, List[str]]],
+         exclude: Iterable[int] = ()) -> List[int]:
+    """Return the root process and all its descendants"""
+    children = {}
+    for pid, (ppid, _) in processes.items():
+        children.setdefault(ppid, []).append(pid)
+    excluded = set(exclude)
+    found, stack = [], [root]
+    while stack:
+        pid = stack.pop()
+        if pid in excluded or pid not in processes:
+            continue
+        found.append(pid)
+        stack.extend(children.get(pid, []))
+    return found
+
+
+def snapshot(root: int,
+             exclude: Iterable[int] = ()) -> Optional[Dict[str, float]]:
+    """Sum memory, CPU time and I/O over a process tree, None once the root
+    process exited"""
+    page_mb = os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    ticks = os.sysconf("SC_CLK_TCK")
+    processes = _processes()
+    if root not in processes or processes[root][1][0] == "Z":
+        return None
+    pids = tree(root, processes, exclude)
+    usage = {"processes": len(pids), "rss_mb": 0.0, "cpu_s": 0.0,
+             "read_mb": 0.0, "write_mb": 0.0}
+    for pid in pids:
+        fields = processes[pid][1]
+        usage["rss_mb"] += int(fields[21]) * page_mb
+        usage["cpu_s"] += (int(fields[11]) + int(fields[12])) / ticks
+        read, write = _io_bytes(pid)
+        usage["read_mb"] += read / 1024 ** 2
+        usage["write_mb"] += write / 1024 ** 2
+    return usage
+
+
+def sample(root: int, output: str, interval: float,
+           metadata: Dict[str, Any]) -> int:
+    """Sample a process tree until its root exits, return the sample count"""
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    start = previous_time = time.monotonic()
+    previous_cpu = None
+    count = 0
+    with open(output, "w") as stream:
+        stream.write("# {}\n".format(json.dumps(metadata)))
+        stream.write("\t".join(HEADER) + "\n")
+        while True:
+            usage = snapshot(root, exclude=[os.getpid()])
+            if usage is None:
+                break
+            now = time.monotonic()
+            # CPU time spent before profiling is not accounted
+            if previous_cpu is None:
+                previous_cpu = usage["cpu_s"]
+            cpu_percent = max(usage["cpu_s"] - previous_cpu, 0) \
+                / max(now - previous_time, 1e-6) * 100
+            previous_cpu, previous_time = usage["cpu_s"], now
+            stream.write("{:.2f}\t{}\t{:.1f}\t{:.1f}\t{:.2f}\t{:.2f}\n".format(
+                now - start, usage["processes"], usage["rss_mb"],
+                cpu_percent, usage["read_mb"], usage["write_mb"]
+            ))
+            stream.flush()
+            count += 1
+            time.sleep(interval)
+    return count
+
+
+##############################
+# Summary
+##############################
+def read_profile(path: str) -> Tuple[Dict[str, Any], List[Dict[str, float]]]:
+    """Return the metadata and the samples of a time series"""
+    with open(path) as stream:
+        metadata = json.loads(stream.readline()[1:])
+        header = stream.readline().rstrip("\n").split("\t")
+        samples = [
+            dict(zip(header, map(float, line.rstrip("\n").split("\t"))))
+            for line in stream if line.strip()
+        ]
+    return metadata, samples
+
+
+def summarize(directory: str) -> Dict[str, List[Dict[str, Any]]]:
+    """Gather all time series below a directory, per rule"""
+    rules = {}
+    pattern = os.path.join(directory, "**", "*.profile.tsv")
+    for path in sorted(glob.glob(pattern, recursive=True)):
+        try:
+            metadata, samples = read_profile(path)
+        except (OSError, ValueError):
+            continue
+        if not samples:
+            continue
+        peak = max(samples, key=lambda row: row["rss_mb"])
+        duration = samples[-1]["time_s"]
+        rules.setdefault(metadata.get("rule", "unknown"), []).append({
+            "path": path,
+            "samples": samples,
+            "peak_rss_mb": peak["rss_mb"],
+            "peak_at": peak["time_s"] / duration if duration > 0 else 0.0,
+            "duration_s": duration,
+        })
+    return rules
+
+
+def format_summary(rules: Dict[str, List[Dict[str, Any]]]) -> str:
+    """Return the peak memory of each rule, and when it occurs, as TSV"""
+    lines = ["rule\tjobs\tpeak_rss_mb\tpeak_at_percent\tmax_duration_s"]
+    for rule, jobs in sorted(rules.items()):
+        peak = max(jobs, key=lambda job: job["peak_rss_mb"])
+        lines.append("{}\t{}\t{:.1f}\t{:.0f}\t{:.1f}".format(
+            rule, len(jobs), peak["peak_rss_mb"], peak["peak_at"] * 100,
+            max(job["duration_s"] for job in jobs)
+        ))
+    return "\n".join(lines)
+
+
+def plot(rules: Dict[str, List[Dict[str, Any]]], output: str) -> None:
+    """Draw the memory curves of each rule, one panel per rule"""
+    width, height, margin = 640, 220, 50
+    panels = []
+    for index, (rule, jobs) in enumerate(sorted(rules.items())):
+        top = index * (height + margin)
+        max_time = max(job["duration_s"] for job in jobs) or 1
+        max_rss = max(job["peak_rss_mb"] for job in jobs) or 1
+        panel = [
+            '<text x="{}" y="{}" font-weight="bold">{}</text>'.format(
+                margin, top + 20, html.escape(rule)),
+            '<text x="5" y="{}" font-size="10">{:.0f} MB</text>'.format(
+                top + 40, max_rss),
+            '<text x="{}" y="{}" font-size="10">{:.0f} s</text>'.format(
+                width - margin, top + height + 15, max_time),
+            '<path d="M{0},{1} V{2} H{3}" fill="none" stroke="black"/>'
+            .format(margin, top + 30, top + height, width - margin),
+        ]
+        for number, job in enumerate(jobs):
+            points = " ".join(
+                "{:.1f},{:.1f}".format(
+                    margin + row["time_s"] / max_time * (width - 2 * margin),
+                    top + height - row["rss_mb"] / max_rss * (height - 30)
+                )
+                for row in job["samples"]
+            )
+            panel.append(
+                '<polyline points="{}" fill="none" stroke="{}">'
+                '<title>{}</title></polyline>'.format(
+                    points, COLORS[number % len(COLORS)],
+                    html.escape(job["path"]))
+            )
+        panels.extend(panel)
+
+    total_height = max(len(rules), 1) * (height + margin)
+    with open(output, "w") as stream:
+        stream.write(
+            '<svg xmlns="http://www.w3.org/2000/svg" width="{}" height="{}" '
+            'font-family="sans-serif" font-size="12">\n{}\n</svg>\n'.format(
+                width, total_height, "\n".join(panels))
+        )
+
+
+##############################
+# Tests
+##############################
+def _jobscript(tmp_path, properties: Dict[str, Any]) -> str:
+    path = tmp_path / "jobscript.sh"
+    path.write_text("#!/bin/bash\n# properties = {}\necho\n".format(
+        json.dumps(properties)))
+    return str(path)
+
+
+def test_profile_path(tmp_path) -> None:
+    properties = read_properties(_jobscript(
+        tmp_path, {"rule": "deseq", "jobid": 3, "log": ["logs/deseq/d1.log"]}
+    ))
+    assert profile_path(properties) == "logs/deseq/d1.profile.tsv"
+    assert profile_path({"rule": "tximport", "jobid": 4}) == \
+        os.path.join("logs", "profiles", "tximport.4.profile.tsv")
+
+
+def test_tree() -> None:
+    processes = {1: (0, []), 10: (1, []), 11: (10, []), 12: (10, []),
+                 20: (1, [])}
+    assert sorted(tree(10, processes)) == [10, 11, 12]
+    assert sorted(tree(10, processes, exclude=[12])) == [10, 11]
+
+
+def test_sample_and_summary(tmp_path) -> None:
+    import subprocess
+    process = subprocess.Popen([
+        sys.executable, "-c",
+        "import time; data = bytearray(64 * 1024 ** 2); time.sleep(0.6)"
+    ])
+    output = str(tmp_path / "logs" / "rule" / "job.profile.tsv")
+    assert sample(process.pid, output, 0.1, {"rule": "big"}) >= 2
+    process.wait()
+
+    rules = summarize(str(tmp_path))
+    assert list(rules) == ["big"]
+    assert rules["big"][0]["peak_rss_mb"] >= 64
+    assert format_summary(rules).splitlines()[1].startswith("big\t1\t")
+
+    plot(rules, str(tmp_path / "profiles.svg"))
+    svg = (tmp_path / "profiles.svg").read_text()
+    assert svg.count("<polyline") == 1
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    command, argv = sys.argv[1], sys.argv[2:]
+    if command == "sample":
+        jobscript, root = argv[0], int(argv[1])
+        properties = read_properties(jobscript)
+        sample(root, profile_path(properties), _interval(), {
+            key: properties.get(key)
+            for key in ["rule", "jobid", "wildcards", "threads", "resources"]
+        })
+    elif command == "summary":
+        parser = argparse.ArgumentParser(prog="summary")
+        parser.add_argument("directory", nargs="?", default="logs")
+        parser.add_argument("--output", default="profiles.svg")
+        args = parser.parse_args(argv)
+        rules = summarize(args.directory)
+        print(format_summary(rules))
+        plot(rules, args.output)
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,5 @@
+#!/bin/bash
+# Run slurm-status.py against the local cluster emulator
+PROFILE="$(dirname "$(readlink -f "${0}")")"
+export PATH="${PROFILE}/bin:${PATH}"
+exec "${PROFILE}/slurm-status.py" "$@"
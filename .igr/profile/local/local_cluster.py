@@ -0,0 +1,682 @@
+#!/usr/bin/env python3
+"""
+Local SLURM emulator.
+
+This module accepts sbatch-style submissions and runs them on the local
+machine, with a scheduler sharing the cores between jobs:
+
+- CPUs: a job only starts when enough cores are free, and is pinned to
+  them (sched_setaffinity).
+
+With LOCAL_CLUSTER_ENFORCE set, the scheduler also enforces each job's
+memory and time limit, as SLURM would:
+
+- Memory: jobs requesting more memory than available are refused, and a job
+  only starts when its memory is free. The resident memory of the job's
+  whole process tree is sampled, the job is killed (OUT_OF_MEMORY) when it
+  exceeds its request.
+- Time: the job is killed (TIMEOUT) when it exceeds its time limit.
+
+Otherwise, jobs run without limits, as plain local runs do, and jobs
+requesting more cores than available use all of them.
+
+Job states are reported through a sacct-compatible command, so the SLURM
+submission and status scripts of this profile are used unchanged (see
+bin/sbatch and bin/sacct). The scheduler starts with the first submission,
+and stops once idle.
+
+Environment variables:
+    LOCAL_CLUSTER_DIR       State directory (default: .snakemake/local-cluster)
+    LOCAL_CLUSTER_CPUS      Number of cores available (default: all)
+    LOCAL_CLUSTER_MEM_MB    Memory available, in MB (default: all)
+    LOCAL_CLUSTER_IDLE      Stop the scheduler after this many idle seconds
+                            (default: 60)
+    LOCAL_CLUSTER_ENFORCE   Enforce memory and time limits (default: unset)
+
+Usage:
+    local_cluster.py sbatch [sbatch options] jobscript
+    local_cluster.py sacct -P -b -n -j <jobid>[,<jobid>...]
+    local_cluster.py stats
+
+You can test this module with:
+pytest -vv local_cluster.py
+"""
+import argparse
+import fcntl
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+
+from typing import Any, Dict, Iterable, List, Optional
+
+TICK = 0.2
+FINISHED = {"COMPLETED", "FAILED", "OUT_OF_MEMORY", "TIMEOUT", "CANCELLED"}
+
+
+def _cluster_dir() -> str:
+    return os.environ.get("LOCAL_CLUSTER_DIR",
+                          os.path.join(".snakemake", "local-cluster"))
+
+
+def _cpus() -> int:
+    return int(os.environ.get("LOCAL_CLUSTER_CPUS",
+                              len(os.sched_getaffinity(0))))
+
+
+def _mem_mb() -> int:
+    if "LOCAL_CLUSTER_MEM_MB" in os.environ:
+        return int(os.environ["LOCAL_CLUSTER_MEM_MB"])
+    with open("/proc/meminfo") as stream:
+        m = re.search(r"MemTotal:\s+(\d+) kB", stream.read())
+    return int(m.group(1)) // 1024
+
+
+def _idle() -> float:
+    return float(os.environ.get("LOCAL_CLUSTER_IDLE", 60))
+
+
+def _enforce() -> bool:
+    return os.environ.get("LOCAL_CLUSTER_ENFORCE", "") not in ("", "0")
+
+
+def _exit_code(status: int) -> int:
+    """Return the exit code of a wait status, minus the signal number if
+    the process was killed (os.waitstatus_to_exitcode, Python < 3.9)"""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _job_path(cluster_dir: str, jobid: str) -> str:
+    return os.path.join(cluster_dir, "jobs", jobid + ".json")
+
+
+def _read_json(path: str) -> Dict[str, Any]:
+    with open(path) as stream:
+        return json.load(stream)
+
+
+def _write_json(path: str, data: Dict[str, Any]) -> None:
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "w") as stream:
+        json.dump(data, stream)
+    os.replace(tmp_path, path)
+
+
+def parse_time(value: Optional[str]) -> Optional[float]:
+    """Convert a SLURM time limit into seconds. Accepted formats are
+    minutes, MM:SS, HH:MM:SS, D-HH, D-HH:MM and D-HH:MM:SS"""
+    if value is None:
+        return None
+    days = 0
+    if "-" in value:
+        days, value = value.split("-", 1)
+        parts = [int(x) for x in value.split(":")] + [0, 0]
+        hours, minutes, seconds = parts[:3]
+        return ((int(days) * 24 + hours) * 60 + minutes) * 60 + seconds
+    parts = [int(x) for x in value.split(":")]
+    if len(parts) == 1:
+        return parts[0] * 60
+    if len(parts) == 2:
+        return parts[0] * 60 + parts[1]
+    return (parts[0] * 60 + parts[1]) * 60 + parts[2]
+
+
+def parse_mem(value: Optional[str]) -> Optional[int]:
+    """Convert a SLURM memory request into MB"""
+    if value is None:
+        return None
+    m = re.match(r"^(\d+)([KMGT]?)B?$", str(value).upper())
+    factor = {"K": 1 / 1024, "": 1, "M": 1, "G": 1024, "T": 1024 ** 2}
+    return int(int(m.group(1)) * factor[m.group(2)])
+
+
+##############################
+# sbatch
+##############################
+def sbatch_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="sbatch", add_help=False)
+    parser.add_argument("-a", "--array")
+    parser.add_argument("-c", "--cpus-per-task", type=int, default=1)
+    parser.add_argument("-D", "--workdir", "--chdir", dest="workdir")
+    parser.add_argument("-e", "--error")
+    parser.add_argument("-J", "--job-name")
+    parser.add_argument("-n", "--ntasks", type=int, default=1)
+    parser.add_argument("-o", "--output")
+    parser.add_argument("-t", "--time")
+    parser.add_argument("--mem")
+    return parser
+
+
+def _array_indices(array: str) -> List[int]:
+    indices = []
+    for part in array.split("%")[0].split(","):
+        if "-" in part:
+            start, end = part.split("-")
+            indices.extend(range(int(start), int(end) + 1))
+        else:
+            indices.append(int(part))
+    return indices
+
+
+def _next_jobid(cluster_dir: str) -> int:
+    with open(os.path.join(cluster_dir, "counter.lock"), "a+") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        lock.seek(0)
+        jobid = int(lock.read().strip() or 0) + 1
+        lock.seek(0)
+        lock.truncate()
+        lock.write(str(jobid))
+        return jobid
+
+
+def sbatch(argv: List[str],
+           cluster_dir: Optional[str] = None,
+           start: bool = True) -> str:
+    """Queue a job (or a job array), return its job identifier"""
+    cluster_dir = cluster_dir or _cluster_dir()
+    os.makedirs(os.path.join(cluster_dir, "jobs"), exist_ok=True)
+    # Unsupported options are ignored, the jobscript comes last
+    args, _ = sbatch_parser().parse_known_args(argv[:-1])
+    args.jobscript = argv[-1]
+
+    cpus = args.cpus_per_task * args.ntasks
+    mem_mb = parse_mem(args.mem)
+    if _enforce():
+        # Like SLURM, refuse jobs which could never start
+        if cpus > _cpus() or (mem_mb or 0) > _mem_mb():
+            raise ValueError(
+                "Requested node configuration is not available: "
+                "{} cpus, {} MB".format(cpus, mem_mb)
+            )
+    else:
+        cpus = min(cpus, _cpus())
+
+    jobid = str(_next_jobid(cluster_dir))
+    tasks = ([(jobid, None)] if args.array is None else
+             [("{}_{}".format(jobid, index), index)
+              for index in _array_indices(args.array)])
+    for task_id, index in tasks:
+        _write_json(_job_path(cluster_dir, task_id), {
+            "jobid": task_id,
+            "array_jobid": jobid,
+            "array_index": index,
+            "name": args.job_name or os.path.basename(args.jobscript),
+            "jobscript": os.path.abspath(args.jobscript),
+            "workdir": os.path.abspath(args.workdir or os.getcwd()),
+            "output": args.output or "slurm-%j.out",
+            "error": args.error or args.output or "slurm-%j.out",
+            "cpus": cpus,
+            "mem_mb": mem_mb,
+            "time_s": parse_time(args.time),
+            "state": "PENDING",
+            "submit": time.time(),
+        })
+
+    if start and not scheduler_running(cluster_dir):
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "scheduler",
+             "--cluster-dir", cluster_dir],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    return jobid
+
+
+##############################
+# sacct
+##############################
+def sacct(jobids: Iterable[str],
+          cluster_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Return the records of the given jobs; an array job identifier
+    stands for all of its tasks"""
+    cluster_dir = cluster_dir or _cluster_dir()
+    jobs_dir = os.path.join(cluster_dir, "jobs")
+    records = []
+    for jobid in jobids:
+        path = _job_path(cluster_dir, jobid)
+        if os.path.exists(path):
+            records.append(_read_json(path))
+        elif os.path.isdir(jobs_dir):
+            records.extend(
+                _read_json(os.path.join(jobs_dir, name))
+                for name in sorted(os.listdir(jobs_dir))
+                if name.startswith(jobid + "_") and name.endswith(".json")
+            )
+    return records
+
+
+def format_sacct(records: List[Dict[str, Any]]) -> str:
+    return "".join(
+        "{}|{}|{}:0\n".format(record["jobid"], record["state"],
+                              record.get("exit_code", 0))
+        for record in records
+    )
+
+
+##############################
+# Scheduler
+##############################
+def _sessions_rss_mb() -> Dict[int, float]:
+    """Sum the resident memory of all processes, per session"""
+    rss = {}
+    page_mb = os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open("/proc/{}/stat".format(pid)) as stream:
+                fields = stream.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        session = int(fields[3])
+        rss[session] = rss.get(session, 0) + int(fields[21]) * page_mb
+    return rss
+
+
+def _expand(pattern: str, record: Dict[str, Any]) -> str:
+    index = record["array_index"]
+    return (pattern
+            .replace("%A", record["array_jobid"])
+            .replace("%a", "" if index is None else str(index))
+            .replace("%j", record["jobid"])
+            .replace("%x", record["name"])
+            .replace("%N", os.uname().nodename))
+
+
+class Scheduler:
+    """First-come first-served scheduler with backfilling"""
+
+    def __init__(self,
+                 cluster_dir: Optional[str] = None,
+                 cpus: Optional[int] = None,
+                 mem_mb: Optional[int] = None,
+                 enforce: Optional[bool] = None) -> None:
+        self.cluster_dir = cluster_dir or _cluster_dir()
+        self.enforce = _enforce() if enforce is None else enforce
+        self.free_cores = set(range(cpus or _cpus()))
+        self.cores = len(self.free_cores)
+        # More cores than available can be emulated: they share CPUs
+        self.cpu_ids = sorted(os.sched_getaffinity(0))
+        self.free_mem = mem_mb or _mem_mb()
+        self.running = {}
+
+    def _save(self, record: Dict[str, Any]) -> None:
+        _write_json(_job_path(self.cluster_dir, record["jobid"]), record)
+
+    def pending(self) -> List[Dict[str, Any]]:
+        jobs_dir = os.path.join(self.cluster_dir, "jobs")
+        records = []
+        for name in os.listdir(jobs_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                record = _read_json(os.path.join(jobs_dir, name))
+            except (OSError, ValueError):
+                continue
+            if record["state"] == "PENDING":
+                records.append(record)
+        return sorted(records, key=lambda r: (r["submit"], r["jobid"]))
+
+    def start(self, record: Dict[str, Any]) -> bool:
+        mem_mb = (record["mem_mb"] or 0) if self.enforce else 0
+        cpus = record["cpus"] if self.enforce \
+            else min(record["cpus"], self.cores)
+        if cpus > len(self.free_cores) or mem_mb > self.free_mem:
+            return False
+        cores = sorted(self.free_cores)[:cpus]
+        self.free_cores -= set(cores)
+        cpu_ids = {self.cpu_ids[core % len(self.cpu_ids)] for core in cores}
+        self.free_mem -= mem_mb
+
+        output = os.path.join(record["workdir"],
+                              _expand(record["output"], record))
+        error = os.path.join(record["workdir"],
+                             _expand(record["error"], record))
+        for path in (output, error):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        env = dict(os.environ,
+                   SLURM_JOB_ID=record["jobid"],
+                   SLURM_CPUS_PER_TASK=str(record["cpus"]))
+        if record["array_index"] is not None:
+            env["SLURM_ARRAY_JOB_ID"] = record["array_jobid"]
+            env["SLURM_ARRAY_TASK_ID"] = str(record["array_index"])
+
+        with open(output, "a") as out, open(error, "a") as err:
+            process = subprocess.Popen(
+                ["/bin/bash", record["jobscript"]],
+                cwd=record["workdir"],
+                env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=out,
+                stderr=out if output == error else err,
+                start_new_session=True,
+                preexec_fn=lambda: os.sched_setaffinity(0, cpu_ids),
+            )
+        record.update(state="RUNNING", start=time.time(), cores=cores,
+                      reserved_mem_mb=mem_mb, max_rss_mb=0)
+        self._save(record)
+        self.running[record["jobid"]] = (process, record)
+        return True
+
+    def _finish(self, jobid: str, state: str, exit_code: int,
+                cpu_seconds: float) -> None:
+        process, record = self.running.pop(jobid)
+        self.free_cores |= set(record["cores"])
+        self.free_mem += record["reserved_mem_mb"]
+        record.update(state=state, exit_code=exit_code, end=time.time(),
+                      cpu_seconds=cpu_seconds)
+        self._save(record)
+
+    def _kill(self, process: subprocess.Popen) -> None:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def poll(self) -> None:
+        rss = _sessions_rss_mb()
+        for jobid, (process, record) in list(self.running.items()):
+            pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+            if pid != 0:
+                process.returncode = _exit_code(status)
+                # Kill remaining background processes of the job
+                self._kill(process)
+                state = record.get("killed") or (
+                    "COMPLETED" if process.returncode == 0 else "FAILED"
+                )
+                self._finish(jobid, state, process.returncode,
+                             usage.ru_utime + usage.ru_stime)
+                continue
+
+            record["max_rss_mb"] = max(record["max_rss_mb"],
+                                       rss.get(process.pid, 0))
+            if not self.enforce:
+                continue
+            if record["mem_mb"] and record["max_rss_mb"] > record["mem_mb"]:
+                record["killed"] = "OUT_OF_MEMORY"
+                self._kill(process)
+            elif (record["time_s"] is not None and
+                    time.time() - record["start"] > record["time_s"]):
+                record["killed"] = "TIMEOUT"
+                self._kill(process)
+
+    def schedule(self) -> None:
+        for record in self.pending():
+            self.start(record)
+
+    def run(self, idle: Optional[float] = None) -> None:
+        """Run jobs until nothing happened for `idle` seconds"""
+        idle = _idle() if idle is None else idle
+        last_activity = time.time()
+        while True:
+            self.poll()
+            self.schedule()
+            if self.running:
+                last_activity = time.time()
+            elif time.time() - last_activity > idle:
+                return
+            time.sleep(TICK)
+
+
+def scheduler_running(cluster_dir: str) -> bool:
+    try:
+        with open(os.path.join(cluster_dir, "scheduler.lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            fcntl.flock(lock, fcntl.LOCK_UN)
+        return False
+    except OSError:
+        return True
+
+
+def run_scheduler(cluster_dir: Optional[str] = None,
+                  cpus: Optional[int] = None,
+                  mem_mb: Optional[int] = None,
+                  idle: Optional[float] = None) -> None:
+    cluster_dir = cluster_dir or _cluster_dir()
+    os.makedirs(os.path.join(cluster_dir, "jobs"), exist_ok=True)
+    while True:
+        with open(os.path.join(cluster_dir, "scheduler.lock"), "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return
+            Scheduler(cluster_dir, cpus, mem_mb).run(idle)
+        # Jobs queued while the scheduler was stopping found the lock held,
+        # and did not start another scheduler
+        if not Scheduler(cluster_dir, cpus, mem_mb).pending():
+            return
+
+
+##############################
+# Statistics
+##############################
+def stats(cluster_dir: Optional[str] = None) -> Dict[str, Any]:
+    """Summarize scheduling throughput and resource usage"""
+    cluster_dir = cluster_dir or _cluster_dir()
+    jobs_dir = os.path.join(cluster_dir, "jobs")
+    names = os.listdir(jobs_dir) if os.path.isdir(jobs_dir) else []
+    records = [_read_json(os.path.join(jobs_dir, name))
+               for name in names if name.endswith(".json")]
+    done = [r for r in records if r["state"] in FINISHED and "start" in r]
+    summary = {
+        "jobs": len(records),
+        "states": {},
+        "mean_wait_s": None,
+        "makespan_s": None,
+        "jobs_per_minute": None,
+        "cpu_efficiency": None,
+    }
+    for record in records:
+        summary["states"][record["state"]] = (
+            summary["states"].get(record["state"], 0) + 1
+        )
+    if done:
+        makespan = (max(r["end"] for r in done) -
+                    min(r["submit"] for r in done))
+        reserved = sum((r["end"] - r["start"]) * r["cpus"] for r in done)
+        summary.update(
+            mean_wait_s=sum(r["start"] - r["submit"] for r in done) /
+            len(done),
+            makespan_s=makespan,
+            jobs_per_minute=60 * len(done) / makespan if makespan else None,
+            cpu_efficiency=(sum(r["cpu_seconds"] for r in done) / reserved
+                            if reserved else None),
+        )
+    return summary
+
+
+##############################
+# Tests
+##############################
+def _script(tmp_path, name: str, body: str) -> str:
+    path = tmp_path / name
+    path.write_text("#!/bin/bash\n" + body + "\n")
+    return str(path)
+
+
+def _submit(tmp_path, argv: List[str]) -> str:
+    """Queue a job running in tmp_path"""
+    return sbatch(["-D", str(tmp_path)] + argv, str(tmp_path / "cluster"),
+                  start=False)
+
+
+def _run(tmp_path, cpus: int = 2, mem_mb: int = 1024,
+         enforce: bool = True) -> None:
+    Scheduler(str(tmp_path / "cluster"), cpus, mem_mb, enforce).run(idle=0)
+
+
+def test_parse_time() -> None:
+    assert parse_time("20") == 1200
+    assert parse_time("1:30") == 90
+    assert parse_time("1:00:00") == 3600
+    assert parse_time("1-00:00:00") == 86400
+    assert parse_time("2-1") == 2 * 86400 + 3600
+
+
+def test_parse_mem() -> None:
+    assert parse_mem("1024") == 1024
+    assert parse_mem("2G") == 2048
+    assert parse_mem("512M") == 512
+
+
+def test_exit_code() -> None:
+    process = subprocess.Popen(["/bin/sh", "-c", "exit 3"])
+    assert _exit_code(os.waitpid(process.pid, 0)[1]) == 3
+    process = subprocess.Popen(["/bin/sleep", "10"])
+    process.kill()
+    assert _exit_code(os.waitpid(process.pid, 0)[1]) == -signal.SIGKILL
+
+
+def test_sbatch_and_sacct(tmp_path) -> None:
+    cluster_dir = str(tmp_path / "cluster")
+    script = _script(tmp_path, "job.sh", "echo $SLURM_JOB_ID")
+    jobid = _submit(tmp_path, [
+        "--output", "logs/%x-%j.out", "--job-name", "hello",
+        "--partition", "shortq", "--mem", "100", script
+    ])
+    assert format_sacct(sacct([jobid], cluster_dir)) == \
+        "{}|PENDING|0:0\n".format(jobid)
+
+    _run(tmp_path)
+    assert format_sacct(sacct([jobid], cluster_dir)) == \
+        "{}|COMPLETED|0:0\n".format(jobid)
+    assert (tmp_path / "logs" / "hello-{}.out".format(jobid)).read_text() \
+        == "{}\n".format(jobid)
+
+
+def test_sbatch_unavailable_configuration(tmp_path, monkeypatch) -> None:
+    monkeypatch.setenv("LOCAL_CLUSTER_CPUS", "2")
+    monkeypatch.setenv("LOCAL_CLUSTER_MEM_MB", "1024")
+    monkeypatch.setenv("LOCAL_CLUSTER_ENFORCE", "1")
+    script = _script(tmp_path, "job.sh", "true")
+    for argv in (["-c", "4", script], ["--mem", "2G", script]):
+        try:
+            sbatch(argv, str(tmp_path / "cluster"), start=False)
+        except ValueError:
+            continue
+        raise AssertionError("{} should be refused".format(argv))
+
+
+def test_limits_not_enforced(tmp_path, monkeypatch) -> None:
+    monkeypatch.setenv("LOCAL_CLUSTER_CPUS", "2")
+    monkeypatch.setenv("LOCAL_CLUSTER_MEM_MB", "1024")
+    monkeypatch.delenv("LOCAL_CLUSTER_ENFORCE", raising=False)
+    cluster_dir = str(tmp_path / "cluster")
+    script = _script(
+        tmp_path, "job.sh",
+        "{} -c 'x = bytearray(200 * 1024 ** 2); import time; "
+        "time.sleep(1)'".format(sys.executable)
+    )
+    jobid = _submit(tmp_path, ["-c", "4", "--mem", "2G", "--time", "0:00",
+                               script])
+    _run(tmp_path, enforce=False)
+    record = sacct([jobid], cluster_dir)[0]
+    assert record["state"] == "COMPLETED"
+    assert record["cores"] == [0, 1]
+
+
+def test_submission_while_stopping(tmp_path, monkeypatch) -> None:
+    cluster_dir = str(tmp_path / "cluster")
+    script = _script(tmp_path, "job.sh", "true")
+    submitted = []
+    run = Scheduler.run
+
+    def stopping(self, idle=None):
+        run(self, idle)
+        # Queued once the scheduler is idle, before it releases its lock
+        if not submitted:
+            submitted.append(_submit(tmp_path, [script]))
+
+    monkeypatch.setattr(Scheduler, "run", stopping)
+    run_scheduler(cluster_dir, 2, 1024, idle=0)
+    assert sacct(submitted, cluster_dir)[0]["state"] == "COMPLETED"
+
+
+def test_job_array(tmp_path) -> None:
+    cluster_dir = str(tmp_path / "cluster")
+    script = _script(tmp_path, "job.sh", "exit $SLURM_ARRAY_TASK_ID")
+    jobid = _submit(tmp_path, ["--array=0-1", "--output", "%A_%a.out", script])
+    _run(tmp_path)
+    assert format_sacct(sacct([jobid], cluster_dir)) == (
+        "{0}_0|COMPLETED|0:0\n{0}_1|FAILED|1:0\n".format(jobid)
+    )
+    assert (tmp_path / "{}_1.out".format(jobid)).exists()
+
+
+def test_cpu_limits(tmp_path) -> None:
+    cluster_dir = str(tmp_path / "cluster")
+    script = _script(tmp_path, "job.sh", "sleep 0.5")
+    first = _submit(tmp_path, ["-c", "1", script])
+    second = _submit(tmp_path, ["-c", "1", script])
+    _run(tmp_path, cpus=1)
+    first, second = sacct([first, second], cluster_dir)
+    assert second["start"] >= first["end"]
+    assert first["cores"] == second["cores"] == [0]
+
+
+def test_memory_limit(tmp_path) -> None:
+    cluster_dir = str(tmp_path / "cluster")
+    script = _script(
+        tmp_path, "job.sh",
+        "{} -c 'x = bytearray(200 * 1024 ** 2); import time; "
+        "time.sleep(5)'".format(sys.executable)
+    )
+    jobid = _submit(tmp_path, ["--mem", "50", script])
+    _run(tmp_path)
+    assert sacct([jobid], cluster_dir)[0]["state"] == "OUT_OF_MEMORY"
+
+
+def test_time_limit(tmp_path) -> None:
+    cluster_dir = str(tmp_path / "cluster")
+    script = _script(tmp_path, "job.sh", "sleep 10")
+    jobid = _submit(tmp_path, ["--time", "0:01", script])
+    _run(tmp_path)
+    record = sacct([jobid], cluster_dir)[0]
+    assert record["state"] == "TIMEOUT"
+    assert record["end"] - record["start"] < 5
+
+
+def test_stats(tmp_path) -> None:
+    cluster_dir = str(tmp_path / "cluster")
+    script = _script(tmp_path, "job.sh", "true")
+    for _ in range(3):
+        _submit(tmp_path, [script])
+    _run(tmp_path)
+    summary = stats(cluster_dir)
+    assert summary["jobs"] == 3
+    assert summary["states"] == {"COMPLETED": 3}
+    assert summary["jobs_per_minute"] > 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    command, argv = sys.argv[1], sys.argv[2:]
+    if command == "sbatch":
+        try:
+            print("Submitted batch job {}".format(sbatch(argv)))
+        except ValueError as e:
+            print("sbatch: error: {}".format(e), file=sys.stderr)
+            sys.exit(1)
+    elif command == "sacct":
+        parser = argparse.ArgumentParser(prog="sacct", add_help=False)
+        parser.add_argument("-j", "--jobs", required=True)
+        args, _ = parser.parse_known_args(argv)
+        sys.stdout.write(format_sacct(sacct(args.jobs.split(","))))
+    elif command == "scheduler":
+        parser = argparse.ArgumentParser(prog="scheduler")
+        parser.add_argument("--cluster-dir", default=None)
+        run_scheduler(parser.parse_args(argv).cluster_dir)
+    elif command == "stats":
+        print(json.dumps(stats(), indent=2))
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -1,3 +1,14 @@
 #!/bin/bash
 # properties = {properties}
+# Optional sampling of the job's memory, CPU and I/O (see job_profiler.py)
+if [ -n "${{JOB_PROFILER:-}}" ]; then
+    python3 "${{JOB_PROFILER}}" sample "$0" $$ &
+fi
+# Optional run in node-local scratch space (see job_staging.py)
+if [ -n "${{JOB_STAGING:-}}" ]; then
+    python3 "${{JOB_STAGING}}" run "$0" <<'SNAKEMAKE_JOB'
+{exec_job}
+SNAKEMAKE_JOB
+    exit $?
+fi
 {exec_job}
@@ -5,13 +5,41 @@ import shlex
 import sys
 import time
 import logging
+
+import slurm_agent
+import slurm_array
+import slurm_status_daemon
 logger = logging.getLogger("__name__")
 
 STATUS_ATTEMPTS = 20
 
 jobid = sys.argv[1]
 
-for i in range(STATUS_ATTEMPTS):
+# Jobs handed to the submission agent, or gathered in job arrays, are known
+# by a placeholder until they are submitted
+for submitter in (slurm_agent, slurm_array):
+    if submitter.is_placeholder(jobid):
+        submitted_id = submitter.resolve(jobid)
+        if submitted_id is None:
+            print("running")
+            exit(0)
+        elif submitted_id == "":
+            print("failed")
+            exit(0)
+        jobid = submitted_id
+
+# Most jobs are answered from the batched status cache (see
+# slurm_status_daemon.py); unknown jobs and stale caches fall back
+# to a direct query.
+try:
+    cached = slurm_status_daemon.cached_status(jobid)
+except OSError as e:
+    logger.error("status cache error")
+    logger.error(e)
+    cached = None
+res = {jobid: cached} if cached is not None else None
+
+for i in range(STATUS_ATTEMPTS if res is None else 0):
     try:
         sacct_res = sp.check_output(shlex.split("sacct -P -b -j {} -n".format(jobid)))
         res = {x.split("|")[0]: x.split("|")[1] for x in sacct_res.decode().strip().split("\n")}
@@ -36,7 +64,8 @@ for i in range(STATUS_ATTEMPTS):
         else:
             time.sleep(1)
 
-status = res[jobid]
+# Pending array tasks may be reported under their array range
+status = res.get(jobid, next(iter(res.values())))
 
 if (status == "BOOT_FAIL"):
     print("failed")
@@ -7,6 +7,10 @@ import argparse
 import subprocess
 from snakemake.utils import read_job_properties
 
+import slurm_agent
+import slurm_status_daemon
+import slurm_topology
+
 
 ##############################
 # Helper functions
@@ -15,47 +19,19 @@ def _get_default_partition():
     """Retrieve default partition for cluster"""
     if "shortq":
         return "shortq"
-    cmd = "sinfo -O \"partition\""
-    res = subprocess.run(cmd, check=True, shell=True,
-                         stdout=subprocess.PIPE)
-    m = re.search("(?P<partition>\S+)\*", res.stdout.decode(), re.M)
-    partition = m.group("partition")
-    return partition
+    return slurm_topology.get_default_partition()
 
 
 def _get_cluster_configuration(partition):
-    """Retrieve cluster configuration for a partition."""
-    # Retrieve partition info; we tacitly assume we only get one response
-    cmd = " ".join(
-        ["sinfo -e -O \"partition,cpus,memory,time,size,maxcpuspernode\"",
-         "-h -p {}".format(partition)])
-    res = subprocess.run(cmd, check=True, shell=True, stdout=subprocess.PIPE)
-    m = re.search("(?P<partition>\S+)\s+(?P<cpus>\d+)\s+(?P<memory>\S+)\s+((?P<days>\d+)-)?(?P<hours>\d+):(?P<minutes>\d+):(?P<seconds>\d+)\s+(?P<size>\S+)\s+(?P<maxcpus>\S+)",
-                  res.stdout.decode())
-    d = m.groupdict()
-    if not 'days' in d or not d['days']:
-        d['days'] = 0
-    d["time"] = int(d['days']) * 24 * 60 + \
-        int(d['hours']) * 60 + int(d['minutes']) + \
-        math.ceil(int(d['seconds']) / 60)
-    return d
+    """Retrieve cluster configuration for a partition, from the cached
+    cluster topology (see slurm_topology.py)."""
+    return slurm_topology.get_cluster_configuration(partition)
 
 
 def _get_features_and_memory(partition):
     """Retrieve features and memory for a partition in the cluster
-    configuration. """
-    cmd = " ".join(
-        ["sinfo -e -O \"memory,features_act\"",
-         "-h -p {}".format(partition)])
-    res = subprocess.run(cmd, check=True, shell=True, stdout=subprocess.PIPE)
-    mem_feat = []
-    for x in res.stdout.decode().split("\n"):
-        if not re.search("^\d+", x):
-            continue
-        m = re.search("^(?P<mem>\d+)\s+(?P<feat>\S+)", x)
-        mem_feat.append({'mem': m.groupdict()["mem"],
-                         'features': m.groupdict()["feat"].split(",")})
-    return mem_feat
+    configuration, from the cached cluster topology. """
+    return slurm_topology.get_features_and_memory(partition)
 
 
 def _get_available_memory(mem_feat, constraints=None):
@@ -267,6 +243,11 @@ if arg_dict["wrap"] is not None:
 else:
     cmd = "sbatch {opts} {extras}".format(opts=opts, extras=extras)
 
+# Submissions are handed to the asynchronous agent (see slurm_agent.py)
+if slurm_agent.enabled():
+    print(slurm_agent.enqueue(cmd))
+    sys.exit(0)
+
 try:
     res = subprocess.run(cmd, check=True, shell=True, stdout=subprocess.PIPE)
 except subprocess.CalledProcessError as e:
@@ -281,3 +262,9 @@ try:
 except Exception as e:
     print(e)
     raise
+
+# Let the batched status service poll this job
+try:
+    slurm_status_daemon.register(jobid)
+except OSError as e:
+    print(e, file=sys.stderr)
@@ -7,6 +7,10 @@ import subprocess
 
 from snakemake.utils import read_job_properties
 
+import slurm_array
+import slurm_agent
+import slurm_status_daemon
+
 parser = argparse.ArgumentParser(add_help=False)
 parser.add_argument(
     "--help", help="Display help message.", action="store_true")
@@ -65,10 +69,14 @@ jobscript = sys.argv[-1]
 job_properties = read_job_properties(jobscript)
 
 extras = ""
+# Extra sbatch arguments, without the jobscript, for job arrays
+array_extras = ""
 if args.positional:
     for m in args.positional:
         if m is not None:
             extras = extras + " " + m
+            if m != jobscript:
+                array_extras = array_extras + " " + m
 
 arg_dict = dict(args.__dict__)
 
@@ -133,11 +141,23 @@ for k, v in arg_dict.items():
     if v is not None:
         opts += " --{} \"{}\" ".format(k.replace("_", "-"), v)
 
+# Jobs of the same rule, with the same resources, are gathered in job arrays
+if (slurm_array.enabled() and "rule" in job_properties
+        and arg_dict["wrap"] is None and arg_dict["array"] is None):
+    print(slurm_array.spool(jobscript, job_properties["rule"],
+                            opts + array_extras))
+    sys.exit(0)
+
 if arg_dict["wrap"] is not None:
     cmd = "sbatch {opts}".format(opts=opts)
 else:
     cmd = "sbatch {opts} {extras}".format(opts=opts, extras=extras)
 
+# Submissions are handed to the asynchronous agent (see slurm_agent.py)
+if slurm_agent.enabled():
+    print(slurm_agent.enqueue(cmd))
+    sys.exit(0)
+
 try:
     res = subprocess.run(cmd, check=True, shell=True, stdout=subprocess.PIPE)
 except subprocess.CalledProcessError as e:
@@ -152,3 +172,9 @@ try:
 except Exception as e:
     print(e)
     raise
+
+# Let the batched status service poll this job
+try:
+    slurm_status_daemon.register(jobid)
+except OSError as e:
+    print(e, file=sys.stderr)
@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+Asynchronous SLURM submission agent with adaptive rate control.
+
+slurm-submit.py does not call sbatch itself: it hands the sbatch command to
+this agent and returns a placeholder identifier immediately, so Snakemake
+never blocks on the SLURM controller. A single background agent submits the
+queued commands with a few concurrent workers, maps each placeholder to its
+job identifier, and registers it to the batched status service.
+
+All sbatch calls (queued jobs and job arrays) share one rate controller
+(AIMD, as TCP congestion control): the submission rate grows by a constant
+step after each fast and successful call, and is halved when the controller
+answers slowly or fails. Failed calls are retried.
+
+Environment variables:
+    SLURM_AGENT             Set to 0 to call sbatch synchronously (default: 1)
+    SLURM_AGENT_DIR         State directory (default: .snakemake/slurm-agent)
+    SLURM_AGENT_RATE        Initial submission rate, per second (default: 10)
+    SLURM_AGENT_MIN_RATE    Lowest submission rate, per second (default: 0.2)
+    SLURM_AGENT_MAX_RATE    Highest submission rate, per second (default: 50)
+    SLURM_AGENT_LATENCY     sbatch latency above which the rate is halved,
+                            in seconds (default: 2)
+    SLURM_AGENT_WORKERS     Number of concurrent sbatch calls (default: 4)
+    SLURM_AGENT_IDLE        Stop the agent after this many idle seconds
+                            (default: 30)
+    SLURM_AGENT_TIMEOUT     Report a queued job as failed when it was not
+                            submitted after this many seconds, or when no
+                            agent serves the queue anymore (default: 3600)
+
+Usage:
+    slurm_agent.py --agent
+    slurm_agent.py --benchmark 50 --latency 0.5
+
+You can test this module with:
+pytest -vv slurm_agent.py
+"""
+import argparse
+import concurrent.futures
+import fcntl
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+from typing import Any, Dict, Optional
+
+PREFIX = "agent-"
+ATTEMPTS = 3
+# Delay for a new agent to take its lock
+GRACE = 60
+
+
+def _state_dir() -> str:
+    return os.environ.get("SLURM_AGENT_DIR",
+                          os.path.join(".snakemake", "slurm-agent"))
+
+
+def _env(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+
+def enabled() -> bool:
+    return os.environ.get("SLURM_AGENT", "1") != "0"
+
+
+def _write_json(path: str, data: Dict[str, Any]) -> None:
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "w") as stream:
+        json.dump(data, stream)
+    os.replace(tmp_path, path)
+
+
+##############################
+# Rate control
+##############################
+class RateController:
+    """Additive increase, multiplicative decrease of the sbatch rate,
+    shared by all processes through a locked JSON file"""
+
+    def __init__(self, state_dir: Optional[str] = None) -> None:
+        self.state_dir = state_dir or _state_dir()
+        os.makedirs(self.state_dir, exist_ok=True)
+        self.path = os.path.join(self.state_dir, "rate.json")
+        self.min_rate = _env("SLURM_AGENT_MIN_RATE", 0.2)
+        self.max_rate = _env("SLURM_AGENT_MAX_RATE", 50)
+        self.latency = _env("SLURM_AGENT_LATENCY", 2)
+        self.step = 1
+
+    def _update(self, update) -> Any:
+        with open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.path) as stream:
+                    state = json.load(stream)
+            except (OSError, ValueError):
+                state = {"rate": _env("SLURM_AGENT_RATE", 10), "next": 0,
+                         "calls": 0, "errors": 0, "slow": 0}
+            result = update(state)
+            _write_json(self.path, state)
+            return result
+
+    def state(self) -> Dict[str, Any]:
+        return self._update(dict)
+
+    def reserve(self) -> float:
+        """Book the next submission slot, return the delay until then"""
+        def update(state):
+            now = time.time()
+            start = max(now, state["next"])
+            state["next"] = start + 1 / state["rate"]
+            return start - now
+        return self._update(update)
+
+    def feedback(self, latency: float, success: bool) -> None:
+        """Adapt the rate to the last sbatch call"""
+        def update(state):
+            state["calls"] += 1
+            if not success:
+                state["errors"] += 1
+            elif latency > self.latency:
+                state["slow"] += 1
+            if success and latency <= self.latency:
+                state["rate"] = min(self.max_rate, state["rate"] + self.step)
+            else:
+                state["rate"] = max(self.min_rate, state["rate"] / 2)
+        self._update(update)
+
+
+def run_sbatch(cmd: str,
+               cwd: Optional[str] = None,
+               state_dir: Optional[str] = None,
+               attempts: int = ATTEMPTS) -> str:
+    """Call sbatch at the pace of the rate controller, return the job id"""
+    controller = RateController(state_dir)
+    for attempt in range(attempts):
+        time.sleep(controller.reserve())
+        start = time.time()
+        res = subprocess.run(cmd, shell=True, cwd=cwd,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        m = re.search(r"Submitted batch job (\d+)", res.stdout.decode())
+        controller.feedback(time.time() - start,
+                            res.returncode == 0 and m is not None)
+        if res.returncode == 0 and m is not None:
+            return m.group(1)
+    raise subprocess.CalledProcessError(res.returncode, cmd, res.stdout,
+                                        res.stderr)
+
+
+##############################
+# Submission side
+##############################
+def enqueue(cmd: str,
+            state_dir: Optional[str] = None,
+            start: bool = True) -> str:
+    """Queue an sbatch command and return its placeholder id"""
+    state_dir = state_dir or _state_dir()
+    os.makedirs(os.path.join(state_dir, "queue"), exist_ok=True)
+    os.makedirs(os.path.join(state_dir, "map"), exist_ok=True)
+
+    placeholder = "{}{}-{}".format(PREFIX, os.getpid(), time.time_ns())
+    _write_json(os.path.join(state_dir, "queue", placeholder + ".json"),
+                {"cmd": cmd, "cwd": os.getcwd(), "queued": time.time()})
+    if start and not agent_running(state_dir):
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--agent",
+             "--state-dir", state_dir],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    return placeholder
+
+
+##############################
+# Agent side
+##############################
+def _submit(state_dir: str, placeholder: str, register: bool) -> None:
+    path = os.path.join(state_dir, "queue", placeholder + ".json")
+    with open(path) as stream:
+        queued = json.load(stream)
+    try:
+        jobid = run_sbatch(queued["cmd"], queued["cwd"], state_dir)
+        result = {"jobid": jobid, "submitted": time.time()}
+    except Exception as e:
+        # Any error must be reported, or the job would wait forever
+        print(e, file=sys.stderr)
+        jobid, result = None, {"jobid": None, "error": str(e)}
+    _write_json(os.path.join(state_dir, "map", placeholder), result)
+    os.remove(path)
+
+    if register and jobid is not None:
+        try:
+            import slurm_status_daemon
+            slurm_status_daemon.register(jobid)
+        except (ImportError, OSError) as e:
+            print(e, file=sys.stderr)
+
+
+def _serve(state_dir: str, idle: float, workers: int,
+           register: bool) -> None:
+    queue_dir = os.path.join(state_dir, "queue")
+    in_flight = {}
+    last_activity = time.time()
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        while True:
+            for name in sorted(os.listdir(queue_dir)):
+                placeholder = name[:-len(".json")]
+                if name.endswith(".json") and placeholder not in in_flight:
+                    in_flight[placeholder] = pool.submit(
+                        _submit, state_dir, placeholder, register
+                    )
+            for placeholder, future in list(in_flight.items()):
+                if future.done():
+                    del in_flight[placeholder]
+            if in_flight:
+                last_activity = time.time()
+            elif time.time() - last_activity >= idle:
+                return
+            time.sleep(0.05)
+
+
+def run_agent(state_dir: Optional[str] = None,
+              idle: Optional[float] = None,
+              workers: Optional[int] = None,
+              register: bool = True) -> None:
+    """Submit queued commands until the queue stayed empty for `idle`
+    seconds"""
+    state_dir = state_dir or _state_dir()
+    idle = _env("SLURM_AGENT_IDLE", 30) if idle is None else idle
+    workers = workers or int(_env("SLURM_AGENT_WORKERS", 4))
+    os.makedirs(os.path.join(state_dir, "queue"), exist_ok=True)
+    os.makedirs(os.path.join(state_dir, "map"), exist_ok=True)
+    while True:
+        with open(os.path.join(state_dir, "agent.lock"), "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # Another agent serves this run
+                return
+            _serve(state_dir, idle, workers, register)
+        # A command may have been queued while this agent was stopping
+        if not os.listdir(os.path.join(state_dir, "queue")):
+            return
+
+
+def agent_running(state_dir: str) -> bool:
+    try:
+        with open(os.path.join(state_dir, "agent.lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            fcntl.flock(lock, fcntl.LOCK_UN)
+        return False
+    except OSError:
+        return True
+
+
+##############################
+# Status side
+##############################
+def is_placeholder(jobid: str) -> bool:
+    return jobid.startswith(PREFIX)
+
+
+def age(placeholder: str) -> float:
+    """Return the number of seconds since a placeholder was given"""
+    return time.time() - int(placeholder.rsplit("-", 1)[-1]) / 1e9
+
+
+def resolve(placeholder: str,
+            state_dir: Optional[str] = None,
+            timeout: Optional[float] = None) -> Optional[str]:
+    """Return the job id of a placeholder, None while it is still queued.
+    A failed submission is reported as an empty string, as a job still
+    queued after `timeout` seconds, or once no agent serves the queue."""
+    state_dir = state_dir or _state_dir()
+    timeout = _env("SLURM_AGENT_TIMEOUT", 3600) if timeout is None \
+        else timeout
+    try:
+        with open(os.path.join(state_dir, "map", placeholder)) as stream:
+            return json.load(stream)["jobid"] or ""
+    except (OSError, ValueError):
+        pass
+    elapsed = age(placeholder)
+    if elapsed > timeout or (elapsed > GRACE
+                             and not agent_running(state_dir)):
+        return ""
+    return None
+
+
+##############################
+# Benchmark
+##############################
+def _fake_sbatch(directory: str, latency: float, fail: bool = False) -> str:
+    """Write a fake sbatch executable answering after `latency` seconds"""
+    path = os.path.join(directory, "sbatch")
+    with open(path, "w") as stream:
+        stream.write(
+            "#!/bin/sh\n"
+            "sleep {latency}\n"
+            "{fail}"
+            "echo \"Submitted batch job $(date +%s%N)\"\n".format(
+                latency=latency, fail="exit 1\n" if fail else ""
+            )
+        )
+    os.chmod(path, 0o755)
+    return path
+
+
+def benchmark(jobs: int,
+              latency: float,
+              directory: str,
+              jobs_per_second: float = 1) -> Dict[str, Any]:
+    """Submit `jobs` jobs to a fake sbatch, first as Snakemake does without
+    the agent (blocking calls, at most `jobs_per_second`), then through
+    the agent. Report how long Snakemake is blocked, and the time needed to
+    submit all jobs."""
+    sbatch = _fake_sbatch(directory, latency)
+    report = {"jobs": jobs, "latency_s": latency}
+
+    start = time.time()
+    for _ in range(jobs):
+        call = time.time()
+        subprocess.run(sbatch, check=True, stdout=subprocess.PIPE)
+        time.sleep(max(0, 1 / jobs_per_second - (time.time() - call)))
+    elapsed = time.time() - start
+    report["blocking"] = {"total_s": elapsed, "blocked_s": elapsed,
+                          "jobs_per_second": jobs / elapsed}
+
+    state_dir = os.path.join(directory, "agent")
+    start = time.time()
+    placeholders = [enqueue(sbatch, state_dir, start=False)
+                    for _ in range(jobs)]
+    blocked = time.time() - start
+    run_agent(state_dir, idle=0, register=False)
+    elapsed = time.time() - start
+    assert all(resolve(p, state_dir) for p in placeholders)
+    report["agent"] = {"total_s": elapsed, "blocked_s": blocked,
+                       "jobs_per_second": jobs / elapsed,
+                       "final_rate": RateController(state_dir).state()["rate"]}
+    return report
+
+
+##############################
+# Tests
+##############################
+def test_rate_controller(tmp_path) -> None:
+    controller = RateController(str(tmp_path))
+    rate = controller.state()["rate"]
+    controller.feedback(0.1, True)
+    assert controller.state()["rate"] == rate + 1
+    controller.feedback(0.1, False)
+    assert controller.state()["rate"] == (rate + 1) / 2
+    controller.feedback(controller.latency + 1, True)
+    assert controller.state()["rate"] == (rate + 1) / 4
+    assert controller.state()["errors"] == 1
+    assert controller.state()["slow"] == 1
+
+
+def test_reserve_spaces_calls(tmp_path) -> None:
+    controller = RateController(str(tmp_path))
+    controller.reserve()
+    delay = controller.reserve()
+    assert 0 < delay <= 1 / controller.state()["rate"]
+
+
+def test_enqueue_and_resolve(tmp_path) -> None:
+    state_dir = str(tmp_path / "agent")
+    sbatch = _fake_sbatch(str(tmp_path), 0)
+    placeholders = [enqueue(sbatch, state_dir, start=False)
+                    for _ in range(3)]
+    assert all(map(is_placeholder, placeholders))
+    assert resolve(placeholders[0], state_dir) is None
+
+    run_agent(state_dir, idle=0, register=False)
+    jobids = [resolve(p, state_dir) for p in placeholders]
+    assert all(jobid.isdigit() for jobid in jobids)
+    assert len(set(jobids)) == 3
+    assert os.listdir(os.path.join(state_dir, "queue")) == []
+
+
+def test_failed_submission(tmp_path) -> None:
+    state_dir = str(tmp_path / "agent")
+    sbatch = _fake_sbatch(str(tmp_path), 0, fail=True)
+    placeholder = enqueue(sbatch, state_dir, start=False)
+    run_agent(state_dir, idle=0, register=False)
+    assert resolve(placeholder, state_dir) == ""
+    assert RateController(state_dir).state()["errors"] == ATTEMPTS
+
+
+def test_resolve_timeout(tmp_path) -> None:
+    state_dir = str(tmp_path / "agent")
+    placeholder = enqueue("true", state_dir, start=False)
+    assert 0 <= age(placeholder) < GRACE
+    assert resolve(placeholder, state_dir) is None
+    assert resolve(placeholder, state_dir, timeout=-1) == ""
+
+    # Queued long ago, and no agent serves the queue anymore
+    old = "{}1-{}".format(PREFIX, time.time_ns() - int(2 * GRACE * 1e9))
+    assert resolve(old, state_dir) == ""
+
+
+def test_benchmark(tmp_path) -> None:
+    report = benchmark(4, 0.1, str(tmp_path), jobs_per_second=10)
+    assert report["agent"]["blocked_s"] < report["blocking"]["blocked_s"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--agent", action="store_true",
+                        help="Submit queued sbatch commands")
+    parser.add_argument("--state-dir", default=None,
+                        help="State directory")
+    parser.add_argument("--benchmark", type=int, default=None,
+                        help="Number of jobs submitted to a fake sbatch")
+    parser.add_argument("--latency", type=float, default=0.5,
+                        help="Latency of the fake sbatch, in seconds")
+    args = parser.parse_args()
+    if args.agent:
+        run_agent(args.state_dir)
+    elif args.benchmark is not None:
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            print(json.dumps(benchmark(args.benchmark, args.latency, tmp),
+                             indent=2))
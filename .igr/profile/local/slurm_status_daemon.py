@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""
+Batched SLURM job status service.
+
+Submission scripts register each job identifier they obtain from sbatch.
+A single background process polls `sacct` for all registered jobs at once,
+and caches their states in a JSON file. slurm-status.py reads this cache
+instead of calling `sacct` once per job and per status check: N subprocess
+calls per poll become one.
+
+The daemon is started on demand by the first status query, and stops by
+itself once nobody queried it for a while (end of the Snakemake run).
+Finished jobs are dropped from the registry as soon as they are polled,
+and from the cached states SLURM_STATUS_IDLE seconds later.
+
+Environment variables:
+    SLURM_STATUS_DIR        State directory (default: .snakemake/slurm-status)
+    SLURM_STATUS_INTERVAL   Delay between two sacct polls, in seconds
+                            (default: 10)
+    SLURM_STATUS_IDLE       Stop the daemon after this many seconds without
+                            any status query (default: 600)
+    SLURM_SACCT             sacct executable (default: sacct)
+    SLURM_STATUS_MISSED     Number of polls a registered job may be missing
+                            from sacct before the status script queries SLURM
+                            itself (default: 3)
+
+You can test this module with:
+pytest -vv slurm_status_daemon.py
+"""
+import argparse
+import fcntl
+import json
+import logging
+import os
+import shlex
+import subprocess
+import sys
+import time
+
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATES = {"BOOT_FAIL", "CANCELLED", "COMPLETED", "DEADLINE",
+                   "FAILED", "NODE_FAIL", "OUT_OF_MEMORY", "PREEMPTED",
+                   "TIMEOUT"}
+SACCT_CHUNK = 500
+
+
+def _state_dir() -> str:
+    return os.environ.get("SLURM_STATUS_DIR",
+                          os.path.join(".snakemake", "slurm-status"))
+
+
+def _interval() -> float:
+    return float(os.environ.get("SLURM_STATUS_INTERVAL", 10))
+
+
+def _idle() -> float:
+    return float(os.environ.get("SLURM_STATUS_IDLE", 600))
+
+
+def _missed() -> int:
+    return int(os.environ.get("SLURM_STATUS_MISSED", 3))
+
+
+def _sacct() -> str:
+    return os.environ.get("SLURM_SACCT", "sacct")
+
+
+def _path(state_dir: str, name: str) -> str:
+    return os.path.join(state_dir, name)
+
+
+def is_terminal(state: str) -> bool:
+    """Return whether a job in this state will never change again"""
+    return state.split(" ")[0] in TERMINAL_STATES
+
+
+##############################
+# Submission side
+##############################
+def register(jobid: str, state_dir: Optional[str] = None) -> None:
+    """Add a job to the set of jobs polled by the daemon"""
+    state_dir = state_dir or _state_dir()
+    os.makedirs(state_dir, exist_ok=True)
+    # The lock keeps appends out of prune_registry's rewrites
+    with open(_path(state_dir, "jobids"), "a") as stream:
+        fcntl.flock(stream, fcntl.LOCK_EX)
+        stream.write("{}\n".format(jobid))
+
+
+def registered_jobs(state_dir: str) -> List[str]:
+    try:
+        with open(_path(state_dir, "jobids")) as stream:
+            return [line.strip() for line in stream if line.strip()]
+    except OSError:
+        return []
+
+
+def prune_registry(state_dir: str, finished: Iterable[str]) -> None:
+    """Remove finished jobs from the registry, in place"""
+    finished = set(finished)
+    try:
+        with open(_path(state_dir, "jobids"), "r+") as stream:
+            fcntl.flock(stream, fcntl.LOCK_EX)
+            jobids = [line.strip() for line in stream if line.strip()]
+            stream.seek(0)
+            stream.writelines("{}\n".format(jobid) for jobid in jobids
+                              if jobid not in finished)
+            stream.truncate()
+    except OSError:
+        pass
+
+
+##############################
+# Daemon side
+##############################
+def read_states(state_dir: str) -> Dict[str, object]:
+    try:
+        with open(_path(state_dir, "states.json")) as stream:
+            return json.load(stream)
+    except (OSError, ValueError):
+        return {"timestamp": 0, "states": {}, "missed": {}, "finished": {}}
+
+
+def write_states(state_dir: str,
+                 states: Dict[str, str],
+                 missed: Optional[Dict[str, int]] = None,
+                 finished: Optional[Dict[str, float]] = None) -> None:
+    tmp_path = _path(state_dir, "states.json.{}.tmp".format(os.getpid()))
+    with open(tmp_path, "w") as stream:
+        json.dump({"timestamp": time.time(), "states": states,
+                   "missed": missed or {}, "finished": finished or {}},
+                  stream)
+    os.replace(tmp_path, _path(state_dir, "states.json"))
+
+
+def parse_sacct(sacct_output: str) -> Dict[str, str]:
+    """Parse `sacct -P -b -n` output, ignoring job steps"""
+    states = {}
+    for line in sacct_output.strip().split("\n"):
+        fields = line.split("|")
+        if len(fields) < 2 or "." in fields[0]:
+            continue
+        states[fields[0]] = fields[1]
+    return states
+
+
+def query_sacct(jobids: Iterable[str],
+                sacct: Optional[str] = None) -> Dict[str, str]:
+    """Retrieve the states of all given jobs, with one sacct call per
+    chunk of SACCT_CHUNK jobs"""
+    jobids = list(jobids)
+    states = {}
+    for start in range(0, len(jobids), SACCT_CHUNK):
+        cmd = "{} -P -b -n -j {}".format(
+            sacct or _sacct(), ",".join(jobids[start:start + SACCT_CHUNK])
+        )
+        res = subprocess.check_output(shlex.split(cmd))
+        states.update(parse_sacct(res.decode()))
+    return states
+
+
+def poll_once(state_dir: str,
+              sacct: Optional[str] = None,
+              idle: Optional[float] = None) -> Dict[str, str]:
+    """Refresh the cached states of all registered, unfinished, jobs.
+    Polls where sacct did not return a job are counted. Finished jobs
+    leave the registry, and their states are forgotten after `idle`
+    seconds, once Snakemake had the time to read them"""
+    idle = _idle() if idle is None else idle
+    cache = read_states(state_dir)
+    states = cache["states"]
+    missed = cache.get("missed", {})
+    finished = cache.get("finished", {})
+    pending = [jobid for jobid in registered_jobs(state_dir)
+               if not is_terminal(states.get(jobid, "PENDING"))]
+    if pending:
+        try:
+            polled = query_sacct(sorted(set(pending)), sacct)
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.error("sacct process error")
+            logger.error(e)
+            return states
+        states.update(polled)
+        for jobid in set(pending):
+            if jobid in polled:
+                missed.pop(jobid, None)
+            else:
+                missed[jobid] = missed.get(jobid, 0) + 1
+
+    now = time.time()
+    for jobid, state in list(states.items()):
+        if not is_terminal(state):
+            continue
+        if now - finished.setdefault(jobid, now) > idle:
+            for cached in (states, missed, finished):
+                cached.pop(jobid, None)
+    write_states(state_dir, states, missed, finished)
+    prune_registry(state_dir, finished)
+    return states
+
+
+def _last_query(state_dir: str) -> float:
+    try:
+        return os.path.getmtime(_path(state_dir, "heartbeat"))
+    except OSError:
+        return 0
+
+
+def run_daemon(state_dir: Optional[str] = None,
+               interval: Optional[float] = None,
+               idle: Optional[float] = None,
+               sacct: Optional[str] = None,
+               max_polls: Optional[int] = None) -> None:
+    """Poll sacct until no status was queried for `idle` seconds"""
+    state_dir = state_dir or _state_dir()
+    interval = _interval() if interval is None else interval
+    idle = _idle() if idle is None else idle
+    os.makedirs(state_dir, exist_ok=True)
+
+    with open(_path(state_dir, "daemon.lock"), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            # Another daemon already polls for this run
+            return
+
+        with open(_path(state_dir, "daemon.pid"), "w") as stream:
+            stream.write(str(os.getpid()))
+
+        polls = 0
+        try:
+            while max_polls is None or polls < max_polls:
+                poll_once(state_dir, sacct, idle)
+                polls += 1
+                if time.time() - _last_query(state_dir) > idle:
+                    break
+                time.sleep(interval)
+        finally:
+            try:
+                os.remove(_path(state_dir, "daemon.pid"))
+            except OSError:
+                pass
+
+
+def daemon_running(state_dir: str) -> bool:
+    try:
+        with open(_path(state_dir, "daemon.pid")) as stream:
+            os.kill(int(stream.read().strip()), 0)
+        return True
+    except (OSError, ValueError):
+        return False
+
+
+def start_daemon(state_dir: str) -> None:
+    """Start the polling process in background, detached from the caller"""
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--daemon",
+         "--state-dir", state_dir],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+##############################
+# Status query side
+##############################
+def cached_status(jobid: str,
+                  state_dir: Optional[str] = None,
+                  start: bool = True) -> Optional[str]:
+    """Return the cached state of a registered job.
+
+    Registered jobs which were not polled yet are reported as PENDING.
+    None is returned for unregistered jobs, for jobs sacct did not return
+    after SLURM_STATUS_MISSED polls, or when the daemon could not refresh
+    the cache recently: the caller should then query SLURM itself.
+    """
+    state_dir = state_dir or _state_dir()
+    if not os.path.isdir(state_dir):
+        return None
+
+    with open(_path(state_dir, "heartbeat"), "w"):
+        pass
+    if start and not daemon_running(state_dir):
+        start_daemon(state_dir)
+
+    cache = read_states(state_dir)
+    state = cache["states"].get(jobid)
+    if state is not None and is_terminal(state):
+        return state
+    if time.time() - cache["timestamp"] > 3 * _interval() + 30:
+        return None
+    if state is not None:
+        return state
+    if cache.get("missed", {}).get(jobid, 0) >= _missed():
+        return None
+    if jobid in registered_jobs(state_dir):
+        return "PENDING"
+    return None
+
+
+##############################
+# Tests
+##############################
+def _fake_sacct(tmp_path, states: Dict[str, str]) -> str:
+    """Write a fake sacct executable which logs each of its calls"""
+    (tmp_path / "sacct.out").write_text("".join(
+        "{jobid}|{state}|0:0\n{jobid}.batch|{state}|0:0\n".format(
+            jobid=jobid, state=state
+        )
+        for jobid, state in states.items()
+    ))
+    sacct = tmp_path / "sacct"
+    sacct.write_text(
+        "#!/bin/sh\n"
+        "echo \"$@\" >> {calls}\n"
+        "cat {out}\n".format(calls=tmp_path / "calls.txt",
+                             out=tmp_path / "sacct.out")
+    )
+    sacct.chmod(0o755)
+    return str(sacct)
+
+
+def _calls(tmp_path) -> List[str]:
+    calls = tmp_path / "calls.txt"
+    return calls.read_text().splitlines() if calls.exists() else []
+
+
+def test_parse_sacct() -> None:
+    assert parse_sacct("1|COMPLETED|0:0\n1.batch|COMPLETED|0:0\n"
+                       "2|CANCELLED by 0|0:0\n") == {
+        "1": "COMPLETED", "2": "CANCELLED by 0"
+    }
+
+
+def test_poll_once_single_query(tmp_path) -> None:
+    state_dir = str(tmp_path / "status")
+    sacct = _fake_sacct(tmp_path, {"1": "COMPLETED", "2": "RUNNING",
+                                   "3": "PENDING"})
+    for jobid in ["1", "2", "3"]:
+        register(jobid, state_dir)
+
+    assert poll_once(state_dir, sacct) == {
+        "1": "COMPLETED", "2": "RUNNING", "3": "PENDING"
+    }
+    assert _calls(tmp_path) == ["-P -b -n -j 1,2,3"]
+
+    # Finished jobs are not polled anymore
+    poll_once(state_dir, sacct)
+    assert _calls(tmp_path)[-1] == "-P -b -n -j 2,3"
+
+
+def test_poll_once_prune(tmp_path) -> None:
+    state_dir = str(tmp_path / "status")
+    sacct = _fake_sacct(tmp_path, {"1": "COMPLETED", "2": "RUNNING"})
+    for jobid in ["1", "2"]:
+        register(jobid, state_dir)
+
+    # Finished jobs leave the registry, but their state is still cached
+    poll_once(state_dir, sacct, idle=60)
+    assert registered_jobs(state_dir) == ["2"]
+    assert cached_status("1", state_dir, start=False) == "COMPLETED"
+
+    register("3", state_dir)
+    assert registered_jobs(state_dir) == ["2", "3"]
+
+    # ... until Snakemake had the time to read it
+    poll_once(state_dir, sacct, idle=-1)
+    assert read_states(state_dir)["states"] == {"2": "RUNNING"}
+    assert read_states(state_dir)["finished"] == {}
+    assert registered_jobs(state_dir) == ["2", "3"]
+
+
+def test_cached_status(tmp_path) -> None:
+    state_dir = str(tmp_path / "status")
+    assert cached_status("1", state_dir, start=False) is None
+
+    sacct = _fake_sacct(tmp_path, {"1": "COMPLETED"})
+    register("1", state_dir)
+    register("2", state_dir)
+    run_daemon(state_dir, interval=0, idle=60, sacct=sacct, max_polls=1)
+
+    assert cached_status("1", state_dir, start=False) == "COMPLETED"
+    assert cached_status("2", state_dir, start=False) == "PENDING"
+    assert cached_status("3", state_dir, start=False) is None
+    assert not daemon_running(state_dir)
+
+
+def test_cached_status_missed(tmp_path) -> None:
+    state_dir = str(tmp_path / "status")
+    sacct = _fake_sacct(tmp_path, {"1": "RUNNING"})
+    register("1", state_dir)
+    register("2", state_dir)
+    for _ in range(_missed() - 1):
+        poll_once(state_dir, sacct)
+    assert cached_status("2", state_dir, start=False) == "PENDING"
+
+    # Never returned by sacct: the caller falls back to scontrol
+    poll_once(state_dir, sacct)
+    assert cached_status("1", state_dir, start=False) == "RUNNING"
+    assert cached_status("2", state_dir, start=False) is None
+
+
+def test_cached_status_stale(tmp_path) -> None:
+    state_dir = str(tmp_path / "status")
+    register("1", state_dir)
+    with open(_path(state_dir, "states.json"), "w") as stream:
+        json.dump({"timestamp": 0, "states": {"1": "RUNNING"}}, stream)
+    assert cached_status("1", state_dir, start=False) is None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--daemon", action="store_true",
+                        help="Poll sacct for all registered jobs")
+    parser.add_argument("--state-dir", default=None,
+                        help="State directory")
+    args = parser.parse_args()
+    if args.daemon:
+        run_daemon(args.state_dir)
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Cached SLURM cluster topology.
+
+Partitions, CPUs, memory, time limits and features are retrieved with a
+single `sinfo` call, then cached in a local JSON file. Submissions read this
+file while it is younger than its time to live, so most of them never call
+`sinfo`. A lock file ensures only one submission refreshes the cache at a
+time.
+
+Environment variables:
+    SLURM_TOPOLOGY_CACHE    Path to the cache file
+                            (default: ~/.cache/snakemake/slurm-topology.json)
+    SLURM_TOPOLOGY_TTL      Cache time to live, in seconds (default: 3600)
+    SLURM_SINFO             sinfo executable (default: sinfo)
+
+You can test this module with:
+pytest -vv slurm_topology.py
+"""
+import fcntl
+import json
+import math
+import os
+import re
+import subprocess
+import time
+
+from typing import Any, Dict, List, Optional
+
+DEFAULT_CACHE = os.path.join(
+    os.path.expanduser("~"), ".cache", "snakemake", "slurm-topology.json"
+)
+DEFAULT_TTL = 3600
+SINFO_FIELDS = "partition,cpus,memory,time,size,maxcpuspernode,features_act"
+SINFO_REGEX = re.compile(
+    r"(?P<partition>\S+)\s+(?P<cpus>\d+)\s+(?P<memory>\d+)\S*\s+"
+    r"((?P<days>\d+)-)?(?P<hours>\d+):(?P<minutes>\d+):(?P<seconds>\d+)\s+"
+    r"(?P<size>\S+)\s+(?P<maxcpus>\S+)(\s+(?P<features>\S+))?"
+)
+
+
+def _cache_path() -> str:
+    return os.environ.get("SLURM_TOPOLOGY_CACHE", DEFAULT_CACHE)
+
+
+def _cache_ttl() -> float:
+    return float(os.environ.get("SLURM_TOPOLOGY_TTL", DEFAULT_TTL))
+
+
+def _sinfo() -> str:
+    return os.environ.get("SLURM_SINFO", "sinfo")
+
+
+def parse_topology(sinfo_output: str) -> Dict[str, Any]:
+    """Parse the output of `sinfo -e -h -O <SINFO_FIELDS>` into a
+    partition -> configuration mapping. The first line of each partition
+    provides its cpus and time limit, every line adds to its list of
+    memory and features."""
+    topology = {"default_partition": None, "partitions": {}}
+    for line in sinfo_output.split("\n"):
+        m = SINFO_REGEX.search(line)
+        if m is None:
+            continue
+        d = m.groupdict()
+        name = d["partition"]
+        if name.endswith("*"):
+            name = name[:-1]
+            topology["default_partition"] = name
+        if name not in topology["partitions"]:
+            days = int(d["days"]) if d["days"] else 0
+            topology["partitions"][name] = {
+                "partition": name,
+                "cpus": d["cpus"],
+                "memory": d["memory"],
+                "size": d["size"],
+                "maxcpus": d["maxcpus"],
+                "time": days * 24 * 60 + int(d["hours"]) * 60 +
+                int(d["minutes"]) + math.ceil(int(d["seconds"]) / 60),
+                "mem_feat": [],
+            }
+        features = d["features"] or "(null)"
+        topology["partitions"][name]["mem_feat"].append(
+            {"mem": d["memory"], "features": features.split(",")}
+        )
+    return topology
+
+
+def query_topology(sinfo: Optional[str] = None) -> Dict[str, Any]:
+    """Retrieve the whole cluster topology with a single sinfo call"""
+    cmd = "{} -e -h -O \"{}\"".format(sinfo or _sinfo(), SINFO_FIELDS)
+    res = subprocess.run(cmd, check=True, shell=True, stdout=subprocess.PIPE)
+    return parse_topology(res.stdout.decode())
+
+
+def _read_cache(cache_path: str, ttl: float) -> Optional[Dict[str, Any]]:
+    """Return cached topology if it exists and is fresh, None otherwise"""
+    try:
+        with open(cache_path) as stream:
+            cached = json.load(stream)
+    except (OSError, ValueError):
+        return None
+    if time.time() - cached.get("timestamp", 0) > ttl:
+        return None
+    return cached.get("topology")
+
+
+def load_topology(cache_path: Optional[str] = None,
+                  ttl: Optional[float] = None,
+                  sinfo: Optional[str] = None) -> Dict[str, Any]:
+    """Return the cluster topology, from cache when possible"""
+    cache_path = cache_path or _cache_path()
+    ttl = _cache_ttl() if ttl is None else ttl
+
+    topology = _read_cache(cache_path, ttl)
+    if topology is not None:
+        return topology
+
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    with open(cache_path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            # Another submission may have refreshed the cache while we
+            # were waiting for the lock
+            topology = _read_cache(cache_path, ttl)
+            if topology is not None:
+                return topology
+
+            topology = query_topology(sinfo)
+            tmp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+            with open(tmp_path, "w") as stream:
+                json.dump({"timestamp": time.time(), "topology": topology},
+                          stream)
+            os.replace(tmp_path, cache_path)
+            return topology
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _partition(partition: str,
+               cache_path: Optional[str] = None,
+               ttl: Optional[float] = None,
+               sinfo: Optional[str] = None) -> Dict[str, Any]:
+    topology = load_topology(cache_path, ttl, sinfo)
+    if partition not in topology["partitions"]:
+        # Partition may have been created after the last refresh
+        topology = load_topology(cache_path, 0, sinfo)
+    return topology["partitions"][partition]
+
+
+def get_default_partition(cache_path: Optional[str] = None,
+                          ttl: Optional[float] = None,
+                          sinfo: Optional[str] = None) -> Optional[str]:
+    """Retrieve default partition for cluster"""
+    return load_topology(cache_path, ttl, sinfo)["default_partition"]
+
+
+def get_cluster_configuration(partition: str,
+                              cache_path: Optional[str] = None,
+                              ttl: Optional[float] = None,
+                              sinfo: Optional[str] = None) -> Dict[str, Any]:
+    """Retrieve cluster configuration for a partition."""
+    config = _partition(partition, cache_path, ttl, sinfo)
+    return {k: v for k, v in config.items() if k != "mem_feat"}
+
+
+def get_features_and_memory(partition: str,
+                            cache_path: Optional[str] = None,
+                            ttl: Optional[float] = None,
+                            sinfo: Optional[str] = None
+                            ) -> List[Dict[str, Any]]:
+    """Retrieve features and memory for a partition in the cluster
+    configuration. """
+    return _partition(partition, cache_path, ttl, sinfo)["mem_feat"]
+
+
+##############################
+# Tests
+##############################
+FAKE_SINFO_OUTPUT = """shortq*             40                  190000              1-00:00:00          1-infinite          UNLIMITED           skylake,avx
+shortq*             40                  380000              1-00:00:00          1-infinite          UNLIMITED           bigmem
+longq               20                  90000+              7-00:00:00          1-infinite          UNLIMITED           (null)
+"""
+
+
+def _fake_sinfo(tmp_path) -> str:
+    """Write a fake sinfo executable which logs each of its calls"""
+    (tmp_path / "sinfo.out").write_text(FAKE_SINFO_OUTPUT)
+    sinfo = tmp_path / "sinfo"
+    sinfo.write_text(
+        "#!/bin/sh\n"
+        "echo \"$@\" >> {calls}\n"
+        "cat {out}\n".format(calls=tmp_path / "calls.txt",
+                             out=tmp_path / "sinfo.out")
+    )
+    sinfo.chmod(0o755)
+    return str(sinfo)
+
+
+def _calls(tmp_path) -> int:
+    calls = tmp_path / "calls.txt"
+    return len(calls.read_text().splitlines()) if calls.exists() else 0
+
+
+def test_parse_topology() -> None:
+    tested = parse_topology(FAKE_SINFO_OUTPUT)
+    assert tested["default_partition"] == "shortq"
+    assert tested["partitions"]["shortq"]["cpus"] == "40"
+    assert tested["partitions"]["shortq"]["time"] == 1440
+    assert tested["partitions"]["shortq"]["mem_feat"] == [
+        {"mem": "190000", "features": ["skylake", "avx"]},
+        {"mem": "380000", "features": ["bigmem"]},
+    ]
+    assert tested["partitions"]["longq"]["memory"] == "90000"
+    assert tested["partitions"]["longq"]["time"] == 10080
+
+
+def test_load_topology_uses_cache(tmp_path) -> None:
+    sinfo = _fake_sinfo(tmp_path)
+    cache = str(tmp_path / "cache" / "topology.json")
+    for _ in range(5):
+        config = get_cluster_configuration(
+            "shortq", cache_path=cache, ttl=60, sinfo=sinfo
+        )
+        mem_feat = get_features_and_memory(
+            "longq", cache_path=cache, ttl=60, sinfo=sinfo
+        )
+    assert _calls(tmp_path) == 1
+    assert config["cpus"] == "40"
+    assert "mem_feat" not in config
+    assert mem_feat == [{"mem": "90000", "features": ["(null)"]}]
+
+
+def test_load_topology_expired(tmp_path) -> None:
+    sinfo = _fake_sinfo(tmp_path)
+    cache = str(tmp_path / "topology.json")
+    load_topology(cache_path=cache, ttl=60, sinfo=sinfo)
+    load_topology(cache_path=cache, ttl=0, sinfo=sinfo)
+    assert _calls(tmp_path) == 2
+
+
+def test_unknown_partition_refreshes_cache(tmp_path) -> None:
+    sinfo = _fake_sinfo(tmp_path)
+    cache = str(tmp_path / "topology.json")
+    load_topology(cache_path=cache, ttl=60, sinfo=sinfo)
+    try:
+        get_cluster_configuration(
+            "gpuq", cache_path=cache, ttl=60, sinfo=sinfo
+        )
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("gpuq is not a partition of the fake cluster")
+    assert _calls(tmp_path) == 2
+
+
+def test_load_topology_corrupted_cache(tmp_path) -> None:
+    sinfo = _fake_sinfo(tmp_path)
+    cache = tmp_path / "topology.json"
+    cache.write_text("{not json")
+    assert get_default_partition(
+        cache_path=str(cache), ttl=60, sinfo=sinfo
+    ) == "shortq"
+    assert _calls(tmp_path) == 1
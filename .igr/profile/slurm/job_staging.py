@@ -0,0 +1,658 @@
+#!/usr/bin/env python3
+"""
+Node-local scratch staging for cluster jobs.
+
+When JOB_STAGING holds the path to this file, the jobscript hands the job
+command over to this module instead of running it in the project directory.
+The job's declared inputs are copied to a scratch directory below $TMPDIR,
+Snakemake runs the job with this scratch directory as working directory,
+and every file the job wrote (outputs, logs, benchmarks) is moved back to
+the project directory, one file at a time, through a temporary file and an
+atomic rename. Reading many small files from the node's local disk spares
+the metadata server of the shared file system.
+
+Only inputs given relatively to the working directory can be staged:
+absolute inputs (annotation, Salmon quantifications from the design, ...)
+are read in place. Salmon directories staged by the pipeline itself
+(see rule stage_salmon) are relative: rules declare their quant.sf, or a
+file below aux_info, but also read the files next to it (meta_info.json,
+lib_format_counts.json, bootstraps, ...), so the whole Salmon directory is
+staged. When inputs cannot be staged, e.g. when the local disk is full, the
+job runs in place.
+
+Configuration files are read from the project directory: the relocated job
+gets a copy of the configuration, saved in the scratch directory, where the
+relative paths to the design and the annotation are made absolute.
+
+The bytes and the time spent copying are saved next to the first log file
+of the job (`<log>.staging.json`), and the summary command reports, for
+each rule, the share of the job time spent staging.
+
+Environment variables:
+    JOB_STAGING         Path to this file, enables staging
+    JOB_STAGING_RULES   Comma separated list of rules to stage
+                        (default: all rules)
+    JOB_STAGING_DIR     Scratch directory (default: $TMPDIR, then /tmp)
+    JOB_STAGING_KEEP    Keep scratch directories after the job, for debug
+
+Usage:
+    job_staging.py run <jobscript> < job_command
+    job_staging.py summary [directory]
+
+You can test this module with:
+pytest -vv job_staging.py
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import yaml
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from job_profiler import read_properties
+
+# Command run by Snakemake once the job is over, to flag it as done
+FINISH_PATTERN = re.compile(r"\s+&&\s+touch\s+.*$", re.S)
+DIRECTORY_PATTERN = re.compile(r"--directory\s+('[^']*'|\"[^\"]*\"|\S+)")
+CD_PATTERN = re.compile(r"^\s*cd\s+('[^']*'|\"[^\"]*\"|\S+)\s+&&")
+CONFIGFILES_PATTERN = re.compile(
+    r"\s--configfiles?((?:\s+(?!-)(?:'[^']*'|\"[^\"]*\"|\S+))+)"
+)
+# Configuration keys holding paths relative to the working directory
+CONFIG_PATHS = [("design", ), ("ref", "gtf")]
+# Salmon files standing for their whole quantification directory
+SALMON_FILES = ["quant.sf", "quant.genes.sf"]
+SALMON_AUX = "aux_info"
+# Software deployment defaults to the working directory, and must not
+# be rebuilt in each scratch directory
+PREFIXES = {
+    "--use-conda": ("--conda-prefix", ".snakemake/conda"),
+    "--use-singularity": ("--singularity-prefix", ".snakemake/singularity"),
+}
+
+
+def _unquote(word: str) -> str:
+    return word[1:-1] if word[:1] in "'\"" and word[-1:] == word[:1] \
+        else word
+
+
+def enabled(rule: Optional[str]) -> bool:
+    """Return True if jobs of the given rule should be staged"""
+    rules = [
+        name.strip()
+        for name in os.environ.get("JOB_STAGING_RULES", "").split(",")
+        if name.strip()
+    ]
+    return not rules or rule in rules
+
+
+def staging_path(properties: Dict[str, Any]) -> str:
+    """Return the path of the staging record, next to the job's log"""
+    logs = properties.get("log") or []
+    if logs:
+        return "{}.staging.json".format(os.path.splitext(logs[0])[0])
+    return os.path.join("logs", "staging", "{}.{}.staging.json".format(
+        properties.get("rule", "job"), properties.get("jobid", os.getpid())
+    ))
+
+
+##############################
+# Command
+##############################
+def split_command(command: str) -> Tuple[str, str]:
+    """Split the job command from the commands flagging its completion"""
+    command = command.strip()
+    match = FINISH_PATTERN.search(command)
+    if match is None:
+        return command, ""
+    return command[:match.start()], match.group(0).strip()[2:].strip()
+
+
+def workdir(command: str) -> str:
+    """Return the working directory of a job command"""
+    match = DIRECTORY_PATTERN.search(command) or CD_PATTERN.search(command)
+    return os.path.abspath(_unquote(match.group(1))) if match \
+        else os.getcwd()
+
+
+def configfiles(command: str, origin: str) -> List[str]:
+    """Return the configuration files of a job command, as absolute paths
+
+    Without --configfiles, the pipeline loads config.yaml from the working
+    directory.
+    """
+    match = CONFIGFILES_PATTERN.search(command)
+    if match is None:
+        default = os.path.join(origin, "config.yaml")
+        return [default] if os.path.exists(default) else []
+    return [
+        os.path.join(origin, path) for path in shlex.split(match.group(1))
+    ]
+
+
+def _merge(config: Dict[str, Any], update: Dict[str, Any]
+           ) -> Dict[str, Any]:
+    for key, value in update.items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            _merge(config[key], value)
+        else:
+            config[key] = value
+    return config
+
+
+def relocate_config(paths: List[str], origin: str, destination: str
+                    ) -> Dict[str, Any]:
+    """Save the configuration with absolute paths to the destination"""
+    config = {}
+    for path in paths:
+        with open(path) as stream:
+            _merge(config, yaml.safe_load(stream) or {})
+
+    for keys in CONFIG_PATHS:
+        section = config
+        for key in keys[:-1]:
+            section = section.get(key)
+            if not isinstance(section, dict):
+                break
+        else:
+            path = section.get(keys[-1])
+            if isinstance(path, str) and path and not os.path.isabs(path):
+                section[keys[-1]] = os.path.normpath(
+                    os.path.join(origin, path)
+                )
+
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    with open(destination, "w") as stream:
+        yaml.safe_dump(config, stream, default_flow_style=False)
+    return config
+
+
+def relocate(command: str, scratch: str, origin: str) -> str:
+    """Run a job command in the scratch directory
+
+    The configuration files are replaced by a copy with absolute paths,
+    see relocate_config.
+    """
+    quoted = "'{}'".format(scratch)
+    if DIRECTORY_PATTERN.search(command):
+        command = DIRECTORY_PATTERN.sub(
+            lambda _: "--directory {}".format(quoted), command
+        )
+    else:
+        command += " --directory {}".format(quoted)
+
+    for flag, (option, default) in PREFIXES.items():
+        if flag in command.split() and option not in command:
+            command += " {} '{}'".format(
+                option, os.path.join(origin, default)
+            )
+
+    paths = configfiles(command, origin)
+    if paths:
+        config = os.path.join(scratch, ".snakemake", "staging", "config.yaml")
+        relocate_config(paths, origin, config)
+        option = " --configfiles '{}'".format(config)
+        if CONFIGFILES_PATTERN.search(command):
+            command = CONFIGFILES_PATTERN.sub(lambda _: option, command)
+        else:
+            command += option
+    return command
+
+
+##############################
+# Copies
+##############################
+def _size(path: str) -> int:
+    if os.path.isdir(path):
+        return sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(path) for name in names
+        )
+    return os.path.getsize(path)
+
+
+def salmon_directories(inputs: List[str]) -> List[str]:
+    """Replace Salmon files by their quantification directory
+
+    Relative inputs below another input directory are dropped.
+    """
+    paths = []
+    for path in inputs:
+        parts = os.path.normpath(path).split(os.sep)
+        if not os.path.isabs(path):
+            if SALMON_AUX in parts[:-1]:
+                parts = parts[:parts.index(SALMON_AUX)]
+            elif parts[-1] in SALMON_FILES and len(parts) > 1:
+                parts = parts[:-1]
+            path = os.path.join(*parts) if parts else path
+        if path not in paths:
+            paths.append(path)
+    return [
+        path for path in paths
+        if not any(path.startswith(other + os.sep) for other in paths)
+    ]
+
+
+def stage_in(inputs: List[str], origin: str, scratch: str
+             ) -> Dict[str, Any]:
+    """Copy relative inputs to the scratch directory
+
+    Salmon files are staged with their whole quantification directory, see
+    salmon_directories.
+    """
+    start = time.monotonic()
+    staged, in_place, size = [], [], 0
+    for path in salmon_directories(inputs):
+        if os.path.isabs(path) or os.path.normpath(path).startswith("..") \
+                or not os.path.exists(os.path.join(origin, path)):
+            in_place.append(path)
+            continue
+        source = os.path.join(origin, path)
+        destination = os.path.join(scratch, path)
+        os.makedirs(os.path.dirname(destination) or scratch, exist_ok=True)
+        if os.path.isdir(source):
+            shutil.copytree(source, destination, dirs_exist_ok=True)
+        else:
+            shutil.copy2(source, destination)
+        staged.append(path)
+        size += _size(source)
+    return {"staged": staged, "in_place": in_place, "bytes": size,
+            "seconds": round(time.monotonic() - start, 3)}
+
+
+def stage_out(scratch: str, origin: str, staged: List[str],
+              keep: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Move the files written by the job back to the working directory
+
+    Each file is copied next to its destination, then atomically renamed.
+    Staged inputs, and Snakemake's own metadata, are left behind. When
+    `keep` is given, only the files below these paths are moved back.
+    """
+    start = time.monotonic()
+    skipped = {os.path.normpath(path) for path in staged}
+    moved, size = [], 0
+    for root, directories, names in os.walk(scratch):
+        directories[:] = [
+            name for name in directories
+            if os.path.relpath(os.path.join(root, name), scratch)
+            not in skipped | {".snakemake"}
+        ]
+        for name in names:
+            path = os.path.relpath(os.path.join(root, name), scratch)
+            if path in skipped:
+                continue
+            if keep is not None and not any(
+                    path == prefix or path.startswith(prefix + os.sep)
+                    for prefix in map(os.path.normpath, keep)):
+                continue
+            destination = os.path.join(origin, path)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            temporary = "{}.staging.{}".format(destination, os.getpid())
+            shutil.copy2(os.path.join(root, name), temporary)
+            os.replace(temporary, destination)
+            moved.append(path)
+            size += os.path.getsize(destination)
+    return {"moved": sorted(moved), "bytes": size,
+            "seconds": round(time.monotonic() - start, 3)}
+
+
+def write_record(record: Dict[str, Any], path: str) -> None:
+    """Save a staging record, atomically"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temporary = "{}.{}".format(path, os.getpid())
+    with open(temporary, "w") as stream:
+        json.dump(record, stream, indent=2)
+    os.replace(temporary, path)
+
+
+##############################
+# Run
+##############################
+def run(properties: Dict[str, Any], command: str) -> int:
+    """Run a job command in a scratch directory, return its exit code"""
+    job, finish = split_command(command)
+    if not enabled(properties.get("rule")):
+        return subprocess.call(command, shell=True)
+
+    origin = workdir(job)
+    base = os.environ.get("JOB_STAGING_DIR") or tempfile.gettempdir()
+    scratch = tempfile.mkdtemp(prefix="{}.{}.".format(
+        properties.get("rule", "job"), properties.get("jobid", "")
+    ), dir=base)
+    record = {
+        key: properties.get(key) for key in ["rule", "jobid", "wildcards"]
+    }
+    record["scratch"] = scratch
+
+    try:
+        try:
+            record["stage_in"] = stage_in(
+                properties.get("input") or [], origin, scratch
+            )
+        except OSError as error:
+            # Not enough local space, unreadable input, ...: run in place
+            record["error"] = str(error)
+            write_record(record, os.path.join(
+                origin, staging_path(properties)
+            ))
+            return subprocess.call(command, shell=True)
+
+        start = time.monotonic()
+        code = subprocess.call(relocate(job, scratch, origin), shell=True)
+        record["job_seconds"] = round(time.monotonic() - start, 3)
+        record["exit_code"] = code
+
+        # Logs of failed jobs are kept, their outputs are not
+        record["stage_out"] = stage_out(
+            scratch, origin, record["stage_in"]["staged"],
+            keep=None if code == 0 else (properties.get("log") or [])
+        )
+    finally:
+        if not os.environ.get("JOB_STAGING_KEEP"):
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    write_record(record, os.path.join(origin, staging_path(properties)))
+    if finish:
+        return subprocess.call(
+            "(exit {}) && {}".format(code, finish), shell=True
+        )
+    return code
+
+
+##############################
+# Summary
+##############################
+def summarize(directory: str) -> Dict[str, Dict[str, float]]:
+    """Gather all staging records below a directory, per rule"""
+    rules = {}
+    pattern = os.path.join(directory, "**", "*.staging.json")
+    for path in sorted(glob.glob(pattern, recursive=True)):
+        try:
+            with open(path) as stream:
+                record = json.load(stream)
+        except (OSError, ValueError):
+            continue
+        rule = rules.setdefault(record.get("rule") or "unknown", {
+            "jobs": 0, "fallbacks": 0, "staged_mb": 0.0, "stage_s": 0.0,
+            "job_s": 0.0
+        })
+        rule["jobs"] += 1
+        if "error" in record:
+            rule["fallbacks"] += 1
+            continue
+        for step in ["stage_in", "stage_out"]:
+            rule["staged_mb"] += record.get(step, {}).get("bytes", 0) \
+                / 1024 ** 2
+            rule["stage_s"] += record.get(step, {}).get("seconds", 0)
+        rule["job_s"] += record.get("job_seconds", 0)
+    return rules
+
+
+def format_summary(rules: Dict[str, Dict[str, float]]) -> str:
+    """Return the staging cost of each rule, as TSV"""
+    lines = ["rule\tjobs\tfallbacks\tstaged_mb\tstage_s\tjob_s\t"
+             "stage_percent"]
+    for rule, total in sorted(rules.items()):
+        elapsed = total["stage_s"] + total["job_s"]
+        lines.append("{}\t{}\t{}\t{:.1f}\t{:.1f}\t{:.1f}\t{:.0f}".format(
+            rule, total["jobs"], total["fallbacks"], total["staged_mb"],
+            total["stage_s"], total["job_s"],
+            total["stage_s"] / elapsed * 100 if elapsed > 0 else 0
+        ))
+    return "\n".join(lines)
+
+
+##############################
+# Tests
+##############################
+def test_split_command() -> None:
+    command = ("cd /project && python -m snakemake --directory '/project' "
+               "&& touch '/project/.snakemake/tmp.a/1.jobfinished' || "
+               "(touch '/project/.snakemake/tmp.a/1.jobfailed'; exit 1)\n")
+    job, finish = split_command(command)
+    assert job == "cd /project && python -m snakemake --directory '/project'"
+    assert finish.startswith("touch '/project/.snakemake/tmp.a/1.jobfin")
+    assert finish.endswith("exit 1)")
+    assert split_command("python -m snakemake") == ("python -m snakemake", "")
+
+
+def test_relocate() -> None:
+    job = "cd /work && python -m snakemake --directory '/project' --use-conda"
+    assert workdir(job) == "/project"
+    assert workdir("cd /work && python -m snakemake") == "/work"
+    tested = relocate(job, "/tmp/scratch", "/project")
+    assert "--directory '/tmp/scratch'" in tested
+    assert "/project" not in tested.replace(
+        "--conda-prefix '/project/.snakemake/conda'", ""
+    )
+    assert relocate(
+        "python -m snakemake --use-conda --conda-prefix /envs", "/s", "/p"
+    ).count("--conda-prefix") == 1
+
+
+def test_relocate_config(tmp_path) -> None:
+    origin, scratch = tmp_path / "project", tmp_path / "scratch"
+    origin.mkdir()
+    (origin / "config.yaml").write_text(
+        "design: design.tsv\nref:\n  gtf: genome/annotation.gtf\n"
+    )
+    (origin / "extra.yaml").write_text("design: /data/design.tsv\n")
+    staged = str(scratch / ".snakemake" / "staging" / "config.yaml")
+
+    tested = relocate("python -m snakemake", str(scratch), str(origin))
+    assert tested.endswith("--configfiles '{}'".format(staged))
+    with open(staged) as stream:
+        config = yaml.safe_load(stream)
+    assert config == {"design": str(origin / "design.tsv"),
+                      "ref": {"gtf": str(origin / "genome/annotation.gtf")}}
+
+    tested = relocate(
+        "python -m snakemake --configfiles '{}' extra.yaml --force".format(
+            origin / "config.yaml"
+        ), str(scratch), str(origin)
+    )
+    assert tested.count("--configfiles") == 1
+    assert "--configfiles '{}' --force".format(staged) in tested
+    with open(staged) as stream:
+        assert yaml.safe_load(stream)["design"] == "/data/design.tsv"
+
+
+def test_relocate_snakefile(tmp_path) -> None:
+    import snakemake
+
+    # The pipeline's own Snakefile, copied since Snakemake 6+ refuses the
+    # between workflow cache of rule tx2gene, written for Snakemake 5
+    repository = os.path.abspath(os.path.join(
+        os.path.dirname(__file__), "..", "..", ".."
+    ))
+    pipeline = tmp_path / "pipeline"
+    for name in ["rules", "scripts", "schemas", "envs"]:
+        shutil.copytree(os.path.join(repository, name), pipeline / name)
+    shutil.copy(os.path.join(repository, "Snakefile"), pipeline)
+    if int(snakemake.__version__.split(".")[0]) > 5:
+        rules = pipeline / "rules" / "tximport.smk"
+        rules.write_text(rules.read_text().replace(
+            "    cache: True\n", ""
+        ))
+
+    origin, scratch = tmp_path / "project", tmp_path / "scratch"
+    origin.mkdir()
+    scratch.mkdir()
+    samples = os.path.join(repository, "test", "pseudo_mapping")
+    (origin / "design.tsv").write_text("".join(
+        ["Sample_id\tSalmon\tCondition\n"] + [
+            "{0}\t{1}\tC{2}\n".format(
+                sample, os.path.join(samples, sample), index % 2 + 1
+            ) for index, sample in enumerate(
+                ["a.chr21.1", "b.chr21.1", "c.chr21.1", "d.chr21.1"]
+            )
+        ]
+    ))
+    (origin / "annotation.gtf").write_text("")
+    with (origin / "config.yaml").open("w") as stream:
+        yaml.safe_dump({
+            "cold_storage": [" "],
+            "config": "config.yaml",
+            "design": "design.tsv",
+            "models": {"Condition_compairing_C1_vs_C2": {
+                "factor": "Condition", "numerator": "C1",
+                "denominator": "C2", "formula": "~Condition"
+            }},
+            "params": {
+                "copy_extra": "--verbose",
+                "tximport_extra": "type='salmon', ignoreTxVersion=TRUE"
+            },
+            "pipeline": {"deseq2": True},
+            "ref": {"gtf": "annotation.gtf"},
+            "threads": 1,
+            "thresholds": {"alpha_threshold": 0.05, "fc_threshold": 1.0},
+            "workdir": "."
+        }, stream)
+
+    job = (
+        "cd {0} && {1} -m snakemake genomes/annotation.gtf --snakefile "
+        "'{2}' --force --cores 1 --dry-run --directory '{0}'"
+    ).format(origin, sys.executable, pipeline / "Snakefile")
+    process = subprocess.run(
+        relocate(job, str(scratch), str(origin)), shell=True,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        universal_newlines=True
+    )
+    assert process.returncode == 0, process.stdout
+    assert "copy_extra" in process.stdout
+
+
+def test_enabled(monkeypatch) -> None:
+    monkeypatch.delenv("JOB_STAGING_RULES", raising=False)
+    assert enabled("deseq")
+    monkeypatch.setenv("JOB_STAGING_RULES", "tximport, deseq")
+    assert enabled("deseq")
+    assert not enabled("multiqc")
+
+
+def test_stage_in_and_out(tmp_path) -> None:
+    origin, scratch = tmp_path / "project", tmp_path / "scratch"
+    (origin / "salmon" / "S1").mkdir(parents=True)
+    (origin / "salmon" / "S1" / "quant.sf").write_text("Name\tNumReads\n")
+    (origin / "design.tsv").write_text("Sample_id\n")
+    scratch.mkdir()
+
+    staged = stage_in(
+        ["salmon/S1", "design.tsv", "/absolute/annotation.gtf", "../up.tsv"],
+        str(origin), str(scratch)
+    )
+    assert staged["staged"] == ["salmon/S1", "design.tsv"]
+    assert staged["in_place"] == ["/absolute/annotation.gtf", "../up.tsv"]
+    assert (scratch / "salmon" / "S1" / "quant.sf").exists()
+
+    (scratch / "deseq2").mkdir()
+    (scratch / "deseq2" / "dds.RDS").write_text("dds")
+    (scratch / "logs").mkdir()
+    (scratch / "logs" / "deseq.log").write_text("log")
+    (scratch / ".snakemake").mkdir()
+    (scratch / ".snakemake" / "metadata").write_text("")
+
+    moved = stage_out(str(scratch), str(origin), staged["staged"],
+                      keep=["logs/deseq.log"])
+    assert moved["moved"] == ["logs/deseq.log"]
+    moved = stage_out(str(scratch), str(origin), staged["staged"])
+    assert moved["moved"] == ["deseq2/dds.RDS", "logs/deseq.log"]
+    assert (origin / "deseq2" / "dds.RDS").read_text() == "dds"
+    assert not (origin / ".snakemake").exists()
+
+
+def test_salmon_directories() -> None:
+    assert salmon_directories([
+        "salmon/S1/quant.sf", "salmon/S1/aux_info/meta_info.json",
+        "salmon/S2/aux_info/bootstrap/bootstraps.gz", "/cold/S3/quant.sf",
+        "quant.sf", "tximport/tx_tab_gene.tsv", "salmon/S1/cmd_info.json"
+    ]) == [
+        "salmon/S1", "salmon/S2", "/cold/S3/quant.sf", "quant.sf",
+        "tximport/tx_tab_gene.tsv"
+    ]
+
+
+def test_stage_salmon_directory(tmp_path) -> None:
+    origin, scratch = tmp_path / "project", tmp_path / "scratch"
+    sample = origin / "salmon" / "S1"
+    (sample / "aux_info" / "bootstrap").mkdir(parents=True)
+    for name in ["quant.sf", "lib_format_counts.json", "cmd_info.json",
+                 "aux_info/meta_info.json", "aux_info/bootstrap/names.tsv"]:
+        (sample / name).write_text(name)
+    scratch.mkdir()
+
+    staged = stage_in(["salmon/S1/quant.sf"], str(origin), str(scratch))
+    assert staged["staged"] == ["salmon/S1"]
+    assert (scratch / "salmon" / "S1" / "aux_info" / "meta_info.json").exists()
+    assert (scratch / "salmon" / "S1" / "aux_info" / "bootstrap" /
+            "names.tsv").exists()
+    assert (scratch / "salmon" / "S1" / "lib_format_counts.json").exists()
+
+    (scratch / "qc.tsv").write_text("qc")
+    moved = stage_out(str(scratch), str(origin), staged["staged"])
+    assert moved["moved"] == ["qc.tsv"]
+
+
+def test_run_and_summary(tmp_path, monkeypatch) -> None:
+    origin = tmp_path / "project"
+    (origin / "counts").mkdir(parents=True)
+    (origin / "counts" / "in.tsv").write_text("1\n2\n")
+    monkeypatch.setenv("JOB_STAGING_DIR", str(tmp_path))
+    monkeypatch.delenv("JOB_STAGING_RULES", raising=False)
+    monkeypatch.delenv("JOB_STAGING_KEEP", raising=False)
+    # Stands for Snakemake: works in the directory given to --directory
+    job = tmp_path / "job.py"
+    job.write_text(
+        "import os, sys\n"
+        "os.chdir(sys.argv[sys.argv.index('--directory') + 1])\n"
+        "os.makedirs('out')\n"
+        "os.makedirs('logs')\n"
+        "open('out/copy.tsv', 'w').write(open('counts/in.tsv').read())\n"
+        "open('logs/job.log', 'w').write(os.getcwd())\n"
+    )
+    command = (
+        "cd {0} && {1} {2} --directory '{0}' && touch {3} || "
+        "(touch {4}; exit 1)"
+    ).format(origin, sys.executable, job, tmp_path / "done",
+             tmp_path / "failed")
+
+    properties = {"rule": "copy", "jobid": 1, "input": ["counts/in.tsv"],
+                  "log": ["logs/job.log"]}
+    assert run(properties, command) == 0
+    assert (origin / "out" / "copy.tsv").read_text() == "1\n2\n"
+    assert (tmp_path / "done").exists()
+    assert (origin / "logs" / "job.log").read_text().strip() != str(origin)
+
+    record = json.loads((origin / "logs" / "job.staging.json").read_text())
+    assert record["stage_in"]["bytes"] == 4
+    assert record["stage_out"]["moved"] == ["logs/job.log", "out/copy.tsv"]
+    assert not os.path.exists(record["scratch"])
+
+    rules = summarize(str(origin))
+    assert rules["copy"]["jobs"] == 1
+    assert format_summary(rules).splitlines()[1].startswith("copy\t1\t0\t")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    command, argv = sys.argv[1], sys.argv[2:]
+    if command == "run":
+        sys.exit(run(read_properties(argv[0]), sys.stdin.read()))
+    elif command == "summary":
+        parser = argparse.ArgumentParser(prog="summary")
+        parser.add_argument("directory", nargs="?", default="logs")
+        args = parser.parse_args(argv)
+        print(format_summary(summarize(args.directory)))
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+SLURM job-array submission for homogeneous jobs.
+
+Snakemake submits jobs one at a time, and waits for each submission to
+return a job identifier. Instead of calling sbatch, slurm-submit.py spools
+the job and returns a placeholder identifier immediately. Jobs from the same
+rule with the same sbatch options (the job signature) are gathered during a
+short window by a background flusher, then submitted as a single job array.
+
+Each placeholder is mapped to its array task identifier (`<jobid>_<index>`),
+which is used by slurm-status.py and registered to the batched status
+service. Each array task writes its own log files (`%A_%a`).
+
+Environment variables:
+    SLURM_ARRAY_WINDOW      Gathering window in seconds, job arrays are used
+                            when it is above 0 (default: 0)
+    SLURM_ARRAY_DIR         Spool directory (default: .snakemake/slurm-array)
+    SLURM_ARRAY_TIMEOUT     Report a spooled job as failed when its array was
+                            not submitted after this many seconds
+                            (default: 3600)
+    SLURM_ARRAY_MAX_SIZE    Maximum number of tasks per array (default: 1000)
+    SLURM_SBATCH            sbatch executable (default: sbatch)
+
+You can test this module with:
+pytest -vv slurm_array.py
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from typing import Dict, List, Optional
+
+import slurm_agent
+
+PREFIX = "array-"
+
+
+def _window() -> float:
+    return float(os.environ.get("SLURM_ARRAY_WINDOW", 0))
+
+
+def _spool_dir() -> str:
+    return os.environ.get("SLURM_ARRAY_DIR",
+                          os.path.join(".snakemake", "slurm-array"))
+
+
+def _max_size() -> int:
+    return int(os.environ.get("SLURM_ARRAY_MAX_SIZE", 1000))
+
+
+def _timeout() -> float:
+    return float(os.environ.get("SLURM_ARRAY_TIMEOUT", 3600))
+
+
+def _sbatch() -> str:
+    return os.environ.get("SLURM_SBATCH", "sbatch")
+
+
+def enabled() -> bool:
+    return _window() > 0
+
+
+def signature(rule: str, opts: str) -> str:
+    """Jobs sharing a rule and sbatch options can share a job array"""
+    return hashlib.sha1("{}\n{}".format(rule, opts).encode()).hexdigest()[:12]
+
+
+def _write_json(path: str, data: Dict) -> None:
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "w") as stream:
+        json.dump(data, stream)
+    os.replace(tmp_path, path)
+
+
+##############################
+# Submission side
+##############################
+def spool(jobscript: str,
+          rule: str,
+          opts: str,
+          spool_dir: Optional[str] = None,
+          start: bool = True) -> str:
+    """Spool a job for array submission and return its placeholder id"""
+    spool_dir = spool_dir or _spool_dir()
+    sig = signature(rule, opts)
+    jobs_dir = os.path.join(spool_dir, "jobs", sig)
+    os.makedirs(jobs_dir, exist_ok=True)
+    os.makedirs(os.path.join(spool_dir, "map"), exist_ok=True)
+
+    placeholder = "{}{}-{}-{}".format(PREFIX, sig, os.getpid(),
+                                      time.time_ns())
+    # Snakemake removes its jobscripts once the job is over: keep a copy
+    shutil.copy(jobscript, os.path.join(jobs_dir, placeholder + ".sh"))
+    _write_json(os.path.join(jobs_dir, placeholder + ".json"),
+                {"rule": rule, "opts": opts, "spooled": time.time()})
+
+    # The first job of a window starts the flusher of its signature
+    flag = os.path.join(spool_dir, "jobs", sig + ".flushing")
+    try:
+        os.close(os.open(flag, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return placeholder
+    if start:
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--flush", sig,
+             "--spool-dir", spool_dir],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    return placeholder
+
+
+##############################
+# Flusher side
+##############################
+def _driver(jobscripts: List[str]) -> str:
+    """Build the array script dispatching each task to its jobscript"""
+    cases = "".join(
+        "    {}) exec /bin/bash '{}' ;;\n".format(index, path)
+        for index, path in enumerate(jobscripts)
+    )
+    return (
+        "#!/bin/bash\n"
+        "case \"${{SLURM_ARRAY_TASK_ID}}\" in\n"
+        "{}"
+        "esac\n"
+        "echo \"Unknown array task ${{SLURM_ARRAY_TASK_ID}}\" >&2\n"
+        "exit 1\n"
+    ).format(cases)
+
+
+def submit_array(placeholders: List[str],
+                 batch_dir: str,
+                 rule: str,
+                 opts: str,
+                 sbatch: Optional[str] = None) -> str:
+    """Submit spooled jobscripts as a single job array, return its jobid"""
+    driver = os.path.join(batch_dir, "{}.driver.sh".format(placeholders[0]))
+    with open(driver, "w") as stream:
+        stream.write(_driver([
+            os.path.abspath(os.path.join(batch_dir, placeholder + ".sh"))
+            for placeholder in placeholders
+        ]))
+    # Each task writes its own log files
+    opts = opts.replace("%j", "%A_%a")
+    if "--job-name" not in opts:
+        opts += " --job-name \"{}\" ".format(rule)
+    cmd = "{} {} --array=0-{} {}".format(
+        sbatch or _sbatch(), opts, len(placeholders) - 1, driver
+    )
+    # Paced by the rate controller shared with the submission agent
+    return slurm_agent.run_sbatch(cmd)
+
+
+def flush(sig: str,
+          spool_dir: Optional[str] = None,
+          window: Optional[float] = None,
+          sbatch: Optional[str] = None,
+          register: bool = True) -> Dict[str, str]:
+    """Wait for the gathering window, then submit all jobs spooled with
+    this signature. Return the placeholder -> array task id mapping."""
+    spool_dir = spool_dir or _spool_dir()
+    time.sleep(_window() if window is None else window)
+
+    jobs_dir = os.path.join(spool_dir, "jobs", sig)
+    # Jobs spooled from now on belong to the next window
+    os.remove(os.path.join(spool_dir, "jobs", sig + ".flushing"))
+
+    batch_dir = os.path.join(spool_dir, "batches",
+                             "{}-{}".format(sig, time.time_ns()))
+    os.makedirs(batch_dir)
+    placeholders = []
+    for name in sorted(os.listdir(jobs_dir)):
+        if not name.endswith(".json"):
+            continue
+        placeholder = name[:-len(".json")]
+        for ext in (".sh", ".json"):
+            os.replace(os.path.join(jobs_dir, placeholder + ext),
+                       os.path.join(batch_dir, placeholder + ext))
+        placeholders.append(placeholder)
+
+    mapping = {}
+    max_size = _max_size()
+    for start in range(0, len(placeholders), max_size):
+        chunk = placeholders[start:start + max_size]
+        with open(os.path.join(batch_dir, chunk[0] + ".json")) as stream:
+            spooled = json.load(stream)
+        try:
+            jobid = submit_array(chunk, batch_dir, spooled["rule"],
+                                 spooled["opts"], sbatch)
+        except Exception as e:
+            # Any error must be reported, or the jobs would wait forever
+            print(e, file=sys.stderr)
+            for placeholder in chunk:
+                _write_json(os.path.join(spool_dir, "map", placeholder),
+                            {"jobid": None, "error": str(e)})
+            continue
+        for index, placeholder in enumerate(chunk):
+            mapping[placeholder] = "{}_{}".format(jobid, index)
+            _write_json(os.path.join(spool_dir, "map", placeholder),
+                        {"jobid": mapping[placeholder]})
+
+    if not register:
+        return mapping
+    try:
+        import slurm_status_daemon
+        for task_id in mapping.values():
+            slurm_status_daemon.register(task_id)
+    except (ImportError, OSError) as e:
+        print(e, file=sys.stderr)
+    return mapping
+
+
+##############################
+# Status side
+##############################
+def is_placeholder(jobid: str) -> bool:
+    return jobid.startswith(PREFIX)
+
+
+def resolve(placeholder: str,
+            spool_dir: Optional[str] = None,
+            timeout: Optional[float] = None) -> Optional[str]:
+    """Return the array task id of a placeholder, None while it is still
+    waiting for its array to be submitted. A failed array submission is
+    reported as an empty string, as a job still waiting after the
+    gathering window and `timeout` seconds (e.g. its flusher died)."""
+    spool_dir = spool_dir or _spool_dir()
+    timeout = _timeout() if timeout is None else timeout
+    try:
+        with open(os.path.join(spool_dir, "map", placeholder)) as stream:
+            return json.load(stream)["jobid"] or ""
+    except (OSError, ValueError):
+        pass
+    if slurm_agent.age(placeholder) > _window() + timeout:
+        return ""
+    return None
+
+
+##############################
+# Tests
+##############################
+def _fake_sbatch(tmp_path) -> str:
+    """Write a fake sbatch executable which logs each of its calls"""
+    sbatch = tmp_path / "sbatch"
+    sbatch.write_text(
+        "#!/bin/sh\n"
+        "echo \"$@\" >> {calls}\n"
+        "echo \"Submitted batch job $(wc -l < {calls})00\"\n".format(
+            calls=tmp_path / "calls.txt"
+        )
+    )
+    sbatch.chmod(0o755)
+    return str(sbatch)
+
+
+def _jobscript(tmp_path, name: str) -> str:
+    path = tmp_path / name
+    path.write_text("#!/bin/sh\n# properties = {}\necho " + name + "\n")
+    return str(path)
+
+
+def test_signature() -> None:
+    assert signature("pca", "--mem 1024") == signature("pca", "--mem 1024")
+    assert signature("pca", "--mem 1024") != signature("pca", "--mem 2048")
+    assert signature("pca", "--mem 1024") != signature("gsea", "--mem 1024")
+
+
+def test_spool_and_flush(tmp_path, monkeypatch) -> None:
+    monkeypatch.setenv("SLURM_AGENT_DIR", str(tmp_path / "agent"))
+    spool_dir = str(tmp_path / "spool")
+    sbatch = _fake_sbatch(tmp_path)
+    opts = " --output \"logs/slurm/slurm-%x-%j-%N.out\" --mem \"1024\" "
+    placeholders = [
+        spool(_jobscript(tmp_path, "job{}.sh".format(i)), "pca", opts,
+              spool_dir, start=False)
+        for i in range(3)
+    ]
+    other = spool(_jobscript(tmp_path, "other.sh"), "gsea", opts,
+                  spool_dir, start=False)
+    assert all(map(is_placeholder, placeholders + [other]))
+    assert resolve(placeholders[0], spool_dir) is None
+
+    mapping = flush(signature("pca", opts), spool_dir, window=0,
+                    sbatch=sbatch, register=False)
+    assert mapping == {
+        placeholder: "100_{}".format(index)
+        for index, placeholder in enumerate(placeholders)
+    }
+    assert resolve(placeholders[2], spool_dir) == "100_2"
+    assert resolve(other, spool_dir) is None
+
+    calls = (tmp_path / "calls.txt").read_text().splitlines()
+    assert len(calls) == 1
+    assert "--array=0-2" in calls[0]
+    assert "slurm-%x-%A_%a-%N.out" in calls[0]
+    assert "--job-name pca" in calls[0]
+
+    # A new window starts once the previous one was flushed
+    later = spool(_jobscript(tmp_path, "job4.sh"), "pca", opts,
+                  spool_dir, start=False)
+    assert flush(signature("pca", opts), spool_dir, window=0,
+                 sbatch=sbatch, register=False) == {later: "200_0"}
+
+
+def test_driver(tmp_path) -> None:
+    jobscripts = [_jobscript(tmp_path, "a.sh"), _jobscript(tmp_path, "b.sh")]
+    driver = tmp_path / "driver.sh"
+    driver.write_text(_driver(jobscripts))
+    res = subprocess.run(["bash", str(driver)], stdout=subprocess.PIPE,
+                         env=dict(os.environ, SLURM_ARRAY_TASK_ID="1"))
+    assert res.stdout.decode() == "b.sh\n"
+
+
+def test_failed_submission(tmp_path, monkeypatch) -> None:
+    monkeypatch.setenv("SLURM_AGENT_DIR", str(tmp_path / "agent"))
+    spool_dir = str(tmp_path / "spool")
+    placeholder = spool(_jobscript(tmp_path, "a.sh"), "pca", "", spool_dir,
+                        start=False)
+    assert flush(signature("pca", ""), spool_dir, window=0,
+                 sbatch="false", register=False) == {}
+    assert resolve(placeholder, spool_dir) == ""
+
+
+def test_resolve_timeout(tmp_path) -> None:
+    spool_dir = str(tmp_path / "spool")
+    placeholder = spool(_jobscript(tmp_path, "a.sh"), "pca", "", spool_dir,
+                        start=False)
+    assert resolve(placeholder, spool_dir) is None
+    assert resolve(placeholder, spool_dir, timeout=-1) == ""
+
+
+def test_disabled_by_default(monkeypatch) -> None:
+    monkeypatch.delenv("SLURM_ARRAY_WINDOW", raising=False)
+    assert not enabled()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--flush", required=True,
+                        help="Signature of the jobs to submit")
+    parser.add_argument("--spool-dir", default=None,
+                        help="Spool directory")
+    args = parser.parse_args()
+    flush(args.flush, args.spool_dir)
@@ -24,24 +24,26 @@ https://github.com/tdayris-perso/rna-dge-salmon-dese2/wiki/Pipeline_Content
 import argparse
 import os
 import logging
+import shlex
 import sys
+import time
 
+from contextlib import contextmanager
 from pathlib import Path
 from snakemake.utils import makedirs
-from snakemake.shell import shell
 import snakemake
-from typing import Any
+from typing import Any, Iterator
 
 try:
-    from scripts import prepare_config, prepare_design, common_script_rna_dge_salmon_deseq2
+    from scripts import prepare_config, prepare_design, common_script_rna_dge_salmon_deseq2, compare_benchmarks
 except ImportError:
     scripts_path = Path(os.path.realpath(__file__)).parent / "scripts"
     sys.path.append(str(scripts_path))
-    import prepare_config, prepare_design, common_script_rna_dge_salmon_deseq2
+    import prepare_config, prepare_design, common_script_rna_dge_salmon_deseq2, compare_benchmarks
 except ModuleNotFoundError:
     scripts_path = Path(os.path.realpath(__file__)).parent / "scripts"
     sys.path.append(str(scripts_path))
-    import prepare_config, prepare_design, common_script_rna_dge_salmon_deseq2
+    import prepare_config, prepare_design, common_script_rna_dge_salmon_deseq2, compare_benchmarks
 
 
 
@@ -160,6 +162,13 @@ def parser() -> argparse.ArgumentParser:
     )
     igr.set_defaults(func=igr_run)
 
+    benchmark_compare_parser = subparsers.add_parser(
+        "benchmark-compare",
+        parents=[compare_benchmarks.parser()],
+        add_help=False
+    )
+    benchmark_compare_parser.set_defaults(func=benchmark_compare)
+
     report_parser.set_defaults(func=report)
     return main_parser
 
@@ -216,7 +225,7 @@ def snakemake_run(cmd_line_args) -> None:
         use_cache=not cmd_line_args.no_cache
     )
 
-    run_cmd(*command)
+    run_snakemake(*command)
 
 
 def report(cmd_line_args) -> None:
@@ -230,70 +239,101 @@ def report(cmd_line_args) -> None:
         use_cache=not cmd_line_args.no_cache
     )
 
-    run_cmd(*command)
+    run_snakemake(*command)
+
+
+@contextmanager
+def timed_phase(name: str) -> Iterator[None]:
+    """
+    Log the wall time of a pipeline phase, and trace it as a span
+    """
+    start = time.time()
+    try:
+        with common_script_rna_dge_salmon_deseq2.span(f"phase:{name}"):
+            yield
+    finally:
+        elapsed = time.time() - start
+        logging.info("Phase '%s' took %.2f seconds", name, elapsed)
+        print(f"Phase '{name}' took {elapsed:.2f} seconds")
 
 
 def igr_run(cmd_line_args) -> None:
     """
     Call this pipeline whole pipeline with default arguments
+
+    All phases run within this process: no launcher, nor Python
+    interpreter, is started again for each of them.
     """
+    if not check_env():
+        print("Environment was not suitable for this pipeline to run.")
+        return
+
     config_path = "config.yaml"
     if not os.path.exists(config_path):
-        config_cmd = [
-            "python3",
-            os.getenv('DGE_LAUNCHER'),
-            "config",
-            os.getenv('GTF'),
-            "--models",
-            *cmd_line_args.models_to_analyse,
-            "--threads 20",
-            "--debug",
-            "--cold-storage /mnt/isilon /mnt/archivage",
-        ]
-        run_cmd(*config_cmd)
+        with timed_phase("config"):
+            prepare_config.main(prepare_config.parse([
+                os.getenv('GTF'),
+                "--models",
+                *cmd_line_args.models_to_analyse,
+                "--threads", "20",
+                "--debug",
+                "--cold-storage", "/mnt/isilon", "/mnt/archivage",
+            ]))
     else:
         print("config.yaml already exists, it was *not* overwritten.")
 
     design_path = "design.tsv"
     if not os.path.exists(design_path):
-        design_cmd = [
-            "python3",
-            os.getenv('DGE_LAUNCHER'),
-            "design",
-            cmd_line_args.salmon_dir,
-            "--import-design",
-            cmd_line_args.experimental_design,
-            "--debug"
-        ]
-        run_cmd(*design_cmd)
+        with timed_phase("design"):
+            prepare_design.main(prepare_design.parse([
+                cmd_line_args.salmon_dir,
+                "--import-design",
+                cmd_line_args.experimental_design,
+                "--debug"
+            ]))
     else:
         print("design.tsv already exists, it was *not* overwritten.")
 
-    snakemake_cmd = [
-        "python3",
-        os.getenv("DGE_LAUNCHER"),
-        "snakemake"
-    ]
-    run_cmd(*snakemake_cmd)
+    default_args = argparse.Namespace(
+        snakemake_args="", no_profile=False, no_cache=False
+    )
+    with timed_phase("snakemake"):
+        snakemake_run(default_args)
 
-    report_cmd = [
-        "python3",
-        os.getenv("DGE_LAUNCHER"),
-        "report"
-    ]
-    run_cmd(*report_cmd)
+    with timed_phase("report"):
+        report(default_args)
 
 
-def run_cmd(*cmd_line) -> None:
+def run_snakemake(*cmd_line) -> None:
     """
-    Run a provided command line
+    Run a provided snakemake command line through the Snakemake Python API,
+    within this process
     """
-    cmd_line = " ".join(cmd_line)
-    if check_env():
-        print(cmd_line)
-        shell(cmd_line)
-    else:
+    if not check_env():
         print("Environment was not suitable for this pipeline to run.")
+        return
+
+    print(" ".join(cmd_line))
+    # Leading "snakemake" is the program name, not an argument
+    argv = shlex.split(" ".join(cmd_line[1:]))
+    try:
+        snakemake.main(argv)
+    except SystemExit as exit_status:
+        if exit_status.code not in (0, None):
+            raise RuntimeError(
+                f"Snakemake exited with status {exit_status.code}"
+            )
+
+
+def benchmark_compare(cmd_line_args) -> None:
+    """
+    Compare benchmarks against a baseline, exit with a non-zero status
+    on regression
+    """
+    regressions = compare_benchmarks.main(cmd_line_args)
+    if regressions > 0:
+        print(f"{regressions} benchmark(s) regressed beyond tolerance")
+        sys.exit(1)
 
 
 def check_env() -> bool:
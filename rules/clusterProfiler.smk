@@ -22,6 +22,8 @@ checkpoint gene_list:
         fc_threshold = config["thresholds"].get("fc_threshold", 1)
     log:
         "logs/gene_list/{design}.log"
+    benchmark:
+        "benchmarks/gene_list/{design}.tsv"
     wrapper:
         f"{git}/bio/clusterProfiler/DESeq2_to_geneList"
 
@@ -50,6 +52,8 @@ rule gse_go:
         gseGO_extra = config["params"].get("gseGO_extra", "")
     log:
         "logs/gsea_go/{design}/{name}.log"
+    benchmark:
+        "benchmarks/gse_go/{design}/{name}.tsv"
     wrapper:
         f"{git}/bio/clusterProfiler/gseGO"
 
@@ -77,6 +81,8 @@ rule gsea_plot:
         extra = config["params"].get("gseaplot_extra", "")
     log:
         "logs/gsea_plot/{design}/{name}.log"
+    benchmark:
+        "benchmarks/gsea_plot/{design}/{name}.tsv"
     wrapper:
         f"{git}/bio/clusterProfiler/gseaplot"
 
@@ -104,6 +110,8 @@ rule barplot_go:
         barplot_extra = config["params"].get("barplot_extra", "")
     log:
         "logs/barplot_go/{design}/{name}.log"
+    benchmark:
+        "benchmarks/barplot_go/{design}/{name}.tsv"
     wrapper:
         f"{git}/bio/clusterProfiler/barplot"
 
@@ -128,5 +136,7 @@ rule zip_clusterProfiler:
         "../envs/bash.yaml"
     log:
         "logs/figures_archive/clusterProfiler_{design}.log"
+    benchmark:
+        "benchmarks/zip_clusterProfiler/{design}.tsv"
     shell:
         "tar -cvjf {output} {input.htmls} > {log} 2>&1"
@@ -7,16 +7,25 @@ validations.
 import itertools        # Handle iterators
 import os               # OS related operations
 import os.path as op    # Path and file system manipulation
+import re               # Escape sample names
 import sys              # System related operations
 
 
 from pathlib import Path               # Easily handle file paths
 from typing import Any, Dict, Generator, List     # Give IO information
 import pandas as pd                    # Deal with TSV files (design)
+from snakemake.common import Mode      # Tell the main process from jobs
+from snakemake.logging import logger   # Report planned targets
 from snakemake.utils import validate   # Check Yaml/TSV formats
 
 from common_rna_dge_salmon_deseq2 import *
 
+# Tracing spans, see common_script_rna_dge_salmon_deseq2.py
+sys.path.append(srcdir("../scripts"))
+from common_script_rna_dge_salmon_deseq2 import span
+from stage_files import is_cold
+from gene_quant_check import gene_level_ready
+
 # Snakemake-Wrappers version
 wrapper_version = "https://raw.githubusercontent.com/snakemake/snakemake-wrappers/0.67.0"
 # github prefix
@@ -26,29 +35,59 @@ git = "https://raw.githubusercontent.com/tdayris/snakemake-wrappers/Unofficial"
 # Loading configuration
 if config == dict():
     configfile: "config.yaml"
-validate(config, schema="../schemas/config.schema.yaml")
+# Unchanged configuration and design files are not validated again: see
+# load_config and load_design in common_rna_dge_salmon_deseq2.py
+with span("load_config"):
+    load_config(config, srcdir("../schemas/config.schema.yaml"), validate)
 
 # Loading design file
-design = pd.read_csv(
-    config["design"],
-    sep="\t",
-    header=0,
-    index_col=None,
-    dtype=str
-)
+with span("load_design", path=config["design"]):
+    design = load_design(
+        config["design"], srcdir("../schemas/design.schema.yaml"), validate
+    )
 design.set_index(design["Sample_id"])
-validate(design, schema="../schemas/design.schema.yaml")
+
+# Salmon directories on cold storage are staged before being read
+salmon_sources = dict(zip(design["Sample_id"], design["Salmon"]))
+salmon_quant_dirs = salmon_dirs(
+    design, lambda path: is_cold(path, config.get("cold_storage", []))
+)
+
+# The main Snakemake process, as opposed to the jobs it submits, which
+# parse this Snakefile again
+head_process = (workflow.mode == Mode.default)
+
+# Memory and time requests are estimated from past jobs, see
+# ResourceEstimator in common_rna_dge_salmon_deseq2.py
+resource_estimator = ResourceEstimator(
+    history_dir=config["params"].get("resource_history", RESOURCE_HISTORY),
+    samples=len(design.index),
+    gtf=config["ref"]["gtf"],
+    margin=config["params"].get("resource_margin", 1.2),
+    log_requests=head_process
+)
 
 # Define Pipeline-dependent column name, that are not going to be plotted
 # or appear in reports
 reserved = {"Sample_id", "Upstream_file",
             "Downstream_file", "Salmon"}
 
+# Each design column is fingerprinted in its own file, see
+# column_fingerprints in common_rna_dge_salmon_deseq2.py: rules read the
+# design through the fingerprints of the columns they use, so editing a
+# column only re-runs the rules reading it
+with span("design_fingerprints", path=config["design"]):
+    design_fingerprints = column_fingerprints(design)
+report_dropped_columns = filter_design_columns(
+    design.columns.tolist(), config.get("columns", None)
+)
+
 
 wildcard_constraints:
     design = "|".join(config["models"].keys()),
     elipse = "|".join(["with_elipse", "without_elipse"]),
     intgroup = r"[^/]+",
+    sample = "|".join(map(re.escape, salmon_sources.keys())),
     a = '|'.join(map(str, range(1, 10))),
     b = '|'.join(map(str, range(1, 10)))
 
@@ -59,102 +98,113 @@ def get_targets(get_deseq2 : bool = False,
                 get_pca_exp: bool = False,
                 get_figures: bool = False,
                 get_gseaapp: bool = False,
-                get_multiqc: bool = False) -> Dict[str, Any]:
+                get_multiqc: bool = False,
+                get_performance: bool = False,
+                get_bootstraps: bool = False) -> Dict[str, Any]:
     """
     This function retuans the targets of the snakefile
     according to the users requests
     """
-    # Initialize list of final targets
-    targets = {}
-
-    # Remove unnecessary columns
-    reserved = {
-        "Sample_id",
-        "Upstream_file",
-        "Downstream_file",
-        "Upstream_name",
-        "Downstream_name",
-        "Salmon",
-        "Salmon_quant",
-        "Unconcatenated_fq_R1_files",
-        "Unconcatenated_fq_R2_files"
+    with span("plan_targets"):
+        targets = plan_targets(
+            config, design, get_deseq2, get_pca_exp, get_figures, get_gseaapp,
+            get_multiqc, get_performance, get_bootstraps
+        )
+        counts = count_targets(targets)
+    if head_process:
+        for family, count in counts.items():
+            logger.info(f"{count} target(s) planned for {family}")
+
+    return targets
+
+
+def tximport_input(wildcards) -> Dict[str, Any]:
+    """
+    Return the files read by tximport: Salmon gene-level quantifications
+    if they passed the checks of gene_quant_check, transcript-level
+    quantifications and the transcript to gene table otherwise
+    """
+    quant_qc = "qc/salmon_quantification.tsv"
+    if config["params"].get("gene_level_import", False):
+        check = checkpoints.gene_quant_check.get().output["check"]
+        if gene_level_ready(check):
+            return {
+                "quant": [
+                    f"{path}/quant.genes.sf"
+                    for path in salmon_quant_dirs.values()
+                ],
+                "qc": quant_qc,
+                "check": check
+            }
+
+    return {
+        "tx_to_gene": "tximport/tx_tab_gene.tsv",
+        "quant": [f"{path}/quant.sf" for path in salmon_quant_dirs.values()],
+        "qc": quant_qc
     }
 
-    # short cuts for further work
-    first_model = list(config["models"].keys())[0]
-    multiqc_flag = True  # False if missing input files
 
-    if add_target(config, "deseq2", get_deseq2):
-        # Add DESeq2 result files
-        targets["deseq2"] = expand(
-            "deseq2/{design}/Wald_{design}.RDS",
-            design=config["models"].keys()
-        )
+def tximport_extra(wildcards, input) -> str:
+    """
+    Return tximport parameters: gene-level quantifications are imported
+    as is, without summarization
+    """
+    extra = config["params"].get(
+        "tximport_extra",
+        "type='salmon', ignoreTxVersion=TRUE, ignoreAfterBar=TRUE"
+    )
+    if "tx_to_gene" not in input.keys() and "txOut" not in extra:
+        extra += ", txOut=TRUE"
+    return extra
 
-    if add_target(config, "pca_explorer", get_pca_exp):
-        # Add pcaExplorer required files
-        targets["pca_explorer"] = expand(
-            "pcaExplorer/{design}/{object}_{design}.RDS",
-            design=config["models"].keys(),
-            object=["annotation", "limmago"]
-        )
 
-        # Add reporting figures
-        targets["pca_explorer_figures"] = expand(
-            "figures/{design}/{figures}_{design}.png",
-            design=config["models"].keys(),
-            figures=["pca_scree", "distro_expr", "pcacorrs"]
-        )
+def clustermap_counts(wildcards) -> str:
+    """
+    Return the counts clustered by seaborn: the most variable genes when
+    params.clustermap_top_genes is set, all normalized counts otherwise
+    """
+    if config["params"].get("clustermap_top_genes", 0) > 0:
+        return f"deseq2/{wildcards.design}/top_variable_counts.tsv"
+    return f"deseq2/{wildcards.design}/normalized_counts.tsv"
 
-        pca_groups = config.get("columns", None)
-        if pca_groups is None:
-            pca_groups = get_groups(design, columns_to_drop=reserved, nest=1)
-
-        targets["pca"] = expand(
-            "figures/{design}/pca/pca_{intgroup}_{axes}_{elipse}.png",
-            design=config["models"].keys(),
-            intgroup=pca_groups,
-            axes=[
-                f"ax_{a}_ax_{b}"
-                for a, b in get_axes(config["params"].get("pca_axes_depth", 4))
-            ],
-            elipse=["with_elipse", "without_elipse"]
-        )
 
-        # Add pcaExplorer launch script for developper
-        targets["pca_explorer_scripts"] = expand(
-            "pcaExplorer/{design}/pcaExplorer_launcher_{design}.R",
-            design=config["models"].keys()
-        )
-    else:
-        # If no pca-explorer is asked, then no multiqc will be produced
-        multiqc_flag = False
-
-    if add_target(config, "gseaapp", get_gseaapp):
-        targets["gseaapp"] = expand(
-            "GSEAapp/{design}/{design}_{content}.tsv",
-            design=config["models"].keys(),
-            content=["complete", "padj_fc", "fc_fc"],
-        )
+def coldata_columns(wildcards, pca: bool = False) -> List[str]:
+    """
+    Return the design columns given to DESeq2 with a model: its factor and
+    the variables of its formula. PCA plots also read their intgroups
+    """
+    return model_columns(
+        config["models"][wildcards.design],
+        design.columns.tolist(),
+        pca_intgroups(config, design) if pca else None
+    )
 
-    if add_target(config, "additional_figures", get_figures):
-        targets["enhancedVolcano"] = expand(
-            "figures/{design}/Volcano_{design}.png",
-            design=config["models"].keys()
-        )
 
-        targets["seaborn_clustermaps"] = expand(
-            "figures/{design}/sample_clustered_heatmap_{design}.png",
-            design=config["models"].keys()
-        )
-    else:
-        # If no additional figures are built, the no multiqc is produced
-        multiqc_flag = False
-
-    if add_target(config, "multiqc", get_multiqc) and multiqc_flag:
-        targets["multiqc"] = expand(
-            "multiqc/{design}/report.html",
-            design=config["models"].keys()
-        )
+def coldata_fingerprints(wildcards) -> List[str]:
+    """
+    Return the fingerprints of the design columns given to DESeq2
+    """
+    return [
+        design_fingerprints[column] for column in coldata_columns(wildcards)
+    ]
 
-    return targets
+
+def pca_coldata_fingerprints(wildcards) -> List[str]:
+    """
+    Return the fingerprints of the design columns read by PCA plots
+    """
+    return [
+        design_fingerprints[column]
+        for column in coldata_columns(wildcards, pca=True)
+    ]
+
+
+def clustermap_fingerprints(wildcards) -> List[str]:
+    """
+    Return the fingerprints of the factor colouring the clustered heatmap
+    """
+    factor = config["models"][wildcards.design]["factor"]
+    return [
+        design_fingerprints[column] for column in
+        ["Sample_id", *factor_columns(factor, design.columns.tolist())]
+    ]
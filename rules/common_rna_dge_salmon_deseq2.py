@@ -6,13 +6,48 @@ This script contains functions used by Snakemake. They heva bee taken aside
 of the common.smk in order to be tested
 """
 
+import csv             # Read benchmark files
+import fcntl           # Lock the resource history
+import hashlib         # Hash file contents
+import inspect         # Inspect resource functions
 import itertools       # Handle iterators and comprehensions
+import json            # Serialize validated configuration
+import math            # Round resources
+import numpy           # Fit resource models
 import os              # OS related operations
 import pandas          # Handle large datasets
+import pickle          # Read pre-parsed design
 import pytest          # Unit testing
+import re              # Search gene identifiers
+import time            # Date predictions
 
 from pathlib import Path                             # Easily handle paths
-from typing import Any, Dict, Generator, List, Optional, Set   # Type hints
+from snakemake.io import strip_wildcard_constraints  # Format benchmarks
+from types import SimpleNamespace                    # Mock rule objects
+from typing import (Any, Callable, Dict, Generator,  # Type hints
+                    List, Optional, Set)
+
+VALIDATION_CACHE = os.path.join(".snakemake", "validation-cache")
+RESOURCE_HISTORY = os.path.join(".snakemake", "resource-history")
+RESOURCE_HISTORY_FILES = ["predictions.1.jsonl", "predictions.jsonl"]
+RESOURCE_HISTORY_MAX = 10000
+DESIGN_COLUMNS = os.path.join(".snakemake", "design-columns")
+
+# Salmon files read by the pipeline, staged from cold storage
+SALMON_FILES = ["quant.sf", "aux_info/meta_info.json"]
+SALMON_OPTIONAL_FILES = [
+    "aux_info/bootstrap/bootstraps.gz",
+    "aux_info/bootstrap/names.tsv.gz",
+    "cmd_info.json",
+    "lib_format_counts.json",
+    "libParams/flenDist.txt",
+    "quant.genes.sf"
+]
+
+# Job features used to estimate resources, and lowest resources requested
+RESOURCE_FEATURES = ["samples", "genes", "input_mb"]
+RESOURCE_FLOORS = {"mem_mb": 128, "time_min": 1}
+GENE_ID = re.compile(r'gene_id "([^"]+)"')
 
 
 def get_gtf_path(config: Dict[str, Any]) -> Dict[str, str]:
@@ -31,6 +66,178 @@ def test_get_gtf_path() -> None:
     assert expected == tested
 
 
+def content_digest(*contents: bytes) -> str:
+    """
+    Return a digest identifying the given contents
+    """
+    digest = hashlib.sha256()
+    for content in contents:
+        digest.update(hashlib.sha256(content).digest())
+    return digest.hexdigest()
+
+
+def _store(cache_dir: str, name: str, kind: str, write: Callable) -> None:
+    """
+    Atomically write a cache entry, and drop outdated entries of its kind.
+    Temporary files are left alone: other processes may be writing them
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, name)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+    for other in os.listdir(cache_dir):
+        if (other.startswith(kind) and other != name
+                and not other.endswith(".tmp")):
+            try:
+                os.remove(os.path.join(cache_dir, other))
+            except OSError:
+                pass
+
+
+def test_store(tmp_path) -> None:
+    """
+    Test the function _store above: outdated entries are dropped, entries
+    being written by other processes are kept
+    """
+    cache_dir = str(tmp_path)
+    (tmp_path / "config-old.json").write_text("{}")
+    (tmp_path / "config-other.json.1234.tmp").write_text("{}")
+    _store(cache_dir, "config-new.json", "config-",
+           lambda path: Path(path).write_text("{}"))
+    assert sorted(os.listdir(cache_dir)) == [
+        "config-new.json", "config-other.json.1234.tmp"
+    ]
+
+
+def load_config(config: Dict[str, Any],
+                schema: str,
+                validator: Callable,
+                cache_dir: str = VALIDATION_CACHE) -> Dict[str, Any]:
+    """
+    Validate the configuration against its schema, unless this very
+    configuration was already validated against this very schema. In both
+    cases, default values from the schema are set in the configuration.
+    """
+    key = content_digest(
+        json.dumps(config, sort_keys=True, default=str).encode(),
+        Path(schema).read_bytes()
+    )
+    name = f"config-{key}.json"
+    try:
+        with open(os.path.join(cache_dir, name)) as cached:
+            config.update(json.load(cached))
+        return config
+    except (OSError, ValueError):
+        pass
+
+    validator(config, schema=schema)
+
+    def write(path: str) -> None:
+        with open(path, "w") as cached:
+            json.dump(config, cached, default=str)
+    _store(cache_dir, name, "config-", write)
+    return config
+
+
+def load_design(design_path: str,
+                schema: str,
+                validator: Callable,
+                cache_dir: str = VALIDATION_CACHE) -> pandas.DataFrame:
+    """
+    Load and validate the design file. Validated designs are stored
+    pre-parsed, and loaded from there while neither the design, the schema
+    nor pandas changed.
+    """
+    key = content_digest(
+        Path(design_path).read_bytes(),
+        Path(schema).read_bytes(),
+        pandas.__version__.encode()
+    )
+    name = f"design-{key}.pickle"
+    try:
+        return pandas.read_pickle(os.path.join(cache_dir, name))
+    except (OSError, EOFError, ValueError, AttributeError, ImportError,
+            pickle.UnpicklingError):
+        pass
+
+    design = pandas.read_csv(
+        design_path,
+        sep="\t",
+        header=0,
+        index_col=None,
+        dtype=str
+    )
+    validator(design, schema=schema)
+    _store(cache_dir, name, "design-", design.to_pickle)
+    return design
+
+
+class _CountingValidator:
+    """
+    Validator stub for tests, counting its calls and setting a default
+    """
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def __call__(self, data: Any, schema: str) -> None:
+        self.calls += 1
+        if isinstance(data, dict):
+            data.setdefault("default_key", "default_value")
+
+
+def test_load_config(tmp_path) -> None:
+    """
+    Test the function load_config above
+    """
+    schema = tmp_path / "config.schema.yaml"
+    schema.write_text("properties: {}\n")
+    validator = _CountingValidator()
+    cache_dir = str(tmp_path / "cache")
+
+    for _ in range(3):
+        tested = load_config({"design": "design.tsv"}, str(schema),
+                             validator, cache_dir)
+        assert tested["default_key"] == "default_value"
+    assert validator.calls == 1
+
+    load_config({"design": "other.tsv"}, str(schema), validator, cache_dir)
+    assert validator.calls == 2
+    schema.write_text("properties: {design: {type: string}}\n")
+    load_config({"design": "other.tsv"}, str(schema), validator, cache_dir)
+    assert validator.calls == 3
+    assert len(os.listdir(cache_dir)) == 1
+
+
+def test_load_design(tmp_path) -> None:
+    """
+    Test the function load_design above
+    """
+    schema = tmp_path / "design.schema.yaml"
+    schema.write_text("required: [Sample_id]\n")
+    design_path = tmp_path / "design.tsv"
+    design_path.write_text("Sample_id\tCondition\nS1\tA\nS2\t01\n")
+    validator = _CountingValidator()
+    cache_dir = str(tmp_path / "cache")
+
+    for _ in range(3):
+        tested = load_design(str(design_path), str(schema), validator,
+                             cache_dir)
+    assert validator.calls == 1
+    assert tested["Condition"].tolist() == ["A", "01"]
+
+    design_path.write_text("Sample_id\tCondition\nS1\tA\nS2\tB\n")
+    tested = load_design(str(design_path), str(schema), validator, cache_dir)
+    assert validator.calls == 2
+    assert tested["Condition"].tolist() == ["A", "B"]
+
+    # Corrupted cache entries are replaced
+    for name in os.listdir(cache_dir):
+        Path(cache_dir, name).write_text("not a pickle")
+    load_design(str(design_path), str(schema), validator, cache_dir)
+    assert validator.calls == 3
+
+
 def filter_design_columns(factors: List[str],
                           keep: Optional[List[str]] = None) -> List[str]:
     """
@@ -52,12 +259,29 @@ def filter_design_columns(factors: List[str],
     return list(set(factors) - set(keep))
 
 
+def factor_columns(factor: str, columns: List[str]) -> List[str]:
+    """
+    Return the design columns of a model factor: the factor itself when it
+    is a design column, the columns of a composite factor (A.B) otherwise
+    """
+    if factor in columns:
+        return [factor]
+    return [column for column in factor.split(".") if column in columns]
+
+
 def get_condition_dict_w(factor: Any, design: pandas.DataFrame) -> Dict[str, str]:
     """
     Return a dictionnary with:
     sample_id : condition
+    Conditions of composite factors (A.B) join their columns with dots
     """
-    return dict(zip(design["Sample_id"], design[factor]))
+    columns = factor_columns(factor, design.columns.tolist())
+    if len(columns) == 1:
+        return dict(zip(design["Sample_id"], design[columns[0]]))
+    return dict(zip(
+        design["Sample_id"],
+        design[columns].astype(str).agg(".".join, axis=1)
+    ))
 
 
 def test_get_condition_dict_w() -> None:
@@ -72,20 +296,33 @@ def test_get_condition_dict_w() -> None:
     )
     tested = get_condition_dict_w("my_factor", tested_data)
     assert expected == tested
+    assert get_condition_dict_w("my_factor.other", tested_data) == {
+        "name1": "factor1.other1", "name2": "factor1.other1",
+        "name3": "factor2.other2"
+    }
+    assert factor_columns("other", list(tested_data.columns)) == ["other"]
 
 
 def get_groups(design: pandas.DataFrame,
                columns_to_drop: Set[str],
-               nest: int = 2) -> Generator[str, None, None]:
+               nest: int = 2,
+               priority: Optional[List[str]] = None,
+               max_groups: Optional[int] = None) -> Generator[str, None, None]:
     """
-    Return the list of groups of interest
+    Return the groups of interest: combinations of up to `nest` design
+    columns, regardless of their order. Columns listed in `priority` come
+    first, then the other ones in alphabetical order. Only the first
+    `max_groups` groups are returned, if provided.
     """
     cols = set(design.columns) - columns_to_drop
-    return itertools.chain(
+    first = [col for col in dict.fromkeys(priority or []) if col in cols]
+    ordered = first + sorted(cols - set(first))
+    groups = (
         ":".join(map(str, j))
         for i in range(1, nest + 1, 1)
-        for j in itertools.permutations(cols, i)
+        for j in itertools.combinations(ordered, i)
     )
+    return itertools.islice(groups, max_groups)
 
 
 def test_get_groups() -> None:
@@ -99,12 +336,214 @@ def test_get_groups() -> None:
     tested = sorted(list(get_groups(tested_data, set("None"), 2)))
     expected = sorted(['my_factor',
         'other_factor',
-        'my_factor:other_factor',
-        'other_factor:my_factor'
+        'my_factor:other_factor'
     ])
     assert expected == tested
 
 
+def test_get_groups_priority() -> None:
+    """
+    Test the priority and the cap of the above function get_groups
+    """
+    tested_data = pandas.DataFrame(
+        {"Sample_id": ["S1"], "a": ["1"], "b": ["1"], "c": ["1"]}
+    )
+    tested = list(get_groups(tested_data, {"Sample_id"}, 2, priority=["c"]))
+    assert tested == ["c", "a", "b", "c:a", "c:b", "a:b"]
+    tested = list(get_groups(tested_data, {"Sample_id"}, 2, max_groups=4))
+    assert tested == ["a", "b", "c", "a:b"]
+
+
+def pca_intgroups(config: Dict[str, Any],
+                  design: pandas.DataFrame) -> List[str]:
+    """
+    Return the groups colouring PCA plots: the columns listed in the
+    configuration, or the groups of design columns, model factors first
+    """
+    pca_groups = config.get("columns", None)
+    if pca_groups is not None:
+        return list(pca_groups)
+
+    # Remove unnecessary columns
+    reserved = {
+        "Sample_id",
+        "Upstream_file",
+        "Downstream_file",
+        "Upstream_name",
+        "Downstream_name",
+        "Salmon",
+        "Salmon_quant",
+        "Unconcatenated_fq_R1_files",
+        "Unconcatenated_fq_R2_files"
+    }
+    return list(get_groups(
+        design,
+        columns_to_drop=reserved,
+        nest=config["params"].get("pca_intgroup_nest", 1),
+        priority=[
+            column
+            for model in config["models"].values()
+            for column in model["factor"].split(".")
+        ],
+        max_groups=config["params"].get("pca_max_intgroups", 0) or None
+    ))
+
+
+def model_columns(model: Dict[str, str],
+                  columns: List[str],
+                  intgroups: Optional[List[str]] = None) -> List[str]:
+    """
+    Return the design columns read with a model, in design order: sample
+    identifiers, the factor, the variables of the formula and, if given,
+    the PCA intgroups
+    """
+    used = {"Sample_id", model["factor"], *model["factor"].split(".")}
+    used.update(re.findall(r"[A-Za-z_.][\w.]*", model.get("formula", "")))
+    for group in intgroups or []:
+        used.update(group.split(":"))
+    return [column for column in columns if column in used]
+
+
+def test_model_columns() -> None:
+    """
+    Test the functions pca_intgroups and model_columns above
+    """
+    config = {
+        "models": {"m1": {"factor": "Condition",
+                          "formula": "~Batch + Condition"}},
+        "params": {}
+    }
+    design = pandas.DataFrame({
+        "Sample_id": ["S1"], "Salmon": ["S1"], "Batch": ["b1"],
+        "Comment": ["c"], "Sex": ["F"], "Condition": ["A"]
+    })
+    intgroups = pca_intgroups(config, design)
+    assert intgroups == ["Condition", "Batch", "Comment", "Sex"]
+    columns = design.columns.tolist()
+    tested = model_columns(config["models"]["m1"], columns)
+    assert tested == ["Sample_id", "Batch", "Condition"]
+    tested = model_columns(config["models"]["m1"], columns, ["Sex"])
+    assert tested == ["Sample_id", "Batch", "Sex", "Condition"]
+    config["columns"] = ["Sex:Batch"]
+    tested = model_columns(
+        {"factor": "Condition"}, columns, pca_intgroups(config, design)
+    )
+    assert tested == ["Sample_id", "Batch", "Sex", "Condition"]
+
+
+def column_fingerprints(design: pandas.DataFrame,
+                        directory: str = DESIGN_COLUMNS) -> Dict[str, str]:
+    """
+    Write a digest of each design column, along with sample identifiers,
+    in its own file. A file is written again only when its digest changes:
+    rules using it as input only re-run when the column was edited.
+    Return the fingerprint path of each column
+    """
+    os.makedirs(directory, exist_ok=True)
+    samples = "\n".join(design["Sample_id"].astype(str)).encode()
+    paths = {}
+    for column in design.columns:
+        digest = content_digest(
+            samples,
+            str(column).encode(),
+            "\n".join(design[column].fillna("NA").astype(str)).encode()
+        )
+        # Named after a digest: column names are not all valid file names
+        name = content_digest(str(column).encode())
+        path = os.path.join(directory, f"{name}.sha256")
+        try:
+            unchanged = Path(path).read_text() == digest
+        except OSError:
+            unchanged = False
+        if not unchanged:
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            Path(tmp_path).write_text(digest)
+            os.replace(tmp_path, path)
+        paths[column] = path
+    return paths
+
+
+def test_column_fingerprints(tmp_path) -> None:
+    """
+    Test the function column_fingerprints above
+    """
+    design = pandas.DataFrame({
+        "Sample_id": ["S1", "S2"], "Condition": ["A", "B"],
+        "Comment": ["x", None], "a b": [1, 2], "a_b": [1, 2]
+    })
+    directory = str(tmp_path / "columns")
+    paths = column_fingerprints(design, directory)
+    assert sorted(paths) == ["Comment", "Condition", "Sample_id", "a b", "a_b"]
+    assert paths["a b"] != paths["a_b"]
+    for path in paths.values():
+        os.utime(path, ns=(0, 0))
+
+    # Only the edited column is written again
+    design.loc[1, "Comment"] = "y"
+    digests = {column: Path(path).read_text()
+               for column, path in paths.items()}
+    assert column_fingerprints(design, directory) == paths
+    assert os.stat(paths["Condition"]).st_mtime_ns == 0
+    assert os.stat(paths["Comment"]).st_mtime_ns > 0
+    assert Path(paths["Comment"]).read_text() != digests["Comment"]
+
+    # Samples are part of each column
+    design["Sample_id"] = ["S1", "S3"]
+    column_fingerprints(design, directory)
+    assert Path(paths["Condition"]).read_text() != digests["Condition"]
+
+
+class TargetFamily:
+    """
+    Target paths built from a pattern and all combinations of its wildcard
+    values, as `expand` does. Paths are generated on iteration only, and
+    their number is known without generating them.
+    """
+    def __init__(self, pattern: str, **wildcards: Any) -> None:
+        self.pattern = pattern
+        self.wildcards = {
+            name: [values] if isinstance(values, str) else list(values)
+            for name, values in wildcards.items()
+        }
+
+    def __len__(self) -> int:
+        count = 1
+        for values in self.wildcards.values():
+            count *= len(values)
+        return count
+
+    def __iter__(self) -> Generator[str, None, None]:
+        names = list(self.wildcards.keys())
+        for values in itertools.product(*self.wildcards.values()):
+            yield self.pattern.format(**dict(zip(names, values)))
+
+
+def test_target_family() -> None:
+    """
+    Test the class TargetFamily above
+    """
+    tested = TargetFamily(
+        "figures/{design}/{figure}_{design}.png",
+        design={"d1": None, "d2": None}.keys(),
+        figure=["pca", "scree"]
+    )
+    assert len(tested) == 4
+    assert list(tested) == [
+        "figures/d1/pca_d1.png", "figures/d1/scree_d1.png",
+        "figures/d2/pca_d2.png", "figures/d2/scree_d2.png"
+    ]
+    assert len(TargetFamily("deseq2/{design}.tsv", design="d1")) == 1
+
+
+def count_targets(targets: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Return the number of target paths in each family of targets
+    """
+    return {
+        family: 1 if isinstance(paths, str) else len(paths)
+        for family, paths in targets.items()
+    }
+
 
 def get_axes(max_axes: int = 10) -> Generator[List[int], None, None]:
     """
@@ -159,3 +598,665 @@ def test_add_target(config: Dict[str, Any],
     Test the above add_taget function with multiple inputs
     """
     assert add_target(config, part, required) == tested
+
+
+def plan_targets(config: Dict[str, Any],
+                 design: pandas.DataFrame,
+                 get_deseq2: bool = False,
+                 get_pca_exp: bool = False,
+                 get_figures: bool = False,
+                 get_gseaapp: bool = False,
+                 get_multiqc: bool = False,
+                 get_performance: bool = False,
+                 get_bootstraps: bool = False) -> Dict[str, TargetFamily]:
+    """
+    Return the targets of the snakefile according to the users requests,
+    as families of target paths
+    """
+    # Initialize list of final targets
+    targets = {}
+
+    # short cuts for further work
+    first_model = list(config["models"].keys())[0]
+    multiqc_flag = True  # False if missing input files
+
+    if add_target(config, "deseq2", get_deseq2):
+        # Add DESeq2 result files
+        targets["deseq2"] = TargetFamily(
+            "deseq2/{design}/Wald_{design}.RDS",
+            design=config["models"].keys()
+        )
+
+        # Reported design, DESeq2 reads its own columns of the design
+        targets["design"] = TargetFamily("deseq2/filtered_design.tsv")
+
+    if add_target(config, "pca_explorer", get_pca_exp):
+        # Add pcaExplorer required files
+        targets["pca_explorer"] = TargetFamily(
+            "pcaExplorer/{design}/{object}_{design}.RDS",
+            design=config["models"].keys(),
+            object=["annotation", "limmago"]
+        )
+
+        # Add reporting figures
+        targets["pca_explorer_figures"] = TargetFamily(
+            "figures/{design}/{figures}_{design}.png",
+            design=config["models"].keys(),
+            figures=["pca_scree", "distro_expr", "pcacorrs"]
+        )
+
+        targets["pca"] = TargetFamily(
+            "figures/{design}/pca/pca_{intgroup}_{axes}_{elipse}.png",
+            design=config["models"].keys(),
+            intgroup=pca_intgroups(config, design),
+            axes=[
+                f"ax_{a}_ax_{b}"
+                for a, b in get_axes(config["params"].get("pca_axes_depth", 4))
+            ],
+            elipse=["with_elipse", "without_elipse"]
+        )
+
+        # Add pcaExplorer launch script for developper
+        targets["pca_explorer_scripts"] = TargetFamily(
+            "pcaExplorer/{design}/pcaExplorer_launcher_{design}.R",
+            design=config["models"].keys()
+        )
+    else:
+        # If no pca-explorer is asked, then no multiqc will be produced
+        multiqc_flag = False
+
+    if add_target(config, "gseaapp", get_gseaapp):
+        targets["gseaapp"] = TargetFamily(
+            "GSEAapp/{design}/{design}_{content}.tsv",
+            design=config["models"].keys(),
+            content=["complete", "padj_fc", "fc_fc"],
+        )
+
+    if add_target(config, "additional_figures", get_figures):
+        targets["enhancedVolcano"] = TargetFamily(
+            "figures/{design}/Volcano_{design}.png",
+            design=config["models"].keys()
+        )
+
+        targets["seaborn_clustermaps"] = TargetFamily(
+            "figures/{design}/sample_clustered_heatmap_{design}.png",
+            design=config["models"].keys()
+        )
+    else:
+        # If no additional figures are built, the no multiqc is produced
+        multiqc_flag = False
+
+    if add_target(config, "multiqc", get_multiqc) and multiqc_flag:
+        targets["multiqc"] = TargetFamily(
+            "multiqc/{design}/report.html",
+            design=config["models"].keys()
+        )
+
+    if add_target(config, "inferential_replicates", get_bootstraps):
+        targets["bootstraps"] = TargetFamily("bootstrap/infrv_summary.tsv")
+
+    if add_target(config, "performance", get_performance):
+        # Benchmarks are aggregated once all other targets are built
+        targets["performance"] = TargetFamily(
+            "performance/benchmarks_summary.tsv"
+        )
+
+    return targets
+
+
+def test_plan_targets() -> None:
+    """
+    Test the function plan_targets above
+    """
+    config = {
+        "models": {"m1": {"factor": "Condition"}},
+        "params": {"pca_axes_depth": 3},
+        "pipeline": {"deseq2": True, "pca_explorer": True, "gseaapp": True,
+                     "additional_figures": False, "multiqc": True,
+                     "performance": True, "inferential_replicates": True}
+    }
+    design = pandas.DataFrame({
+        "Sample_id": ["S1", "S2"],
+        "Salmon": ["S1/quant.sf", "S2/quant.sf"],
+        "Batch": ["b1", "b2"],
+        "Condition": ["A", "B"]
+    })
+    tested = count_targets(plan_targets(config, design, True, True, True,
+                                        True, True, True, True))
+    # No additional figures: no multiqc report
+    assert "multiqc" not in tested
+    assert tested["performance"] == 1
+    assert tested["bootstraps"] == 1
+    assert tested["deseq2"] == 1
+    assert tested["design"] == 1
+    # Two intgroups, two pairs of axes, with and without elipses
+    assert tested["pca"] == 2 * 2 * 2
+
+
+def evaluate_resource(value: Any) -> Optional[Any]:
+    """
+    Return a resource requested at first attempt, None if it depends on
+    the wildcards of each job. Functions are called with the arguments
+    they name, as Snakemake does, without input files. Estimated resources
+    are not logged as requests
+    """
+    if callable(value):
+        arguments = {
+            "wildcards": {}, "input": [], "attempt": 1, "log_request": False
+        }
+        parameters = inspect.signature(value).parameters
+        try:
+            return value(**{
+                name: argument for name, argument in arguments.items()
+                if name in parameters
+            })
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return None
+    return value
+
+
+def requested_resources(rules: Any) -> Dict[str, Dict[str, Any]]:
+    """
+    Return the threads, memory and time requested by each rule
+    """
+    return {
+        rule.name: {
+            "threads": evaluate_resource(rule.resources.get("_cores", 1)),
+            "mem_mb": evaluate_resource(rule.resources.get("mem_mb")),
+            "time_min": evaluate_resource(rule.resources.get("time_min"))
+        }
+        for rule in rules
+    }
+
+
+def test_requested_resources() -> None:
+    """
+    Test the functions evaluate_resource and requested_resources above
+    """
+    rules = [
+        SimpleNamespace(name="deseq2", resources={
+            "_cores": 4,
+            "mem_mb": lambda wildcards, attempt: min(attempt * 1536, 4096),
+            "time_min": lambda wildcards, attempt: len(wildcards.design)
+        }),
+        SimpleNamespace(name="all", resources={"_cores": 1})
+    ]
+    assert requested_resources(rules) == {
+        "deseq2": {"threads": 4, "mem_mb": 1536, "time_min": None},
+        "all": {"threads": 1, "mem_mb": None, "time_min": None}
+    }
+
+
+def count_genes(gtf_path: str, cache_dir: str = RESOURCE_HISTORY) -> int:
+    """
+    Return the number of distinct gene identifiers in a GTF file. The count
+    is stored, and read from there while the GTF file is unchanged.
+    """
+    stat = os.stat(gtf_path)
+    key = content_digest(
+        os.path.abspath(gtf_path).encode(),
+        f"{stat.st_size}:{stat.st_mtime_ns}".encode()
+    )
+    name = f"genes-{key}.json"
+    try:
+        with open(os.path.join(cache_dir, name)) as cached:
+            return json.load(cached)["genes"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    genes = set()
+    with open(gtf_path) as gtf:
+        for line in gtf:
+            match = GENE_ID.search(line)
+            if match is not None:
+                genes.add(match.group(1))
+
+    def write(path: str) -> None:
+        with open(path, "w") as cached:
+            json.dump({"genes": len(genes)}, cached)
+    _store(cache_dir, name, "genes-", write)
+    return len(genes)
+
+
+def test_count_genes(tmp_path: Path) -> None:
+    """
+    Test the function count_genes above
+    """
+    gtf = tmp_path / "annotation.gtf"
+    gtf.write_text(
+        '#!genome-build GRCh38\n'
+        'chr21\tHAVANA\tgene\t1\t9\t.\t+\t.\tgene_id "G1";\n'
+        'chr21\tHAVANA\texon\t1\t9\t.\t+\t.\tgene_id "G1"; '
+        'transcript_id "T1";\n'
+        'chr21\tHAVANA\texon\t1\t9\t.\t+\t.\tgene_id "G2";\n'
+    )
+    assert count_genes(str(gtf), str(tmp_path / "cache")) == 2
+    # Stored count is used while the file is unchanged
+    assert len(list((tmp_path / "cache").glob("genes-*.json"))) == 1
+    assert count_genes(str(gtf), str(tmp_path / "cache")) == 2
+
+
+def input_mb(input_files: Any) -> float:
+    """
+    Return the size of existing input files, in MB
+    """
+    size = 0
+    for path in input_files:
+        try:
+            size += os.path.getsize(path)
+        except OSError:
+            pass
+    return size / 1024 ** 2
+
+
+def read_predictions(history_dir: str) -> List[Dict[str, Any]]:
+    """
+    Return the predictions logged in the history, the rotated ones first
+    """
+    predictions = []
+    for name in RESOURCE_HISTORY_FILES:
+        try:
+            with open(os.path.join(history_dir, name)) as history:
+                for line in history:
+                    try:
+                        entry = json.loads(line)
+                        entry["benchmark"]
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    predictions.append(entry)
+        except OSError:
+            continue
+    return predictions
+
+
+def prediction_key(entry: Dict[str, Any]) -> str:
+    """
+    Return what identifies a request: the same job, at the same attempt,
+    with the same features and the same request
+    """
+    return json.dumps([
+        entry.get(name) for name in
+        ["rule", "resource", "attempt", "benchmark", "features", "requested"]
+    ], sort_keys=True)
+
+
+def read_observations(history_dir: str) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Return the features and the observed usage of past jobs, per rule.
+
+    Each prediction logged in the history is joined with the benchmark file
+    of its job: the latest prediction made before the benchmark was written
+    holds the features of the job.
+    """
+    predictions = {}
+    for entry in read_predictions(history_dir):
+        predictions.setdefault(entry["benchmark"], []).append(entry)
+
+    observations = {}
+    for benchmark, entries in predictions.items():
+        try:
+            written = os.path.getmtime(benchmark)
+            with open(benchmark) as stream:
+                usage = next(csv.DictReader(stream, delimiter="\t"))
+            observed = {
+                "mem_mb": float(usage["max_rss"]),
+                "time_min": float(usage["s"]) / 60
+            }
+        except (OSError, StopIteration, KeyError, TypeError, ValueError):
+            continue
+
+        entries = [entry for entry in entries if entry["date"] <= written]
+        if entries:
+            entry = entries[-1]
+            observations.setdefault(entry["rule"], []).append(
+                {**entry["features"], **observed}
+            )
+    return observations
+
+
+def predict(observations: List[Dict[str, Any]],
+            features: Dict[str, float],
+            resource: str) -> Optional[float]:
+    """
+    Predict the usage of a resource from past observations, with a least
+    squares fit on job features. The prediction is never lower than any
+    past usage of a job with smaller features.
+    """
+    observations = [
+        observation for observation in observations
+        if not numpy.isnan(observation[resource])
+    ]
+    if not observations:
+        return None
+
+    design_matrix = numpy.array([
+        [1.0] + [observation[name] for name in RESOURCE_FEATURES]
+        for observation in observations
+    ])
+    observed = numpy.array([
+        observation[resource] for observation in observations
+    ])
+    coefficients = numpy.linalg.lstsq(design_matrix, observed, rcond=None)[0]
+    prediction = float(numpy.dot(
+        [1.0] + [features[name] for name in RESOURCE_FEATURES], coefficients
+    ))
+
+    smaller = [
+        observation[resource] for observation in observations
+        if all(observation[name] <= features[name]
+               for name in RESOURCE_FEATURES)
+    ]
+    return max([prediction] + smaller)
+
+
+def test_predict() -> None:
+    """
+    Test the function predict above
+    """
+    observations = [
+        {"samples": 10, "genes": 100, "input_mb": 10, "mem_mb": 200},
+        {"samples": 20, "genes": 100, "input_mb": 20, "mem_mb": 400},
+        {"samples": 40, "genes": 100, "input_mb": 40, "mem_mb": 800},
+    ]
+    tested = predict(
+        observations, {"samples": 30, "genes": 100, "input_mb": 30}, "mem_mb"
+    )
+    assert tested == pytest.approx(600)
+    # Never lower than a smaller job
+    tested = predict(
+        observations[:1], {"samples": 10, "genes": 100, "input_mb": 11},
+        "mem_mb"
+    )
+    assert tested >= 200
+    assert predict([], {"samples": 1, "genes": 1, "input_mb": 1}, "mem_mb") \
+        is None
+
+
+class ResourceEstimator:
+    """
+    Estimate the memory and the time required by each job from the
+    benchmarks of past jobs. Each job is described by its rule, the number
+    of samples, the number of genes and the size of its input files.
+
+    Rules without history keep their own resources formulas. Requests are
+    logged in the history, in order to be audited, and to be joined
+    with benchmarks on later runs. Each job and attempt is logged once, by
+    the main Snakemake process only (log_requests), and the history is
+    rotated after max_entries requests.
+    """
+    def __init__(self,
+                 history_dir: str = RESOURCE_HISTORY,
+                 samples: int = 0,
+                 gtf: Optional[str] = None,
+                 margin: float = 1.2,
+                 log_requests: bool = True,
+                 max_entries: int = RESOURCE_HISTORY_MAX) -> None:
+        self.history_dir = history_dir
+        self.samples = samples
+        self.gtf = gtf
+        self.margin = margin
+        self.log_requests = log_requests
+        self.max_entries = max_entries
+        self._genes = None
+        self._observations = None
+        self._logged = None
+
+    @property
+    def genes(self) -> int:
+        if self._genes is None:
+            try:
+                self._genes = count_genes(self.gtf, self.history_dir)
+            except (OSError, TypeError):
+                self._genes = 0
+        return self._genes
+
+    @property
+    def observations(self) -> Dict[str, List[Dict[str, Any]]]:
+        if self._observations is None:
+            self._observations = read_observations(self.history_dir)
+        return self._observations
+
+    @property
+    def logged(self) -> Set[str]:
+        if self._logged is None:
+            self._logged = {
+                prediction_key(entry)
+                for entry in read_predictions(self.history_dir)
+            }
+        return self._logged
+
+    def log(self, entry: Dict[str, Any]) -> None:
+        """
+        Append a prediction to the history, unless it was already logged.
+        The history is rotated once it holds max_entries predictions.
+        """
+        key = prediction_key(entry)
+        if not self.log_requests or key in self.logged:
+            return
+        self.logged.add(key)
+
+        os.makedirs(self.history_dir, exist_ok=True)
+        path = os.path.join(self.history_dir, RESOURCE_HISTORY_FILES[-1])
+        with open(path, "a+") as history:
+            fcntl.flock(history, fcntl.LOCK_EX)
+            history.seek(0)
+            if sum(1 for line in history) >= self.max_entries:
+                os.replace(
+                    path,
+                    os.path.join(self.history_dir, RESOURCE_HISTORY_FILES[0])
+                )
+                with open(path, "a") as rotated:
+                    rotated.write(json.dumps(entry) + "\n")
+            else:
+                history.write(json.dumps(entry) + "\n")
+
+    def estimate(self,
+                 rule: str,
+                 resource: str,
+                 fallback: Callable,
+                 benchmark: Optional[str]) -> Callable:
+        """
+        Return a resource function for the given rule, that falls back to
+        the rule's own formula when no history is available
+        """
+        floor = RESOURCE_FLOORS[resource]
+
+        def resource_function(wildcards: Any,
+                              input: Any,
+                              attempt: int,
+                              log_request: bool = True) -> int:
+            requested = fallback
+            if callable(fallback):
+                arguments = {
+                    "wildcards": wildcards, "input": input, "attempt": attempt
+                }
+                requested = fallback(**{
+                    name: value for name, value in arguments.items()
+                    if name in inspect.signature(fallback).parameters
+                })
+
+            features = {
+                "samples": self.samples,
+                "genes": self.genes,
+                "input_mb": input_mb(input)
+            }
+            observations = self.observations.get(rule, [])
+            prediction = predict(observations, features, resource)
+            if prediction is not None:
+                requested = max(
+                    math.ceil(round(prediction * self.margin, 3)), floor
+                ) * attempt
+
+            if benchmark is not None and log_request:
+                self.log({
+                    "date": time.time(),
+                    "rule": rule,
+                    "resource": resource,
+                    "attempt": attempt,
+                    "benchmark": os.path.abspath(
+                        benchmark.format(**dict(wildcards.items()))
+                    ),
+                    "features": features,
+                    "observations": len(observations),
+                    "prediction": prediction,
+                    "requested": requested
+                })
+            return requested
+
+        return resource_function
+
+    def adapt(self, rules: Any) -> None:
+        """
+        Replace the memory and time formulas of the given rules
+        """
+        for rule in rules:
+            benchmark = None if rule.benchmark is None \
+                else strip_wildcard_constraints(str(rule.benchmark))
+            for resource in RESOURCE_FLOORS:
+                if resource in rule.resources:
+                    rule.resources[resource] = self.estimate(
+                        rule.name, resource, rule.resources[resource],
+                        benchmark
+                    )
+
+
+def test_resource_estimator(tmp_path: Path) -> None:
+    """
+    Test the class ResourceEstimator above
+    """
+    history = str(tmp_path / "history")
+    gtf = tmp_path / "annotation.gtf"
+    gtf.write_text('chr21\tHAVANA\tgene\t1\t9\t.\t+\t.\tgene_id "G1";\n')
+    quant = tmp_path / "quant.sf"
+    quant.write_bytes(b"0" * 1024 ** 2)
+    benchmark = str(tmp_path / "benchmarks" / "deseq" / "{design}.tsv")
+    wildcards = SimpleNamespace(items=lambda: [("design", "d1")])
+
+    # No history: the rule's formula is used, and the request is logged
+    estimator = ResourceEstimator(history, samples=4, gtf=str(gtf))
+    function = estimator.estimate(
+        "deseq", "mem_mb", lambda wildcards, attempt: attempt * 8192,
+        benchmark
+    )
+    assert function(wildcards, [str(quant)], 2) == 16384
+
+    # Once the job ran, its benchmark is used on the next run
+    Path(benchmark.format(design="d1")).parent.mkdir(parents=True)
+    Path(benchmark.format(design="d1")).write_text(
+        "s\tmax_rss\n120\t1000\n"
+    )
+    estimator = ResourceEstimator(history, samples=4, gtf=str(gtf))
+    function = estimator.estimate(
+        "deseq", "mem_mb", lambda wildcards, attempt: attempt * 8192,
+        benchmark
+    )
+    assert function(wildcards, [str(quant)], 1) == 1200
+    assert function(wildcards, [str(quant)], 2) == 2400
+    assert function(wildcards, [str(quant)], 2) == 2400
+
+    with open(os.path.join(history, "predictions.jsonl")) as predictions:
+        entries = [json.loads(line) for line in predictions]
+    assert len(entries) == 3
+    assert entries[0]["requested"] == 16384
+    assert entries[0]["features"] == {
+        "samples": 4, "genes": 1, "input_mb": 1.0
+    }
+    assert entries[-1]["observations"] == 1
+
+    # The same requests, made by another process, are not logged again
+    estimator = ResourceEstimator(history, samples=4, gtf=str(gtf))
+    function = estimator.estimate(
+        "deseq", "mem_mb", lambda wildcards, attempt: attempt * 8192,
+        benchmark
+    )
+    assert function(wildcards, [str(quant)], 2) == 2400
+    assert len(read_predictions(history)) == 3
+
+
+def test_resource_estimator_log(tmp_path: Path) -> None:
+    """
+    Test the method ResourceEstimator.log above
+    """
+    history = str(tmp_path / "history")
+    estimator = ResourceEstimator(history, log_requests=False)
+    estimator.log({"rule": "deseq", "benchmark": "d1.tsv", "attempt": 1})
+    assert not os.path.exists(history)
+
+    estimator = ResourceEstimator(history, max_entries=2)
+    for attempt in [1, 2, 3, 3]:
+        estimator.log(
+            {"rule": "deseq", "benchmark": "d1.tsv", "attempt": attempt}
+        )
+    with open(os.path.join(history, "predictions.1.jsonl")) as rotated:
+        assert len(rotated.readlines()) == 2
+    with open(os.path.join(history, "predictions.jsonl")) as predictions:
+        assert len(predictions.readlines()) == 1
+    assert [entry["attempt"] for entry in read_predictions(history)] == [
+        1, 2, 3
+    ]
+
+
+def test_resource_estimator_adapt(tmp_path: Path) -> None:
+    """
+    Test the method ResourceEstimator.adapt above
+    """
+    rule = SimpleNamespace(
+        name="deseq",
+        benchmark="benchmarks/deseq/{design,d1|d2}.tsv",
+        resources={"mem_mb": 100, "time_min": 20}
+    )
+    history = str(tmp_path / "history")
+    ResourceEstimator(history_dir=history, samples=2).adapt([rule])
+    assert rule.resources["mem_mb"]({"design": "d1"}, [], 1) == 100
+
+    with open(os.path.join(history, "predictions.jsonl")) as predictions:
+        entry = json.loads(predictions.readline())
+    assert entry["benchmark"].endswith("benchmarks/deseq/d1.tsv")
+
+
+def test_requested_resources_adapt(tmp_path: Path) -> None:
+    """
+    Test that requested_resources evaluates the functions set by
+    ResourceEstimator.adapt, without logging them as requests
+    """
+    rules = [
+        SimpleNamespace(
+            name="deseq",
+            benchmark="benchmarks/deseq/{design}.tsv",
+            resources={
+                "_cores": 1,
+                "mem_mb": lambda wildcards, attempt: attempt * 8192,
+                "time_min": lambda wildcards, attempt: len(wildcards.design)
+            }
+        )
+    ]
+    history = str(tmp_path / "history")
+    ResourceEstimator(history_dir=history, samples=2).adapt(rules)
+    assert requested_resources(rules) == {
+        "deseq": {"threads": 1, "mem_mb": 8192, "time_min": None}
+    }
+    assert not os.path.exists(os.path.join(history, "predictions.jsonl"))
+
+
+def salmon_dirs(design: pandas.DataFrame,
+                cold: Callable[[str], bool]) -> Dict[str, str]:
+    """
+    Return the Salmon directory read for each sample: directories on cold
+    storage are read from their staged copy
+    """
+    return {
+        sample: f"salmon/{sample}" if cold(path) else path
+        for sample, path in zip(design["Sample_id"], design["Salmon"])
+    }
+
+
+def test_salmon_dirs() -> None:
+    """
+    Test the function salmon_dirs above
+    """
+    design = pandas.DataFrame({
+        "Sample_id": ["S1", "S2"],
+        "Salmon": ["/mnt/isilon/S1", "/home/S2"]
+    })
+    tested = salmon_dirs(design, lambda path: path.startswith("/mnt/isilon"))
+    assert tested == {"S1": "salmon/S1", "S2": "/home/S2"}
@@ -2,9 +2,8 @@
 On most clusters, cold and hot storage coexist. Non-expert users might
 try to run IO intensive processes on data through cold storage and break
 either the pipeline or the mounting points on a cluster. This rule
-copies the fastq files.
-More information at:
-https://github.com/tdayris/yawn/tree/master/SnakemakeWrappers/cp/8.25
+stages the genome annotation with the cheapest method available (hard
+link, kernel copy, or chunked parallel copy), see scripts/stage_files.py
 """
 rule copy_extra:
     input:
@@ -22,9 +21,50 @@ rule copy_extra:
         )
     log:
         "logs/copy/copy_gtf.log"
-    threads: 1
+    benchmark:
+        "benchmarks/copy_extra.tsv"
+    threads: 4
     params:
-        extra = config["params"].get("copy_extra", ""),
         cold_storage = config.get("cold_storage", ["NONE"])
-    wrapper:
-        f"{git}/bio/cp"
+    script:
+        "../scripts/stage_files.py"
+
+
+"""
+Salmon quantifications on cold storage are staged in the working directory.
+Only the files read by tximport and MultiQC are copied.
+"""
+rule stage_salmon:
+    input:
+        quant = lambda wildcards: f"{salmon_sources[wildcards.sample]}/quant.sf",
+        meta_info = lambda wildcards: (
+            f"{salmon_sources[wildcards.sample]}/aux_info/meta_info.json"
+        )
+    output:
+        quant = "salmon/{sample}/quant.sf",
+        meta_info = "salmon/{sample}/aux_info/meta_info.json"
+    message:
+        "Staging Salmon quantification of {wildcards.sample}"
+    resources:
+        mem_mb = (
+            lambda wildcards, attempt: min(attempt * 128, 512)
+        ),
+        time_min = (
+            lambda wildcards, attempt: min(attempt * 60, 600)
+        )
+    log:
+        "logs/copy/stage_salmon/{sample}.log"
+    benchmark:
+        "benchmarks/stage_salmon/{sample}.tsv"
+    threads: 2
+    params:
+        optional = lambda wildcards: [
+            [
+                f"{salmon_sources[wildcards.sample]}/{name}",
+                f"salmon/{wildcards.sample}/{name}"
+            ]
+            for name in SALMON_OPTIONAL_FILES
+        ],
+        cold_storage = config.get("cold_storage", ["NONE"])
+    script:
+        "../scripts/stage_files.py"
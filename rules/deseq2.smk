@@ -5,7 +5,7 @@ More information: https://github.com/tdayris-perso/snakemake-wrappers/tree/deseq
 rule DESeqDatasetFromTximport:
     input:
         tximport = "tximport/txi.RDS",
-        coldata = "deseq2/filtered_design.tsv"
+        coldata = "deseq2/{design}/coldata_{design}.tsv"
     output:
         dds = temp("deseq2/{design}/dds_{design}.RDS")
     message:
@@ -32,6 +32,8 @@ rule DESeqDatasetFromTximport:
         count_filter = min(len(design.Sample_id.tolist()), 10)
     log:
         "logs/deseq2/DESeqDatasetFromTximport/{design}.log"
+    benchmark:
+        "benchmarks/DESeqDatasetFromTximport/{design}.tsv"
     wrapper:
         f"{git}/bio/deseq2/DESeqDataSetFromTximport"
 
@@ -73,5 +75,7 @@ rule deseq:
         denominator = lambda w: config["models"][w.design]["denominator"],
     log:
         "logs/deseq2/deseq/{design}.log"
+    benchmark:
+        "benchmarks/deseq/{design}.tsv"
     wrapper:
         f"{git}/bio/deseq2/DESeq"
@@ -28,5 +28,7 @@ rule volcanoplot:
         fc_threshold = config["thresholds"].get("fc_threshold", 1)
     log:
         "logs/volcanoplot/volcano_{design}.log"
+    benchmark:
+        "benchmarks/volcanoplot/{design}.tsv"
     wrapper:
         f"{git}/bio/enhancedVolcano/volcano-deseq2"
@@ -1,41 +1,110 @@
 """
-This rule prepares DESeq2 output for further use with IGR GSEA shiny portal
+This rule prepares DESeq2 output for further use with IGR GSEA shiny portal.
+The gene annotation is indexed once, and the three tables are written in a
+single pass over DESeq2 results.
+
+With `gseaapp_batch`, all designs are converted within a single job,
+indexing the gene annotation only once.
 """
-rule deseq2_to_gseaapp:
-    input:
-        tsv = "deseq2/{design}/DESeq2_{design}.tsv",
-        gene2gene = "tximport/gene2gene.tsv"
-    output:
-        complete = report(
-            "GSEAapp/{design}/{design}_complete.tsv",
-            caption="../report/gseapp_complete.rst",
-            category="6. DGE Tables",
-            subcategory="{design}"
-        ),
-        fc_fc = report(
-            "GSEAapp/{design}/{design}_fc_fc.tsv",
-            caption="../report/gseapp_fc_fc.rst",
-            category="8. GSEAapp Shiny",
-            subcategory="{design}"
-        ),
-        padj_fc = report(
-            "GSEAapp/{design}/{design}_padj_fc.tsv",
-            category="8. GSEAapp Shiny",
-            caption="../report/gseapp_padj_fc.rst",
-            subcategory="{design}"
-        )
-    message:
-        "Subsetting DESeq2 results for {wildcards.design}"
-    threads:
-        1
-    resources:
-        mem_mb = (
-            lambda wildcards, attempt: min(attempt * 2048, 10240)
-        ),
-        time_min = (
-            lambda wildcards, attempt: min(attempt * 40, 200)
-        )
-    log:
-        "logs/deseq2_to_gseaapp/{design}.log"
-    wrapper:
-        f"{git}/bio/pandas/deseq2_to_gseaapp"
+if config["params"].get("gseaapp_batch", False) is True:
+    rule deseq2_to_gseaapp_batch:
+        input:
+            tsv = expand(
+                "deseq2/{design}/DESeq2_{design}.tsv",
+                design=config["models"].keys()
+            ),
+            gene2gene = "tximport/gene2gene.tsv"
+        output:
+            complete = [
+                report(
+                    f"GSEAapp/{design}/{design}_complete.tsv",
+                    caption="../report/gseapp_complete.rst",
+                    category="6. DGE Tables",
+                    subcategory=design
+                )
+                for design in config["models"].keys()
+            ],
+            fc_fc = [
+                report(
+                    f"GSEAapp/{design}/{design}_fc_fc.tsv",
+                    caption="../report/gseapp_fc_fc.rst",
+                    category="8. GSEAapp Shiny",
+                    subcategory=design
+                )
+                for design in config["models"].keys()
+            ],
+            padj_fc = [
+                report(
+                    f"GSEAapp/{design}/{design}_padj_fc.tsv",
+                    category="8. GSEAapp Shiny",
+                    caption="../report/gseapp_padj_fc.rst",
+                    subcategory=design
+                )
+                for design in config["models"].keys()
+            ]
+        message:
+            "Subsetting DESeq2 results for all designs"
+        threads:
+            1
+        resources:
+            mem_mb = (
+                lambda wildcards, attempt: min(attempt * 1024, 10240)
+            ),
+            time_min = (
+                lambda wildcards, attempt: min(
+                    attempt * 20 * len(config["models"].keys()), 200
+                )
+            )
+        params:
+            alpha_threshold = config["thresholds"].get("alpha_threshold", 0.05),
+            fc_threshold = config["thresholds"].get("fc_threshold", 1)
+        log:
+            "logs/deseq2_to_gseaapp/batch.log"
+        benchmark:
+            "benchmarks/deseq2_to_gseaapp_batch.tsv"
+        script:
+            "../scripts/deseq2_to_gseaapp.py"
+else:
+    rule deseq2_to_gseaapp:
+        input:
+            tsv = "deseq2/{design}/DESeq2_{design}.tsv",
+            gene2gene = "tximport/gene2gene.tsv"
+        output:
+            complete = report(
+                "GSEAapp/{design}/{design}_complete.tsv",
+                caption="../report/gseapp_complete.rst",
+                category="6. DGE Tables",
+                subcategory="{design}"
+            ),
+            fc_fc = report(
+                "GSEAapp/{design}/{design}_fc_fc.tsv",
+                caption="../report/gseapp_fc_fc.rst",
+                category="8. GSEAapp Shiny",
+                subcategory="{design}"
+            ),
+            padj_fc = report(
+                "GSEAapp/{design}/{design}_padj_fc.tsv",
+                category="8. GSEAapp Shiny",
+                caption="../report/gseapp_padj_fc.rst",
+                subcategory="{design}"
+            )
+        message:
+            "Subsetting DESeq2 results for {wildcards.design}"
+        threads:
+            1
+        resources:
+            mem_mb = (
+                lambda wildcards, attempt: min(attempt * 1024, 10240)
+            ),
+            time_min = (
+                lambda wildcards, attempt: min(attempt * 20, 200)
+            )
+        params:
+            alpha_threshold = config["thresholds"].get("alpha_threshold", 0.05),
+            fc_threshold = config["thresholds"].get("fc_threshold", 1)
+        log:
+            "logs/deseq2_to_gseaapp/{design}.log"
+        benchmark:
+            "benchmarks/deseq2_to_gseaapp/{design}.tsv"
+        script:
+            "../scripts/deseq2_to_gseaapp.py"
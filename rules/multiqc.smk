@@ -37,6 +37,8 @@ rule prepare_multiqc:
         ]
     log:
         "logs/multiqc/config_{design}.log"
+    benchmark:
+        "benchmarks/prepare_multiqc/{design}.tsv"
     wrapper:
         f"{git}/bio/BiGR/multiqc_rnaseq_report"
 
@@ -51,7 +53,7 @@ rule multiqc:
             #"multiqc/{design}/ma_plot_mqc.png",
             "multiqc/{design}/pca_axes_correlation_mqc.png"
         ],
-        salmon = design.Salmon.tolist()
+        salmon_qc = "qc/salmon_quantification_mqc.tsv"
     output:
         report(
             "multiqc/{design}/report.html",
@@ -74,5 +76,7 @@ rule multiqc:
         lambda w: f" --config multiqc/{w.design}/multiqc_config.yaml "
     log:
         "logs/multiqc/report/{design}.log"
+    benchmark:
+        "benchmarks/multiqc/{design}.tsv"
     wrapper:
         f"{git}/bio/multiqc"
@@ -1,9 +1,14 @@
 """
-This rule cleans the coldata file to build nicer reports
+This rule cleans the coldata file to build nicer reports. The design file
+itself is ancient: only edits of the reported columns re-run this rule
 """
 rule clean_coldata:
     input:
-        design = config["design"]
+        design = ancient(config["design"]),
+        columns = [
+            design_fingerprints[column] for column in design.columns
+            if column not in report_dropped_columns
+        ]
     output:
         tsv = report(
             "deseq2/filtered_design.tsv",
@@ -22,22 +27,92 @@ rule clean_coldata:
             lambda wildcards, attempt: min(attempt * 20, 200)
         )
     params:
-        filter_column = filter_design_columns(
-            design.columns.tolist(),
-            config.get("columns", None)
-        )
+        filter_column = report_dropped_columns
     log:
         "logs/design_filter/design_filter.log"
+    benchmark:
+        "benchmarks/clean_coldata.tsv"
     wrapper:
         f"{git}/bio/pandas/filter_design"
 
 
 """
-Plot clustered heatmap of samples among each others based on normalized counts
+This rule keeps the design columns read by DESeq2 with a model: its factor
+and the variables of its formula. It only re-runs when one of these
+columns is edited, see column_fingerprints. PCA intgroups are added
+afterwards, see pca_coldata
 """
-rule seaborn_clustermap:
+rule model_coldata:
+    input:
+        design = ancient(config["design"]),
+        columns = coldata_fingerprints
+    output:
+        tsv = "deseq2/{design}/coldata_{design}.tsv"
+    message:
+        "Filtering design columns read with {wildcards.design}"
+    threads:
+        1
+    resources:
+        mem_mb = (
+            lambda wildcards, attempt: min(attempt * 1024, 10240)
+        ),
+        time_min = (
+            lambda wildcards, attempt: min(attempt * 20, 200)
+        )
+    params:
+        filter_column = lambda wildcards: [
+            column for column in design.columns
+            if column not in coldata_columns(wildcards)
+        ]
+    log:
+        "logs/design_filter/{design}.log"
+    benchmark:
+        "benchmarks/model_coldata/{design}.tsv"
+    wrapper:
+        f"{git}/bio/pandas/filter_design"
+
+
+"""
+This rule keeps the normalized counts of the most variable genes, reading
+the normalized counts by chunks of genes, without loading them at once.
+The mean and variance of each gene are written along the way
+"""
+rule top_variable_genes:
     input:
         counts = "deseq2/{design}/normalized_counts.tsv"
+    output:
+        counts = temp("deseq2/{design}/top_variable_counts.tsv"),
+        stats = "deseq2/{design}/gene_variance.tsv"
+    message:
+        "Selecting the most variable genes on {wildcards.design}"
+    threads:
+        1
+    resources:
+        mem_mb = (
+            lambda wildcards, attempt: min(attempt * 1024, 10240)
+        ),
+        time_min = (
+            lambda wildcards, attempt: min(attempt * 20, 200)
+        )
+    params:
+        top = config["params"].get("clustermap_top_genes", 0),
+        chunk_size = 10000
+    log:
+        "logs/top_variable_genes/{design}.log"
+    benchmark:
+        "benchmarks/top_variable_genes/{design}.tsv"
+    script:
+        "../scripts/count_matrix.py"
+
+
+"""
+Plot clustered heatmap of samples among each others based on normalized
+counts, or on the most variable genes with params.clustermap_top_genes
+"""
+rule seaborn_clustermap:
+    input:
+        counts = clustermap_counts,
+        columns = clustermap_fingerprints
     output:
         png = report(
             "figures/{design}/sample_clustered_heatmap_{design}.png",
@@ -57,16 +132,15 @@ rule seaborn_clustermap:
             lambda wildcards, attempt: min(attempt * 20, 200)
         )
     params:
-        conditions = lambda wildcards: dict(
-            zip(
-                design.Sample_id,
-                design[str(wildcards.design).split("_compairing_")[0]]
-            )
+        conditions = lambda wildcards: get_condition_dict_w(
+            config["models"][wildcards.design]["factor"], design
         ),
-        factor = lambda wildcards: str(wildcards.design).split("_compairing_")[0],
+        factor = lambda wildcards: config["models"][wildcards.design]["factor"],
         ylabel_rotation = 0,
         xlabel_rotation = 90
     log:
         "logs/seaborn/clustermap/{design}.log"
+    benchmark:
+        "benchmarks/seaborn_clustermap/{design}.tsv"
     wrapper:
         f"{git}/bio/seaborn/clustermap"
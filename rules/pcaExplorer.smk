@@ -1,3 +1,70 @@
+"""
+This rule keeps the design columns read by PCA plots: the columns of the
+model and the PCA intgroups
+"""
+rule pcaexplorer_coldata:
+    input:
+        design = ancient(config["design"]),
+        columns = pca_coldata_fingerprints
+    output:
+        tsv = "pcaExplorer/{design}/coldata_{design}.tsv"
+    message:
+        "Filtering design columns plotted with {wildcards.design}"
+    threads:
+        1
+    resources:
+        mem_mb = (
+            lambda wildcards, attempt: min(attempt * 1024, 10240)
+        ),
+        time_min = (
+            lambda wildcards, attempt: min(attempt * 20, 200)
+        )
+    params:
+        filter_column = lambda wildcards: [
+            column for column in design.columns
+            if column not in coldata_columns(wildcards, pca=True)
+        ]
+    log:
+        "logs/design_filter/pcaexplorer_{design}.log"
+    benchmark:
+        "benchmarks/pcaexplorer_coldata/{design}.tsv"
+    wrapper:
+        f"{git}/bio/pandas/filter_design"
+
+
+"""
+This rule adds the PCA intgroups to DESeq2 objects. DESeq2 only reads the
+columns of its model: editing an intgroup re-runs the plots, not DESeq2
+"""
+rule pcaexplorer_add_coldata:
+    input:
+        rds = "deseq2/{design}/{object}_{design}.RDS",
+        coldata = "pcaExplorer/{design}/coldata_{design}.tsv"
+    output:
+        rds = "pcaExplorer/{design}/{object}_{design}.RDS"
+    message:
+        "Adding PCA intgroups to {wildcards.object} on {wildcards.design}"
+    threads:
+        1
+    resources:
+        mem_mb = (
+            lambda wildcards, attempt: min(attempt * 2048, 10240)
+        ),
+        time_min = (
+            lambda wildcards, attempt: min(attempt * 20, 200)
+        )
+    wildcard_constraints:
+        object = "Wald|dds"
+    conda:
+        "../envs/deseq2.yaml"
+    log:
+        "logs/pcaexplorer/add_coldata/{design}_{object}.log"
+    benchmark:
+        "benchmarks/pcaexplorer_add_coldata/{design}/{object}.tsv"
+    script:
+        "../scripts/pca_coldata.R"
+
+
 """
 This rule prepares an annotation designed to pcaExplorer.
 More information: https://github.com/tdayris/snakemake-wrappers/blob/Unofficial/bio/pcaExplorer/annotation
@@ -23,6 +90,8 @@ rule pcaexplorer_annot:
         design = "|".join(config["models"].keys())
     log:
         "logs/pcaexplorer/{design}_annot.log"
+    benchmark:
+        "benchmarks/pcaexplorer_annot/{design}.tsv"
     wrapper:
         f"{git}/bio/pcaExplorer/annotation"
 
@@ -57,6 +126,8 @@ rule limma_pca_to_go:
         )
     log:
         "logs/limma_pca_to_go/{design}.log"
+    benchmark:
+        "benchmarks/limma_pca_to_go/{design}.tsv"
     wrapper:
         f"{git}/bio/pcaExplorer/limmago"
 
@@ -94,6 +165,8 @@ rule distro_expr:
         design = "|".join(config["models"].keys())
     log:
         "logs/pcaexplorer/{design}_distro_expr.log"
+    benchmark:
+        "benchmarks/distro_expr/{design}.tsv"
 
     wrapper:
         f"{git}/bio/pcaExplorer/distro_expr"
@@ -131,6 +204,8 @@ rule pca_scree:
         design = "|".join(config["models"].keys())
     log:
         "logs/pcaexplorer/{design}_scree.log"
+    benchmark:
+        "benchmarks/pca_scree/{design}.tsv"
     wrapper:
         f"{git}/bio/pcaExplorer/PCAScree"
 
@@ -140,8 +215,8 @@ More information at: https://github.com/tdayris/snakemake-wrappers/blob/Unoffici
 """
 rule pcaexplorer_pcacorrs:
     input:
-        dst = "deseq2/{design}/Wald_{design}.RDS",
-        dds = "deseq2/{design}/dds_{design}.RDS"
+        dst = "pcaExplorer/{design}/Wald_{design}.RDS",
+        dds = "pcaExplorer/{design}/dds_{design}.RDS"
     output:
         png = report(
             "figures/{design}/pcacorrs_{design}.png",
@@ -170,6 +245,8 @@ rule pcaexplorer_pcacorrs:
         h = config["params"].get("plot_height", 768)
     log:
         "logs/pcaexplorer/{design}_pcacorrs.log"
+    benchmark:
+        "benchmarks/pcaexplorer_pcacorrs/{design}.tsv"
     wrapper:
         f"{git}/bio/pcaExplorer/plotCorrs"
 
@@ -180,7 +257,7 @@ More information at: https://github.com/tdayris/snakemake-wrappers/blob/Unoffici
 """
 rule pcaexplorer_pca:
     input:
-        dst = "deseq2/{design}/Wald_{design}.RDS"
+        dst = "pcaExplorer/{design}/Wald_{design}.RDS"
     output:
         png = report(
             "figures/{design}/pca/pca_{intgroup}_ax_{a}_ax_{b}_{elipse}.png",
@@ -208,6 +285,8 @@ rule pcaexplorer_pca:
         h = config["params"].get("plot_height", 768)
     log:
         "logs/pcaexplorer/PCA/design_{design}_ingroup_{intgroup}_ax_{a}_{b}_{elipse}.log"
+    benchmark:
+        "benchmarks/pcaexplorer_pca/{design}/{intgroup}_{a}_{b}_{elipse}.tsv"
     wrapper:
         f"{git}/bio/pcaExplorer/PCA"
 
@@ -242,17 +321,19 @@ rule pcaexplorer_pair_corr:
         h = config["params"].get("plot_height", 768)
     log:
         "logs/pcaexplorer/pairwise_scatterplot/{design}.log"
+    benchmark:
+        "benchmarks/pcaexplorer_pair_corr/{design}.tsv"
     wrapper:
         f"{git}/bio/pcaExplorer/pair_corr"
 
 
 rule pcaExplorer_write_script:
     input:
-        dds = "deseq2/{design}/dds_{design}.RDS",
-        dst = "deseq2/{design}/Wald_{design}.RDS",
+        dds = "pcaExplorer/{design}/dds_{design}.RDS",
+        dst = "pcaExplorer/{design}/Wald_{design}.RDS",
         annotation = "pcaExplorer/{design}/annotation_{design}.RDS",
         pca2go = "pcaExplorer/{design}/limmago_{design}.RDS",
-        coldata = "deseq2/filtered_design.tsv"
+        coldata = "pcaExplorer/{design}/coldata_{design}.tsv"
     output:
         script = "pcaExplorer/{design}/pcaExplorer_launcher_{design}.R"
     message:
@@ -268,5 +349,7 @@ rule pcaExplorer_write_script:
         )
     log:
         "logs/pcaExplorer/write_script/{design}.log"
+    benchmark:
+        "benchmarks/pcaExplorer_write_script/{design}.tsv"
     wrapper:
         f"{git}/bio/pcaExplorer/writeLaunchScript"
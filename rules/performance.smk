@@ -0,0 +1,41 @@
+"""
+This rule aggregates the benchmarks of all jobs (see the `benchmark`
+directives of each rule) per design and per rule: wall time, CPU
+efficiency, peak memory against requested memory, and I/O.
+
+It runs once every other target has been built.
+"""
+rule performance_summary:
+    input:
+        targets = lambda wildcards: [
+            path
+            for family in plan_targets(
+                config, design, True, True, True, True, True, False, True
+            ).values()
+            for path in family
+        ]
+    output:
+        summary = report(
+            "performance/benchmarks_summary.tsv",
+            caption="../report/performance.rst",
+            category="9. Performance"
+        )
+    message:
+        "Aggregating jobs benchmarks"
+    threads:
+        1
+    resources:
+        mem_mb = (
+            lambda wildcards, attempt: min(attempt * 512, 2048)
+        ),
+        time_min = (
+            lambda wildcards, attempt: min(attempt * 10, 60)
+        )
+    params:
+        benchmarks = "benchmarks",
+        designs = list(config["models"].keys()),
+        requested = lambda wildcards: requested_resources(workflow.rules)
+    log:
+        "logs/performance/summary.log"
+    script:
+        "../scripts/aggregate_benchmarks.py"
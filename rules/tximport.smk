@@ -1,12 +1,12 @@
 """
 This rule import salmon counts and possible inferential replicates
-with R for further DESeq2 analysis
+with R for further DESeq2 analysis. With params.gene_level_import, gene-level
+quantifications are imported as is when gene_quant_check validates them
 See: https://github.com/tdayris/snakemake-wrappers/tree/Unofficial/bio/tximport
 """
 rule tximport:
     input:
-        tx_to_gene = "tximport/tx_tab_gene.tsv",
-        quant = expand("{dir}/quant.sf", dir = design.Salmon)
+        unpack(tximport_input)
     output:
         txi = temp("tximport/txi.RDS")
     message:
@@ -21,16 +21,114 @@ rule tximport:
             lambda wildcards, attempt: min(attempt * 20, 200)
         )
     params:
-        extra = config["params"].get(
-            "tximport_extra",
-            "type='salmon', ignoreTxVersion=TRUE, ignoreAfterBar=TRUE"
-        )
+        extra = tximport_extra
     log:
         "logs/tximport.log"
+    benchmark:
+        "benchmarks/tximport.tsv"
     wrapper:
         f"{git}/bio/tximport"
 
 
+"""
+This rule checks the integrity of each Salmon quantification, and gathers
+their mapping rates and library formats, before tximport reads them
+"""
+rule salmon_quant_qc:
+    input:
+        quant = [f"{path}/quant.sf" for path in salmon_quant_dirs.values()]
+    output:
+        qc = "qc/salmon_quantification.tsv",
+        multiqc = "qc/salmon_quantification_mqc.tsv"
+    message:
+        "Checking Salmon quantifications"
+    threads:
+        min(len(salmon_quant_dirs), 8)
+    resources:
+        mem_mb = (
+            lambda wildcards, attempt: min(attempt * 1024, 10240)
+        ),
+        time_min = (
+            lambda wildcards, attempt: min(attempt * 20, 200)
+        )
+    params:
+        samples = list(salmon_quant_dirs.keys())
+    log:
+        "logs/salmon_quant_qc.log"
+    benchmark:
+        "benchmarks/salmon_quant_qc.tsv"
+    script:
+        "../scripts/salmon_quant_qc.py"
+
+
+"""
+This rule checks whether Salmon gene-level quantifications (quant.genes.sf)
+agree with the GTF gene set, and can replace the transcript-level import
+"""
+checkpoint gene_quant_check:
+    input:
+        quant = [f"{path}/quant.sf" for path in salmon_quant_dirs.values()],
+        gtf = get_gtf_path(config)
+    output:
+        check = "qc/gene_quantification.tsv"
+    message:
+        "Checking Salmon gene-level quantifications"
+    threads:
+        1
+    resources:
+        mem_mb = (
+            lambda wildcards, attempt: min(attempt * 1024, 10240)
+        ),
+        time_min = (
+            lambda wildcards, attempt: min(attempt * 20, 200)
+        )
+    params:
+        samples = list(salmon_quant_dirs.keys())
+    log:
+        "logs/gene_quant_check.log"
+    benchmark:
+        "benchmarks/gene_quant_check.tsv"
+    script:
+        "../scripts/gene_quant_check.py"
+
+
+"""
+This rule summarizes the inferential replicates of each sample: mean,
+variance and inferential relative variance of each transcript and gene.
+Bootstraps are streamed, one replicate at a time
+"""
+rule bootstrap_summary:
+    input:
+        meta_info = [
+            f"{path}/aux_info/meta_info.json"
+            for path in salmon_quant_dirs.values()
+        ],
+        tx_to_gene = "tximport/tx_tab_gene.tsv"
+    output:
+        samples = expand(
+            "bootstrap/samples/{sample}.tsv.gz",
+            sample=salmon_quant_dirs.keys()
+        ),
+        summary = "bootstrap/infrv_summary.tsv"
+    message:
+        "Summarizing Salmon inferential replicates"
+    threads:
+        min(len(salmon_quant_dirs), 8)
+    resources:
+        mem_mb = (
+            lambda wildcards, attempt: min(attempt * 2048, 10240)
+        ),
+        time_min = (
+            lambda wildcards, attempt: min(attempt * 60, 600)
+        )
+    log:
+        "logs/bootstrap_summary.log"
+    benchmark:
+        "benchmarks/bootstrap_summary.tsv"
+    script:
+        "../scripts/bootstrap_summary.py"
+
+
 """
 This rule builds a super-set ot the tx2gene table required by tximport, from
 a GTF file.
@@ -64,5 +162,7 @@ rule tx2gene:
         positions = True
     log:
         "logs/tx2gene/transcript_to_gene_id_to_gene_name.log"
+    benchmark:
+        "benchmarks/tx2gene.tsv"
     wrapper:
         f"{git}/bio/gtf/tx2gene"
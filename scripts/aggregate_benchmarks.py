@@ -0,0 +1,348 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+
+"""
+This script gathers the benchmark files written by Snakemake for each job
+(see the `benchmark` directives in rules/*.smk), and aggregates them per
+design and per rule.
+
+Benchmark files are expected under `benchmarks/<rule>.tsv` or
+`benchmarks/<rule>/<design>/...tsv`. Jobs that do not belong to a single
+design (e.g. tximport) are reported under the design `all`.
+
+For each design and rule, the following values are reported: the number of
+jobs, the total and the maximum wall time, the CPU efficiency (CPU time over
+wall time times threads), the maximum resident memory with the memory
+requested by the rule, and the amount of data read and written.
+
+You can test this script with:
+pytest -vv aggregate_benchmarks.py
+
+Usage example:
+python3.8 aggregate_benchmarks.py benchmarks \
+    --designs Condition_compairing_B_vs_A \
+    --requested requested.json \
+    --output performance/benchmarks_summary.tsv
+"""
+
+import argparse  # Parse command line
+import csv  # Read/Write TSV files line by line
+import json  # Load requested resources
+import logging  # Traces and loggings
+import math  # Handle NaN values
+import pytest  # Unit testing
+import shlex  # Lexical analysis
+import sys  # System related methods
+
+from pathlib import Path  # Paths related methods
+from typing import Any, Dict, Iterator, List, Optional, Tuple  # Type hints
+
+
+# Headers of the aggregated table
+SUMMARY_HEADER = [
+    "design", "rule", "jobs", "threads", "wall_time_s", "max_wall_time_s",
+    "cpu_efficiency", "max_rss_mb", "requested_mem_mb", "rss_over_requested",
+    "requested_time_min", "io_in_mb", "io_out_mb"
+]
+
+
+def parser() -> argparse.ArgumentParser:
+    """
+    Build the argument parser object
+    """
+    main_parser = argparse.ArgumentParser(
+        description=sys.modules[__name__].__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    main_parser.add_argument(
+        "benchmarks",
+        help="Path to the directory containing benchmark files",
+        type=str,
+        metavar="PATH",
+    )
+
+    main_parser.add_argument(
+        "--designs",
+        help="Space separated list of design names",
+        nargs="+",
+        default=[],
+        type=str,
+    )
+
+    main_parser.add_argument(
+        "--requested",
+        help="Path to a JSON file with the resources requested by each rule",
+        default=None,
+        type=str,
+    )
+
+    main_parser.add_argument(
+        "--output",
+        help="Path to the aggregated table (default: %(default)s)",
+        default="performance/benchmarks_summary.tsv",
+        type=str,
+    )
+
+    return main_parser
+
+
+def parse(args: Any) -> argparse.ArgumentParser:
+    """
+    Return an argument parser from command line
+    """
+    return parser().parse_args(args)
+
+
+def test_parse() -> None:
+    """
+    Test the argument parsing function
+    """
+    tested = parse(shlex.split("benchmarks --designs d1 d2"))
+    expected = argparse.Namespace(
+        benchmarks="benchmarks",
+        designs=["d1", "d2"],
+        output="performance/benchmarks_summary.tsv",
+        requested=None,
+    )
+    assert tested == expected
+
+
+def to_float(value: str) -> float:
+    """
+    Convert a benchmark value to float, NaN if missing
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def job_key(path: Path,
+            benchmarks: Path,
+            designs: List[str]) -> Tuple[str, str]:
+    """
+    Return the design and the rule a benchmark file belongs to
+    """
+    parts = path.relative_to(benchmarks).parts
+    if len(parts) == 1:
+        return "all", Path(parts[0]).stem
+
+    design = parts[1] if len(parts) > 2 else Path(parts[1]).stem
+    return (design if design in designs else "all"), parts[0]
+
+
+@pytest.mark.parametrize(
+    "path, expected", [
+        ("benchmarks/tximport.tsv", ("all", "tximport")),
+        ("benchmarks/deseq2/d1.tsv", ("d1", "deseq2")),
+        ("benchmarks/pca/d1/cond_1_2.tsv", ("d1", "pca")),
+        ("benchmarks/copy/S1.tsv", ("all", "copy")),
+    ]
+)
+def test_job_key(path: str, expected: Tuple[str, str]) -> None:
+    """
+    Test the function job_key above
+    """
+    assert job_key(Path(path), Path("benchmarks"), ["d1"]) == expected
+
+
+def read_benchmark(path: Path) -> Iterator[Dict[str, float]]:
+    """
+    Yield one record per line of a Snakemake benchmark file
+
+    Older Snakemake releases do not report `cpu_time`: it is then estimated
+    from the mean load.
+    """
+    with path.open() as benchmark:
+        for line in csv.DictReader(benchmark, delimiter="\t"):
+            record = {
+                key: to_float(line.get(key))
+                for key in ["s", "max_rss", "io_in", "io_out", "mean_load"]
+            }
+            record["cpu_time"] = to_float(line.get("cpu_time"))
+            if math.isnan(record["cpu_time"]):
+                record["cpu_time"] = record["mean_load"] / 100 * record["s"]
+            yield record
+
+
+def test_read_benchmark(tmp_path: Path) -> None:
+    """
+    Test the function read_benchmark above
+    """
+    path = tmp_path / "rule.tsv"
+    path.write_text(
+        "s\th:m:s\tmax_rss\tmax_vms\tmax_uss\tmax_pss\tio_in\tio_out\t"
+        "mean_load\n"
+        "10.0\t0:00:10\t512.5\t600\t500\t505\t1.5\t2.5\t150\n"
+        "2.0\t0:00:02\t-\t-\t-\t-\t-\t-\t-\n"
+    )
+    tested = list(read_benchmark(path))
+    assert tested[0]["cpu_time"] == 15.0
+    assert tested[0]["max_rss"] == 512.5
+    assert math.isnan(tested[1]["max_rss"])
+
+
+def ratio(numerator: float, denominator: Optional[float]) -> float:
+    """
+    Return a rounded ratio, NaN if it cannot be computed
+    """
+    if not denominator or math.isnan(numerator):
+        return math.nan
+    return round(numerator / denominator, 3)
+
+
+def nan_max(values: List[float]) -> float:
+    """
+    Return the maximum of the non-missing values, NaN if none
+    """
+    return max((value for value in values if not math.isnan(value)),
+               default=math.nan)
+
+
+def aggregate(benchmarks: Path,
+              designs: List[str],
+              requested: Dict[str, Dict[str, Any]]
+              ) -> List[Dict[str, Any]]:
+    """
+    Aggregate all benchmark files per design and per rule
+    """
+    jobs = {}
+    for path in sorted(benchmarks.glob("**/*.tsv")):
+        jobs.setdefault(job_key(path, benchmarks, designs), []).extend(
+            read_benchmark(path)
+        )
+
+    summary = []
+    for (design, rule), records in sorted(jobs.items()):
+        resources = requested.get(rule, {})
+        threads = resources.get("threads") or 1
+        wall_time = sum(record["s"] for record in records)
+        max_rss = nan_max([record["max_rss"] for record in records])
+        summary.append({
+            "design": design,
+            "rule": rule,
+            "jobs": len(records),
+            "threads": threads,
+            "wall_time_s": round(wall_time, 2),
+            "max_wall_time_s": nan_max([record["s"] for record in records]),
+            "cpu_efficiency": ratio(
+                sum(record["cpu_time"] for record in records),
+                wall_time * threads
+            ),
+            "max_rss_mb": max_rss,
+            "requested_mem_mb": resources.get("mem_mb"),
+            "rss_over_requested": ratio(max_rss, resources.get("mem_mb")),
+            "requested_time_min": resources.get("time_min"),
+            "io_in_mb": round(sum(
+                record["io_in"] for record in records
+                if not math.isnan(record["io_in"])
+            ), 2),
+            "io_out_mb": round(sum(
+                record["io_out"] for record in records
+                if not math.isnan(record["io_out"])
+            ), 2),
+        })
+    return summary
+
+
+def test_aggregate(tmp_path: Path) -> None:
+    """
+    Test the function aggregate above
+    """
+    header = "s\tmax_rss\tio_in\tio_out\tmean_load\tcpu_time\n"
+    (tmp_path / "deseq2").mkdir()
+    for design, line in [("d1", "10\t200\t1\t2\t0\t15\n"),
+                         ("d2", "4\t100\t1\t1\t0\t2\n")]:
+        (tmp_path / "deseq2" / f"{design}.tsv").write_text(header + line)
+    (tmp_path / "tximport.tsv").write_text(header + "6\t50\t5\t1\t0\t6\n")
+
+    tested = aggregate(
+        tmp_path, ["d1"],
+        {"deseq2": {"threads": 2, "mem_mb": 400, "time_min": None}}
+    )
+    assert [(row["design"], row["rule"]) for row in tested] == [
+        ("all", "deseq2"), ("all", "tximport"), ("d1", "deseq2")
+    ]
+    assert tested[2]["cpu_efficiency"] == 0.75
+    assert tested[2]["rss_over_requested"] == 0.5
+    assert tested[1]["requested_mem_mb"] is None
+    assert tested[1]["cpu_efficiency"] == 1.0
+    assert math.isnan(tested[1]["rss_over_requested"])
+
+
+def write_summary(summary: List[Dict[str, Any]], output: str) -> None:
+    """
+    Save the aggregated table as TSV
+    """
+    Path(output).parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", newline="") as table:
+        writer = csv.DictWriter(
+            table, fieldnames=SUMMARY_HEADER, delimiter="\t",
+            lineterminator="\n", restval="NA"
+        )
+        writer.writeheader()
+        for row in summary:
+            writer.writerow({
+                key: "NA" if value is None or (
+                    isinstance(value, float) and math.isnan(value)
+                ) else value
+                for key, value in row.items()
+            })
+
+
+def test_write_summary(tmp_path: Path) -> None:
+    """
+    Test the function write_summary above
+    """
+    output = tmp_path / "performance" / "summary.tsv"
+    write_summary(
+        [{"design": "d1", "rule": "r", "jobs": 1, "max_rss_mb": math.nan}],
+        str(output)
+    )
+    lines = output.read_text().splitlines()
+    assert lines[0].split("\t") == SUMMARY_HEADER
+    assert lines[1].split("\t")[:4] == ["d1", "r", "1", "NA"]
+
+
+def main(args: argparse.ArgumentParser) -> None:
+    """
+    Main function of the script
+    """
+    requested = args.requested
+    if isinstance(requested, str):
+        with open(requested) as requested_json:
+            requested = json.load(requested_json)
+
+    summary = aggregate(Path(args.benchmarks), args.designs, requested or {})
+    logging.info(
+        "%i rule(s) and design(s) aggregated from %s",
+        len(summary), args.benchmarks
+    )
+    write_summary(summary, args.output)
+
+
+# Running programm if not imported
+if __name__ == "__main__":
+    if "snakemake" in globals():
+        # Called through Snakemake's script directive
+        logging.basicConfig(
+            filename=snakemake.log[0], filemode="w", level=10
+        )
+        args = argparse.Namespace(
+            benchmarks=snakemake.params["benchmarks"],
+            designs=list(snakemake.params["designs"]),
+            requested=snakemake.params["requested"],
+            output=snakemake.output["summary"]
+        )
+    else:
+        args = parse(sys.argv[1:])
+        logging.basicConfig(level=10)
+
+    try:
+        main(args)
+    except Exception as e:
+        logging.exception("%s", e)
+        raise
+
+    logging.info("Process over")
@@ -0,0 +1,524 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+
+"""
+This script measures how the workflow scales with the size of the cohort.
+
+Synthetic cohorts are built from the Salmon quantifications available in
+test/pseudo_mapping: samples are drawn from these fixtures with random
+read count variations, design columns and models are added, and both
+quantifications and gene annotation (GTF) are extended with synthetic
+transcripts. Nothing is downloaded: the benchmark runs offline.
+
+For each cohort, the following stages are timed (best of --repeat runs):
+- design_loading: design parsing and validation
+- config_validation: configuration validation
+- get_targets: planning of all target paths
+- snakefile_parsing: Snakefile parsing (snakemake --list)
+- dry_run: Snakefile parsing and DAG building (snakemake --dry-run)
+- gseaapp_conversion: DESeq2 results conversion for GSEAapp
+
+Results are written as JSON, along with the current commit, so that runs
+can be compared across commits.
+
+You can test this script with:
+pytest -vv benchmark_workflow.py
+
+Usage example:
+python3.8 benchmark_workflow.py --samples 10 100 1000 --factors 3 \
+    --models 2 --transcripts 10000 --output benchmark.json
+"""
+
+import argparse  # Parse command line
+import datetime  # Date of the benchmark
+import itertools  # Cohort combinations
+import json  # Write results
+import logging  # Traces and loggings
+import numpy  # Random read counts
+import os  # OS related operations
+import pandas  # Handle quantification tables
+import platform  # Benchmark host description
+import shlex  # Lexical analysis
+import shutil  # Copy fixtures
+import subprocess  # Call snakemake
+import sys  # System related methods
+import tempfile  # Scratch directories
+import time  # Measure wall time
+
+from pathlib import Path  # Paths related methods
+from typing import Any, Callable, Dict, List, Optional  # Type hints
+
+from snakemake.utils import validate  # Schema validation
+
+REPO = Path(os.path.realpath(__file__)).parent.parent
+sys.path.append(str(REPO / "rules"))
+from common_rna_dge_salmon_deseq2 import (  # noqa: E402
+    count_targets, load_config, load_design, plan_targets
+)
+import deseq2_to_gseaapp  # noqa: E402
+import prepare_config  # noqa: E402
+
+FIXTURES = REPO / "test" / "pseudo_mapping"
+FIXTURE_FILES = ["cmd_info.json", "lib_format_counts.json"]
+LEVELS = ["A", "B"]
+
+
+def parser() -> argparse.ArgumentParser:
+    """
+    Build the argument parser object
+    """
+    main_parser = argparse.ArgumentParser(
+        description=sys.modules[__name__].__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+
+    main_parser.add_argument(
+        "--samples",
+        help="Numbers of samples in synthetic cohorts (default: %(default)s)",
+        type=int,
+        nargs="+",
+        default=[10, 100]
+    )
+    main_parser.add_argument(
+        "--factors",
+        help="Numbers of design columns (default: %(default)s)",
+        type=int,
+        nargs="+",
+        default=[2]
+    )
+    main_parser.add_argument(
+        "--models",
+        help="Numbers of DESeq2 models (default: %(default)s)",
+        type=int,
+        nargs="+",
+        default=[1]
+    )
+    main_parser.add_argument(
+        "--transcripts",
+        help="Numbers of transcripts in the synthetic annotation. Fixtures "
+             "are completed with synthetic transcripts when needed "
+             "(default: %(default)s)",
+        type=int,
+        nargs="+",
+        default=[2412]
+    )
+    main_parser.add_argument(
+        "--repeat",
+        help="Number of runs per stage, the best one is kept "
+             "(default: %(default)s)",
+        type=int,
+        default=3
+    )
+    main_parser.add_argument(
+        "--snakefile",
+        help="Path to the Snakefile (default: %(default)s)",
+        type=str,
+        default=str(REPO / "Snakefile")
+    )
+    main_parser.add_argument(
+        "--no-snakemake",
+        help="Do not time Snakefile parsing and dry-run",
+        action="store_true",
+        default=False
+    )
+    main_parser.add_argument(
+        "--workdir",
+        help="Where synthetic cohorts are written (default: temporary "
+             "directory)",
+        type=str,
+        default=None
+    )
+    main_parser.add_argument(
+        "--output",
+        help="Path to the JSON results (default: %(default)s)",
+        type=str,
+        default="benchmark.json"
+    )
+    main_parser.add_argument(
+        "--seed",
+        help="Random seed (default: %(default)s)",
+        type=int,
+        default=42
+    )
+    return main_parser
+
+
+def parse(args: Any) -> argparse.ArgumentParser:
+    """
+    Return an argument parser from command line
+    """
+    return parser().parse_args(args)
+
+
+def test_parse() -> None:
+    """
+    Test the argument parsing function
+    """
+    options = parse(shlex.split("--samples 10 20 --no-snakemake"))
+    assert options.samples == [10, 20]
+    assert options.factors == [2]
+    assert options.no_snakemake is True
+
+
+def fixture_samples() -> List[Path]:
+    """
+    Return the Salmon quantification directories of the test dataset
+    """
+    return sorted(path.parent for path in FIXTURES.glob("*/quant.sf"))
+
+
+def synthetic_quant(transcripts: int,
+                    rng: numpy.random.Generator) -> pandas.DataFrame:
+    """
+    Return a template quantification table with the requested number of
+    transcripts: fixture transcripts first, then synthetic ones modelled
+    on them.
+    """
+    template = pandas.read_csv(
+        fixture_samples()[0] / "quant.sf", sep="\t", header=0
+    )
+    missing = transcripts - len(template)
+    if missing > 0:
+        extra = template.sample(n=missing, replace=True, random_state=rng)
+        extra["Name"] = [f"ENSTSYN{i:011d}" for i in range(missing)]
+        template = pandas.concat([template, extra], ignore_index=True)
+    return template.head(transcripts).reset_index(drop=True)
+
+
+def write_gtf(quant: pandas.DataFrame,
+              gtf_path: Path,
+              transcripts_per_gene: int = 3) -> None:
+    """
+    Write a gene annotation with one gene per `transcripts_per_gene`
+    transcripts of the quantification table
+    """
+    with gtf_path.open("w") as gtf:
+        for i, (name, length) in enumerate(zip(quant["Name"],
+                                               quant["Length"])):
+            gene = f"ENSGSYN{i // transcripts_per_gene:011d}"
+            start = 1000 * i + 1
+            end = start + int(length) - 1
+            attributes = (
+                f'gene_id "{gene}"; transcript_id "{name}"; '
+                f'gene_name "GENE{i // transcripts_per_gene}";'
+            )
+            for feature in ("transcript", "exon"):
+                gtf.write(
+                    f"chrS\tbenchmark\t{feature}\t{start}\t{end}\t.\t+\t.\t"
+                    f"{attributes}\n"
+                )
+
+
+def synthesize_cohort(outdir: Path,
+                      samples: int,
+                      factors: int,
+                      models: int,
+                      transcripts: int,
+                      seed: int = 42) -> Dict[str, str]:
+    """
+    Write a synthetic cohort: Salmon quantifications, gene annotation,
+    design and configuration. Return the paths to the last three.
+    """
+    rng = numpy.random.default_rng(seed)
+    outdir.mkdir(parents=True, exist_ok=True)
+    template = synthetic_quant(transcripts, rng)
+    fixtures = fixture_samples()
+
+    gtf_path = outdir / "annotation.gtf"
+    write_gtf(template, gtf_path)
+
+    rows = []
+    for i in range(samples):
+        fixture = fixtures[i % len(fixtures)]
+        sample_dir = outdir / "salmon" / f"S{i}"
+        (sample_dir / "aux_info").mkdir(parents=True, exist_ok=True)
+
+        quant = template.copy()
+        quant["NumReads"] = (
+            quant["NumReads"] * rng.lognormal(0, 0.3, len(quant))
+        ).round(3)
+        rate = quant["NumReads"] / quant["EffectiveLength"].clip(lower=1)
+        quant["TPM"] = (rate / rate.sum() * 1e6).round(6)
+        quant.to_csv(sample_dir / "quant.sf", sep="\t", index=False)
+
+        for name in FIXTURE_FILES:
+            shutil.copy(fixture / name, sample_dir / name)
+        with (fixture / "aux_info" / "meta_info.json").open() as meta:
+            meta_info = json.load(meta)
+        meta_info["num_valid_targets"] = len(quant)
+        with (sample_dir / "aux_info" / "meta_info.json").open("w") as meta:
+            json.dump(meta_info, meta, indent=4)
+
+        row = {"Sample_id": f"S{i}", "Salmon": str(sample_dir)}
+        for factor in range(factors):
+            # Balanced levels, shifted between factors to avoid confounding
+            row[f"Factor{factor}"] = LEVELS[(i // (factor + 1)) % len(LEVELS)]
+        rows.append(row)
+
+    design_path = outdir / "design.tsv"
+    pandas.DataFrame(rows).to_csv(design_path, sep="\t", index=False)
+
+    model_args = [
+        f"Factor{model % factors},B,A,~Factor{model % factors}"
+        for model in range(models)
+    ]
+    config = prepare_config.args_to_dict(prepare_config.parse([
+        str(gtf_path), "--models", *model_args,
+        "--design", str(design_path)
+    ]))
+    config_path = outdir / "config.yaml"
+    with config_path.open("w") as config_stream:
+        json.dump(config, config_stream, indent=2)
+
+    return {
+        "gtf": str(gtf_path),
+        "design": str(design_path),
+        "config": str(config_path)
+    }
+
+
+def test_synthesize_cohort(tmp_path: Path) -> None:
+    """
+    Test the above function synthesize_cohort
+    """
+    paths = synthesize_cohort(tmp_path, 12, 2, 3, 2500, seed=1)
+    design = pandas.read_csv(paths["design"], sep="\t")
+    assert len(design) == 12
+    assert list(design.columns) == [
+        "Sample_id", "Salmon", "Factor0", "Factor1"
+    ]
+    assert set(design["Factor1"]) == {"A", "B"}
+
+    quant = pandas.read_csv(
+        Path(design["Salmon"][11]) / "quant.sf", sep="\t"
+    )
+    assert len(quant) == 2500
+    assert quant["Name"].is_unique
+    with open(paths["gtf"]) as gtf:
+        assert sum(1 for line in gtf) == 2 * 2500
+
+    with open(paths["config"]) as config_stream:
+        config = json.load(config_stream)
+    assert len(config["models"]) == 2  # Models on Factor0 are the same
+    assert config["design"] == paths["design"]
+
+
+def best_time(function: Callable, repeat: int) -> float:
+    """
+    Return the best wall time of a function over `repeat` calls
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def snakemake_time(snakefile: str,
+                   paths: Dict[str, str],
+                   extra: List[str],
+                   repeat: int) -> Optional[float]:
+    """
+    Return the best wall time of a snakemake call on a cohort, or None if
+    snakemake failed
+    """
+    cmd = [
+        "snakemake", "-s", snakefile, "--directory",
+        str(Path(paths["config"]).parent), "--configfile", paths["config"],
+        "--quiet", *extra
+    ]
+    try:
+        return best_time(
+            lambda: subprocess.run(cmd, check=True,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT),
+            repeat
+        )
+    except subprocess.CalledProcessError as error:
+        logging.error("%s failed:\n%s", " ".join(cmd), error.stdout.decode())
+        return None
+
+
+def gseaapp_inputs(outdir: Path,
+                   paths: Dict[str, str],
+                   rng: numpy.random.Generator) -> Dict[str, str]:
+    """
+    Write DESeq2-like results and gene2gene tables for all genes of a
+    synthetic annotation
+    """
+    genes = sorted({
+        line.split('gene_id "')[1].split('"')[0]
+        for line in open(paths["gtf"])
+    })
+    gene2gene = outdir / "gene2gene.tsv"
+    pandas.DataFrame({
+        "Gene_ID": genes, "Gene_Name": [f"N{gene}" for gene in genes]
+    }).to_csv(gene2gene, sep="\t", index=False)
+
+    deseq2 = outdir / "DESeq2.tsv"
+    pandas.DataFrame({
+        "baseMean": rng.uniform(0, 1000, len(genes)),
+        "log2FoldChange": rng.normal(0, 2, len(genes)),
+        "lfcSE": rng.uniform(0, 1, len(genes)),
+        "stat": rng.normal(0, 3, len(genes)),
+        "pvalue": rng.uniform(0, 1, len(genes)),
+        "padj": rng.uniform(0, 1, len(genes)),
+    }, index=genes).to_csv(deseq2, sep="\t")
+    return {"gene2gene": str(gene2gene), "deseq2": str(deseq2)}
+
+
+def benchmark_cohort(outdir: Path,
+                     samples: int,
+                     factors: int,
+                     models: int,
+                     transcripts: int,
+                     repeat: int,
+                     snakefile: Optional[str],
+                     seed: int = 42) -> Dict[str, Any]:
+    """
+    Build a synthetic cohort and time each stage on it
+    """
+    logging.info(
+        f"Benchmarking {samples} samples, {factors} factors, {models} "
+        f"models, {transcripts} transcripts"
+    )
+    paths = synthesize_cohort(
+        outdir, samples, factors, models, transcripts, seed
+    )
+    with open(paths["config"]) as config_stream:
+        config = json.load(config_stream)
+    schemas = REPO / "schemas"
+    timings = {}
+
+    # Validation cache is disabled: a new directory for each call
+    timings["design_loading"] = best_time(
+        lambda: load_design(
+            paths["design"], str(schemas / "design.schema.yaml"), validate,
+            tempfile.mkdtemp(dir=outdir)
+        ),
+        repeat
+    )
+    timings["config_validation"] = best_time(
+        lambda: load_config(
+            json.loads(json.dumps(config)),
+            str(schemas / "config.schema.yaml"), validate,
+            tempfile.mkdtemp(dir=outdir)
+        ),
+        repeat
+    )
+
+    design = load_design(
+        paths["design"], str(schemas / "design.schema.yaml"), validate,
+        str(outdir / "validation-cache")
+    )
+    targets = plan_targets(config, design, True, True, True, True, True)
+    timings["get_targets"] = best_time(
+        lambda: [list(family) for family in plan_targets(
+            config, design, True, True, True, True, True
+        ).values()],
+        repeat
+    )
+
+    if snakefile is not None:
+        timings["snakefile_parsing"] = snakemake_time(
+            snakefile, paths, ["--list"], repeat
+        )
+        timings["dry_run"] = snakemake_time(
+            snakefile, paths, ["--dry-run"], repeat
+        )
+
+    gseaapp = gseaapp_inputs(outdir, paths, numpy.random.default_rng(seed))
+    timings["gseaapp_conversion"] = best_time(
+        lambda: deseq2_to_gseaapp.convert(
+            gseaapp["deseq2"],
+            deseq2_to_gseaapp.gene_index(gseaapp["gene2gene"]),
+            str(outdir / "complete.tsv"),
+            str(outdir / "fc_fc.tsv"),
+            str(outdir / "padj_fc.tsv")
+        ),
+        repeat
+    )
+
+    return {
+        "samples": samples,
+        "factors": factors,
+        "models": len(config["models"]),
+        "transcripts": transcripts,
+        "targets": count_targets(targets),
+        "timings": timings
+    }
+
+
+def test_benchmark_cohort(tmp_path: Path) -> None:
+    """
+    Test the above function benchmark_cohort, without snakemake
+    """
+    tested = benchmark_cohort(tmp_path, 4, 2, 1, 100, 1, None)
+    assert tested["targets"]["deseq2"] == 1
+    assert set(tested["timings"].keys()) == {
+        "design_loading", "config_validation", "get_targets",
+        "gseaapp_conversion"
+    }
+    assert all(timing > 0 for timing in tested["timings"].values())
+
+
+def current_commit() -> Optional[str]:
+    """
+    Return the current commit of the pipeline, if available
+    """
+    try:
+        return subprocess.run(
+            ["git", "-C", str(REPO), "rev-parse", "HEAD"], check=True,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        ).stdout.decode().strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+def main(args: argparse.ArgumentParser) -> None:
+    """
+    Main function of the script
+    """
+    import snakemake
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="benchmark_"))
+    runs = [
+        benchmark_cohort(
+            workdir / f"cohort_{samples}_{factors}_{models}_{transcripts}",
+            samples, factors, models, transcripts, args.repeat,
+            None if args.no_snakemake else args.snakefile, args.seed
+        )
+        for samples, factors, models, transcripts in itertools.product(
+            args.samples, args.factors, args.models, args.transcripts
+        )
+    ]
+
+    results = {
+        "commit": current_commit(),
+        "date": datetime.datetime.now().isoformat(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "snakemake": snakemake.__version__,
+        "repeat": args.repeat,
+        "runs": runs
+    }
+    with open(args.output, "w") as output:
+        json.dump(results, output, indent=2)
+    logging.info(f"Results written to {args.output}")
+
+    if args.workdir is None:
+        shutil.rmtree(workdir)
+
+
+# Running programm if not imported
+if __name__ == "__main__":
+    args = parse(sys.argv[1:])
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        main(args)
+    except Exception as e:
+        logging.exception("%s", e)
+        raise
+
+    logging.info("Process over")
@@ -0,0 +1,485 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+
+"""
+This script summarizes the inferential replicates (bootstraps) of Salmon
+quantifications, without loading them in memory.
+
+The bootstraps of each sample (`aux_info/bootstrap/bootstraps.gz`) are read
+one replicate at a time. Mean and variance of each transcript, and of each
+gene (sum of its transcripts within a replicate), are updated online with
+Welford's algorithm: memory does not depend on the number of bootstraps.
+The inferential relative variance (InfRV) is then computed as in
+fishpond::computeInfRV:
+
+    InfRV = max(variance - mean, 0) / (mean + 5) + 0.01
+
+Samples are summarized in parallel. One table per sample is written, along
+with a summary of all samples: mean abundance, mean and maximum InfRV of
+each transcript and gene.
+
+You can test this script with:
+pytest -vv bootstrap_summary.py
+
+Usage example:
+python3.8 bootstrap_summary.py /path/to/S1 /path/to/S2 \
+    --tx2gene tximport/tx_tab_gene.tsv \
+    --outputs bootstrap/samples/S1.tsv.gz bootstrap/samples/S2.tsv.gz \
+    --summary bootstrap/infrv_summary.tsv \
+    --threads 2
+"""
+
+import argparse  # Parse command line
+import csv  # Read/Write TSV files line by line
+import gzip  # Read Salmon bootstraps
+import json  # Read Salmon metadata
+import logging  # Traces and loggings
+import numpy  # Vectorized online statistics
+import os  # OS related operations
+import pytest  # Unit testing
+import shlex  # Lexical analysis
+import sys  # System related methods
+
+from multiprocessing.pool import ThreadPool  # Summarize samples in parallel
+from pathlib import Path  # Paths related methods
+from typing import Any, Dict, Iterator, List, Optional, Tuple  # Type hints
+
+try:
+    from scripts.gene_quant_check import strip_id
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+    from gene_quant_check import strip_id
+
+
+# fishpond::computeInfRV default pseudo-count and shift
+INFRV_PSEUDOCOUNT = 5
+INFRV_SHIFT = 0.01
+SAMPLE_HEADER = ["Name", "level", "mean", "variance", "infrv"]
+SUMMARY_HEADER = [
+    "Name", "level", "samples", "mean", "mean_infrv", "max_infrv"
+]
+
+
+def parser() -> argparse.ArgumentParser:
+    """
+    Build the argument parser object
+    """
+    main_parser = argparse.ArgumentParser(
+        description=sys.modules[__name__].__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    main_parser.add_argument(
+        "salmon",
+        help="Space separated list of Salmon quantification directories",
+        nargs="+",
+        type=str,
+        metavar="PATH",
+    )
+
+    main_parser.add_argument(
+        "--tx2gene",
+        help="Path to a transcript to gene table, with a header. "
+             "Only transcripts are summarized without it",
+        default=None,
+        type=str,
+    )
+
+    main_parser.add_argument(
+        "--outputs",
+        help="Space separated list of per-sample tables, one per directory",
+        nargs="+",
+        required=True,
+        type=str,
+    )
+
+    main_parser.add_argument(
+        "--summary",
+        help="Path to the summary of all samples (default: %(default)s)",
+        default="bootstrap/infrv_summary.tsv",
+        type=str,
+    )
+
+    main_parser.add_argument(
+        "--threads",
+        help="Number of samples summarized at once (default: %(default)s)",
+        default=1,
+        type=int,
+    )
+
+    return main_parser
+
+
+def parse(args: Any) -> argparse.ArgumentParser:
+    """
+    Return an argument parser from command line
+    """
+    return parser().parse_args(args)
+
+
+def test_parse() -> None:
+    """
+    Test the argument parsing function
+    """
+    tested = parse(shlex.split("S1 --outputs S1.tsv.gz"))
+    expected = argparse.Namespace(
+        salmon=["S1"],
+        tx2gene=None,
+        outputs=["S1.tsv.gz"],
+        summary="bootstrap/infrv_summary.tsv",
+        threads=1,
+    )
+    assert tested == expected
+
+
+class RunningMoments:
+    """
+    Online mean and variance of vectors (Welford's algorithm)
+    """
+    def __init__(self, size: int) -> None:
+        self.count = 0
+        self.mean = numpy.zeros(size)
+        self._m2 = numpy.zeros(size)
+
+    def update(self, values: numpy.ndarray) -> None:
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (values - self.mean)
+
+    @property
+    def variance(self) -> numpy.ndarray:
+        """
+        Unbiased variance, as computed by tximport and fishpond
+        """
+        if self.count < 2:
+            return numpy.full_like(self.mean, numpy.nan)
+        return self._m2 / (self.count - 1)
+
+
+def test_running_moments() -> None:
+    """
+    Test the class RunningMoments above
+    """
+    values = numpy.random.default_rng(0).gamma(2, 10, size=(50, 4))
+    moments = RunningMoments(4)
+    for row in values:
+        moments.update(row)
+    assert moments.count == 50
+    assert moments.mean == pytest.approx(values.mean(axis=0))
+    assert moments.variance == pytest.approx(values.var(axis=0, ddof=1))
+
+
+def infrv(mean: numpy.ndarray, variance: numpy.ndarray) -> numpy.ndarray:
+    """
+    Return the inferential relative variance of each feature
+    """
+    return numpy.maximum(variance - mean, 0) / (mean + INFRV_PSEUDOCOUNT) \
+        + INFRV_SHIFT
+
+
+def test_infrv() -> None:
+    """
+    Test the function infrv above
+    """
+    tested = infrv(numpy.array([10.0, 10.0]), numpy.array([5.0, 40.0]))
+    assert tested == pytest.approx([0.01, 2.01])
+
+
+def read_names(path: Path) -> List[str]:
+    """
+    Return the transcript names of the bootstraps, in order
+    """
+    with gzip.open(path, "rt") as names:
+        return names.read().strip().split("\t")
+
+
+def iter_replicates(path: Path, size: int) -> Iterator[numpy.ndarray]:
+    """
+    Yield the bootstraps of a sample one at a time, from Salmon's binary
+    format: consecutive vectors of little-endian doubles. The same buffer
+    is filled for each replicate.
+    """
+    buffer = bytearray(size * 8)
+    view = memoryview(buffer)
+    with gzip.open(path, "rb") as bootstraps:
+        while True:
+            read = 0
+            while read < len(buffer):
+                chunk = bootstraps.readinto(view[read:])
+                if not chunk:
+                    break
+                read += chunk
+            if read == 0:
+                return
+            if read < len(buffer):
+                raise ValueError(
+                    f"{path} is truncated: {read} bytes in the last "
+                    f"replicate, {len(buffer)} expected"
+                )
+            yield numpy.frombuffer(buffer, dtype="<f8")
+
+
+def test_iter_replicates(tmp_path: Path) -> None:
+    """
+    Test the function iter_replicates above
+    """
+    path = tmp_path / "bootstraps.gz"
+    values = numpy.arange(6, dtype="<f8")
+    with gzip.open(path, "wb") as bootstraps:
+        bootstraps.write(values.tobytes())
+    assert [list(row) for row in iter_replicates(path, 3)] == [
+        [0, 1, 2], [3, 4, 5]
+    ]
+    with pytest.raises(ValueError, match="truncated"):
+        list(iter_replicates(path, 4))
+
+
+def read_tx2gene(path: Optional[str]) -> Dict[str, str]:
+    """
+    Return the gene of each transcript, versions being ignored
+    """
+    if path is None:
+        return {}
+    with open(path) as table:
+        reader = csv.reader(table, delimiter="\t")
+        next(reader, None)
+        return {
+            strip_id(row[0]): row[1] for row in reader if len(row) >= 2
+        }
+
+
+def gene_index(names: List[str],
+               tx2gene: Dict[str, str]) -> Tuple[List[str], numpy.ndarray]:
+    """
+    Return the genes, and the gene of each transcript as an index in this
+    list (-1 for transcripts without gene)
+    """
+    genes, positions, index = [], {}, []
+    for name in names:
+        gene = tx2gene.get(strip_id(name))
+        if gene is None:
+            index.append(-1)
+            continue
+        if gene not in positions:
+            positions[gene] = len(genes)
+            genes.append(gene)
+        index.append(positions[gene])
+    return genes, numpy.array(index, dtype=numpy.int64)
+
+
+def summarize_sample(directory: str,
+                     tx2gene: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Return the mean, variance and InfRV of the transcripts and genes of a
+    sample, from its bootstraps
+    """
+    bootstrap_dir = Path(directory) / "aux_info" / "bootstrap"
+    names = read_names(bootstrap_dir / "names.tsv.gz")
+    genes, index = gene_index(names, tx2gene)
+    mapped = index >= 0
+
+    transcripts = RunningMoments(len(names))
+    gene_moments = RunningMoments(len(genes))
+    for replicate in iter_replicates(
+            bootstrap_dir / "bootstraps.gz", len(names)):
+        transcripts.update(replicate)
+        if genes:
+            gene_moments.update(numpy.bincount(
+                index[mapped], weights=replicate[mapped],
+                minlength=len(genes)
+            ))
+
+    meta_info = Path(directory) / "aux_info" / "meta_info.json"
+    if meta_info.exists():
+        with meta_info.open() as metadata:
+            expected = json.load(metadata).get("num_bootstraps")
+        if expected is not None and expected != transcripts.count:
+            raise ValueError(
+                f"{transcripts.count} bootstraps found in {directory}, "
+                f"{expected} expected"
+            )
+
+    levels = {"transcript": (names, transcripts)}
+    if genes:
+        levels["gene"] = (genes, gene_moments)
+    summary = {
+        level: {
+            "names": features,
+            "mean": moments.mean,
+            "variance": moments.variance,
+            "infrv": infrv(moments.mean, moments.variance)
+        }
+        for level, (features, moments) in levels.items()
+    }
+    summary["bootstraps"] = transcripts.count
+    summary["unmapped"] = int((~mapped).sum())
+    return summary
+
+
+def test_summarize_sample() -> None:
+    """
+    Test the function summarize_sample above
+    """
+    directory = "test/pseudo_mapping/a.chr21.1"
+    names = read_names(Path(directory, "aux_info", "bootstrap",
+                            "names.tsv.gz"))
+    tx2gene = {strip_id(name): f"G{i % 10}" for i, name in enumerate(names)}
+    tested = summarize_sample(directory, tx2gene)
+    assert tested["bootstraps"] == 100
+    assert len(tested["transcript"]["mean"]) == 2412
+    assert tested["gene"]["names"][:2] == ["G0", "G1"]
+    # Gene means are the sums of their transcripts means
+    assert tested["gene"]["mean"].sum() == \
+        pytest.approx(tested["transcript"]["mean"].sum())
+    assert (tested["transcript"]["infrv"] >= INFRV_SHIFT).all()
+
+
+def write_sample(summary: Dict[str, Any], output: str) -> None:
+    """
+    Save the summary of a sample as a compressed TSV
+    """
+    Path(output).parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(output, "wt", newline="") as table:
+        writer = csv.writer(table, delimiter="\t", lineterminator="\n")
+        writer.writerow(SAMPLE_HEADER)
+        for level in ["transcript", "gene"]:
+            if level not in summary:
+                continue
+            values = summary[level]
+            for row in zip(values["names"], values["mean"],
+                           values["variance"], values["infrv"]):
+                writer.writerow([row[0], level] + [
+                    f"{value:.6g}" for value in row[1:]
+                ])
+
+
+class SummaryAccumulator:
+    """
+    Sums of abundances and InfRV across samples, per feature
+    """
+    def __init__(self) -> None:
+        self.levels = {}
+
+    def add(self, summary: Dict[str, Any]) -> None:
+        for level in ["transcript", "gene"]:
+            if level not in summary:
+                continue
+            values = summary[level]
+            if level not in self.levels:
+                self.levels[level] = {
+                    "names": values["names"],
+                    "samples": 0,
+                    "mean": numpy.zeros(len(values["names"])),
+                    "infrv": numpy.zeros(len(values["names"])),
+                    "max_infrv": numpy.zeros(len(values["names"])),
+                }
+            total = self.levels[level]
+            if total["names"] != values["names"]:
+                raise ValueError(
+                    f"Samples do not share the same {level}s: were they "
+                    "quantified with the same index?"
+                )
+            total["samples"] += 1
+            total["mean"] += values["mean"]
+            total["infrv"] += values["infrv"]
+            numpy.fmax(total["max_infrv"], values["infrv"],
+                       out=total["max_infrv"])
+
+    def write(self, output: str) -> None:
+        Path(output).parent.mkdir(parents=True, exist_ok=True)
+        with open(output, "w", newline="") as table:
+            writer = csv.writer(table, delimiter="\t", lineterminator="\n")
+            writer.writerow(SUMMARY_HEADER)
+            for level, total in self.levels.items():
+                samples = total["samples"]
+                for name, mean, mean_infrv, max_infrv in zip(
+                        total["names"], total["mean"] / samples,
+                        total["infrv"] / samples, total["max_infrv"]):
+                    writer.writerow([
+                        name, level, samples, f"{mean:.6g}",
+                        f"{mean_infrv:.6g}", f"{max_infrv:.6g}"
+                    ])
+
+
+def main(args: argparse.ArgumentParser) -> None:
+    """
+    Main function of the script
+    """
+    if len(args.outputs) != len(args.salmon):
+        raise ValueError(
+            f"{len(args.outputs)} outputs for {len(args.salmon)} "
+            "Salmon directories"
+        )
+    tx2gene = read_tx2gene(args.tx2gene)
+
+    def summarize(job: Tuple[str, str]) -> Dict[str, Any]:
+        directory, output = job
+        summary = summarize_sample(directory, tx2gene)
+        write_sample(summary, output)
+        logging.info(
+            "%s: %i bootstraps, %i transcript(s) without gene",
+            directory, summary["bootstraps"], summary["unmapped"]
+        )
+        return summary
+
+    # Only one summary per thread is held in memory at once
+    accumulator = SummaryAccumulator()
+    with ThreadPool(max(min(args.threads, len(args.salmon)), 1)) as pool:
+        for summary in pool.imap(summarize, zip(args.salmon, args.outputs)):
+            accumulator.add(summary)
+    accumulator.write(args.summary)
+
+
+def test_main(tmp_path: Path) -> None:
+    """
+    Test the main function above
+    """
+    tx2gene = tmp_path / "tx2gene.tsv"
+    tx2gene.write_text(
+        "transcript\tgene\nENST00000624081.1\tG1\nENST00000612610\tG1\n"
+    )
+    outputs = [str(tmp_path / "a.tsv.gz"), str(tmp_path / "b.tsv.gz")]
+    main(parse([
+        "test/pseudo_mapping/a.chr21.1", "test/pseudo_mapping/b.chr21.1",
+        "--tx2gene", str(tx2gene), "--outputs", *outputs,
+        "--summary", str(tmp_path / "summary.tsv"), "--threads", "2"
+    ]))
+    with gzip.open(outputs[0], "rt") as table:
+        lines = table.read().splitlines()
+    assert lines[0].split("\t") == SAMPLE_HEADER
+    assert lines[-1].startswith("G1\tgene\t")
+    assert len(lines) == 1 + 2412 + 1
+
+    summary = (tmp_path / "summary.tsv").read_text().splitlines()
+    assert summary[-1].startswith("G1\tgene\t2\t")
+
+
+# Running programm if not imported
+if __name__ == "__main__":
+    if "snakemake" in globals():
+        # Called through Snakemake's script directive
+        logging.basicConfig(
+            filename=snakemake.log[0], filemode="w", level=10
+        )
+        args = argparse.Namespace(
+            salmon=[
+                os.path.dirname(os.path.dirname(path))
+                for path in snakemake.input.meta_info
+            ],
+            tx2gene=snakemake.input.get("tx_to_gene"),
+            outputs=list(snakemake.output.samples),
+            summary=snakemake.output.summary,
+            threads=snakemake.threads
+        )
+    else:
+        args = parse(sys.argv[1:])
+        logging.basicConfig(level=10)
+
+    try:
+        main(args)
+    except Exception as e:
+        logging.exception("%s", e)
+        raise
+
+    logging.info("Process over")
@@ -5,14 +5,31 @@
 """
 This script contains functions that are to be called by any other scripts in
 this pipeline.
+
+Expensive operations are wrapped in tracing spans. When the environment
+variable RNA_DGE_TRACE holds a path, spans are appended to this file in
+Chrome trace-event format: open it with chrome://tracing or
+https://ui.perfetto.dev. Otherwise, spans are no-ops.
 """
 
 
-import argparse  # Command line argument parsing
-import yaml      # Yaml parser
+import argparse   # Command line argument parsing
+import functools  # Wrap traced functions
+import json       # Export tracing spans
+import os         # Environment variables
+import sys        # Name traced processes
+import threading  # Identify traced threads
+import time       # Time tracing spans
+import yaml       # Yaml parser
+
+from contextlib import nullcontext   # No-op span
+from pathlib import Path             # os dependent paths functions
+from typing import Any, Callable, Dict, Optional   # Type hinting
 
-from pathlib import Path       # os dependent paths functions
-from typing import Any, Dict   # Type hinting
+# Path to the trace file, tracing is off when unset
+TRACE_PATH = os.environ.get("RNA_DGE_TRACE")
+NO_SPAN = nullcontext()
+_TRACED_PROCESSES = set()
 
 
 # Building custom class for help formatter
@@ -30,3 +47,110 @@ def write_yaml(output_yaml: Path, data: Dict[str, Any]) -> None:
     """
     with output_yaml.open("w") as outyaml:
         yaml.dump(data, outyaml, default_flow_style=False)
+
+
+def export_event(event: Dict[str, Any], trace_path: str) -> None:
+    """
+    Append a trace event to the trace file. The closing bracket of the
+    JSON array is optional in trace-event format: each process appends its
+    own events, even when it does not exit cleanly.
+    """
+    events = [event]
+    if (trace_path, os.getpid()) not in _TRACED_PROCESSES:
+        _TRACED_PROCESSES.add((trace_path, os.getpid()))
+        events.insert(0, {
+            "name": "process_name", "ph": "M", "pid": os.getpid(),
+            "args": {"name": " ".join(sys.argv[:2]) or "python"}
+        })
+
+    with open(trace_path, "a") as trace:
+        text = "".join(json.dumps(event) + ",\n" for event in events)
+        trace.write(text if trace.tell() > 0 else "[\n" + text)
+
+
+class Span:
+    """
+    Time a block of code, and export it as a complete trace event
+    """
+    def __init__(self,
+                 name: str,
+                 trace_path: str,
+                 attributes: Dict[str, Any]) -> None:
+        self.name = name
+        self.trace_path = trace_path
+        self.attributes = attributes
+
+    def __enter__(self) -> "Span":
+        self.start = time.time()
+        self.counter = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        duration = time.perf_counter() - self.counter
+        if exc_info[0] is not None:
+            self.attributes["error"] = exc_info[0].__name__
+        export_event({
+            "name": self.name,
+            "cat": "rna-dge-salmon-deseq2",
+            "ph": "X",
+            "ts": int(self.start * 1e6),
+            "dur": int(duration * 1e6),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": self.attributes
+        }, self.trace_path)
+
+
+def span(name: str, **attributes: Any) -> Any:
+    """
+    Return a tracing span context manager, a no-op one if tracing is off
+    """
+    if TRACE_PATH is None:
+        return NO_SPAN
+    return Span(name, TRACE_PATH, {
+        key: str(value) for key, value in attributes.items()
+    })
+
+
+def traced(function: Callable) -> Callable:
+    """
+    Trace each call of the decorated function. When tracing is off, the
+    function is returned unchanged.
+    """
+    if TRACE_PATH is None:
+        return function
+
+    @functools.wraps(function)
+    def traced_function(*args: Any, **kwargs: Any) -> Any:
+        with span(function.__name__):
+            return function(*args, **kwargs)
+    return traced_function
+
+
+def test_span(tmp_path: Path, monkeypatch: Any) -> None:
+    """
+    Test the functions span and traced above
+    """
+    assert span("off") is NO_SPAN
+    assert traced(len) is len
+
+    trace_path = str(tmp_path / "trace.json")
+    monkeypatch.setattr(sys.modules[__name__], "TRACE_PATH", trace_path)
+    with span("load", rows=3):
+        pass
+    traced(len)([1, 2])
+    try:
+        with span("fail"):
+            raise ValueError("expected")
+    except ValueError:
+        pass
+
+    with open(trace_path) as trace:
+        text = trace.read()
+    assert text.startswith("[\n")
+    events = json.loads(text.rstrip(",\n") + "]")
+    assert events[0]["ph"] == "M"
+    assert [event["name"] for event in events[1:]] == ["load", "len", "fail"]
+    assert events[1]["args"] == {"rows": "3"}
+    assert events[3]["args"] == {"error": "ValueError"}
+    assert all(event["dur"] >= 0 for event in events[1:])
@@ -0,0 +1,358 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+
+"""
+This script compares the benchmarks of a run against a baseline, and exits
+with a non-zero status if any time or memory usage regressed beyond the
+given tolerance.
+
+Both the baseline and the compared run can be:
+- a directory of Snakemake benchmark files (e.g. `benchmarks/`),
+- a table aggregated by the pipeline
+  (`performance/benchmarks_summary.tsv`),
+- a JSON file written by `benchmark_workflow.py`.
+
+The comparison is printed as a table, and saved as JSON.
+
+You can test this script with:
+pytest -vv compare_benchmarks.py
+
+Usage example:
+python3.8 compare_benchmarks.py performance/benchmarks_summary.tsv \
+    --baseline baseline/benchmarks_summary.tsv \
+    --tolerance 0.1 \
+    --output benchmark_comparison.json
+"""
+
+import argparse  # Parse command line
+import csv  # Read aggregated benchmarks
+import json  # Read/Write JSON files
+import logging  # Traces and loggings
+import math  # Handle NaN values
+import os  # OS related operations
+import pytest  # Unit testing
+import shlex  # Lexical analysis
+import sys  # System related methods
+
+from pathlib import Path  # Paths related methods
+from typing import Any, Dict, List  # Type hints
+
+try:
+    from scripts import aggregate_benchmarks
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+    import aggregate_benchmarks
+
+
+# Metrics compared between runs, from aggregated benchmark tables
+SUMMARY_METRICS = {"time_s": "wall_time_s", "mem_mb": "max_rss_mb"}
+
+
+def parser() -> argparse.ArgumentParser:
+    """
+    Build the argument parser object
+    """
+    main_parser = argparse.ArgumentParser(
+        description=sys.modules[__name__].__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    main_parser.add_argument(
+        "current",
+        help="Path to the benchmarks of the compared run",
+        type=str,
+        metavar="PATH",
+    )
+
+    main_parser.add_argument(
+        "--baseline",
+        help="Path to the benchmarks of the reference run",
+        required=True,
+        type=str,
+    )
+
+    main_parser.add_argument(
+        "--tolerance",
+        help="Accepted relative increase of time and memory usage "
+             "(default: %(default)s)",
+        default=0.1,
+        type=float,
+    )
+
+    main_parser.add_argument(
+        "--output",
+        help="Path to the JSON comparison (default: %(default)s)",
+        default="benchmark_comparison.json",
+        type=str,
+    )
+
+    return main_parser
+
+
+def parse(args: Any) -> argparse.ArgumentParser:
+    """
+    Return an argument parser from command line
+    """
+    return parser().parse_args(args)
+
+
+def test_parse() -> None:
+    """
+    Test the argument parsing function
+    """
+    tested = parse(shlex.split("benchmarks --baseline baseline.json"))
+    expected = argparse.Namespace(
+        baseline="baseline.json",
+        current="benchmarks",
+        output="benchmark_comparison.json",
+        tolerance=0.1,
+    )
+    assert tested == expected
+
+
+def summary_metrics(rows: List[Dict[str, Any]]
+                    ) -> Dict[str, Dict[str, float]]:
+    """
+    Return the metrics of each rule and design from an aggregated table
+    """
+    return {
+        f"{row['rule']} ({row['design']})": {
+            metric: aggregate_benchmarks.to_float(row.get(column))
+            for metric, column in SUMMARY_METRICS.items()
+        }
+        for row in rows
+    }
+
+
+def workflow_metrics(results: Dict[str, Any]
+                     ) -> Dict[str, Dict[str, float]]:
+    """
+    Return the timings of each phase and cohort from benchmark_workflow.py.
+    Phases skipped or failed have null timings: they are missing
+    """
+    metrics = {}
+    for run in results["runs"]:
+        cohort = (
+            f"{run['samples']} samples, {run['factors']} factors, "
+            f"{run['models']} models, {run['transcripts']} transcripts"
+        )
+        for phase, timing in run["timings"].items():
+            metrics[f"{phase} ({cohort})"] = {
+                "time_s": math.nan if timing is None else timing
+            }
+    return metrics
+
+
+def load_metrics(path: str) -> Dict[str, Dict[str, float]]:
+    """
+    Load benchmarks from a directory, an aggregated table or a JSON file
+    """
+    if os.path.isdir(path):
+        return summary_metrics(
+            aggregate_benchmarks.aggregate(Path(path), [], {})
+        )
+
+    if path.endswith(".json"):
+        with open(path) as results:
+            return workflow_metrics(json.load(results))
+
+    with open(path) as table:
+        return summary_metrics(list(csv.DictReader(table, delimiter="\t")))
+
+
+def test_load_metrics(tmp_path: Path) -> None:
+    """
+    Test the function load_metrics above
+    """
+    (tmp_path / "benchmarks").mkdir()
+    (tmp_path / "benchmarks" / "tximport.tsv").write_text(
+        "s\tmax_rss\n12.5\t300\n"
+    )
+    assert load_metrics(str(tmp_path / "benchmarks")) == {
+        "tximport (all)": {"time_s": 12.5, "mem_mb": 300.0}
+    }
+
+    (tmp_path / "summary.tsv").write_text(
+        "design\trule\twall_time_s\tmax_rss_mb\nd1\tdeseq\t10\tNA\n"
+    )
+    tested = load_metrics(str(tmp_path / "summary.tsv"))
+    assert tested["deseq (d1)"]["time_s"] == 10.0
+    assert math.isnan(tested["deseq (d1)"]["mem_mb"])
+
+    (tmp_path / "benchmark.json").write_text(json.dumps({"runs": [{
+        "samples": 10, "factors": 2, "models": 1, "transcripts": 100,
+        "timings": {"dry_run": 1.5}
+    }]}))
+    assert load_metrics(str(tmp_path / "benchmark.json")) == {
+        "dry_run (10 samples, 2 factors, 1 models, 100 transcripts)": {
+            "time_s": 1.5
+        }
+    }
+
+
+def test_compare_null_timings(tmp_path: Path) -> None:
+    """
+    Test that null timings, e.g. with --no-snakemake, are compared as
+    missing values
+    """
+    (tmp_path / "benchmark.json").write_text(json.dumps({"runs": [{
+        "samples": 10, "factors": 2, "models": 1, "transcripts": 100,
+        "timings": {"dry_run": None, "snakefile_parsing": 2.0}
+    }]}))
+    current = load_metrics(str(tmp_path / "benchmark.json"))
+    baseline = {name: {"time_s": 1.0} for name in current}
+    tested = {row["benchmark"].split(" ")[0]: row["status"]
+              for row in compare(baseline, current, 0.1)}
+    assert tested == {"dry_run": "missing", "snakefile_parsing": "regression"}
+
+
+def compare(baseline: Dict[str, Dict[str, float]],
+            current: Dict[str, Dict[str, float]],
+            tolerance: float) -> List[Dict[str, Any]]:
+    """
+    Compare each metric of each benchmark between two runs
+    """
+    comparison = []
+    for name in sorted(set(baseline) | set(current)):
+        metrics = set(baseline.get(name, {})) | set(current.get(name, {}))
+        for metric in sorted(metrics):
+            reference = baseline.get(name, {}).get(metric, math.nan)
+            value = current.get(name, {}).get(metric, math.nan)
+            change = math.nan
+            if math.isnan(reference) or math.isnan(value):
+                status = "missing" if math.isnan(value) else "new"
+            elif reference == 0:
+                status = "ok" if value == 0 else "regression"
+            else:
+                change = (value - reference) / reference
+                if change > tolerance:
+                    status = "regression"
+                elif change < -tolerance:
+                    status = "improvement"
+                else:
+                    status = "ok"
+            comparison.append({
+                "benchmark": name,
+                "metric": metric,
+                "baseline": None if math.isnan(reference) else reference,
+                "current": None if math.isnan(value) else value,
+                "change": None if math.isnan(change) else round(change, 4),
+                "status": status
+            })
+    return comparison
+
+
+def test_compare() -> None:
+    """
+    Test the function compare above
+    """
+    tested = compare(
+        {"a": {"time_s": 10.0, "mem_mb": 100.0}, "b": {"time_s": 1.0}},
+        {"a": {"time_s": 12.0, "mem_mb": 105.0}, "c": {"time_s": 1.0}},
+        0.1
+    )
+    assert [(row["benchmark"], row["metric"], row["status"])
+            for row in tested] == [
+        ("a", "mem_mb", "ok"),
+        ("a", "time_s", "regression"),
+        ("b", "time_s", "missing"),
+        ("c", "time_s", "new"),
+    ]
+    assert tested[1]["change"] == 0.2
+
+
+def format_table(comparison: List[Dict[str, Any]]) -> str:
+    """
+    Return the comparison as a human readable table
+    """
+    header = ["benchmark", "metric", "baseline", "current", "change", "status"]
+    lines = [header] + [
+        [
+            row["benchmark"],
+            row["metric"],
+            "NA" if row["baseline"] is None else f"{row['baseline']:.2f}",
+            "NA" if row["current"] is None else f"{row['current']:.2f}",
+            "NA" if row["change"] is None else f"{row['change']:+.1%}",
+            row["status"]
+        ]
+        for row in comparison
+    ]
+    widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(line, widths))
+        .rstrip()
+        for line in lines
+    )
+
+
+def test_format_table() -> None:
+    """
+    Test the function format_table above
+    """
+    tested = format_table([{
+        "benchmark": "deseq (d1)", "metric": "time_s", "baseline": 10.0,
+        "current": 12.0, "change": 0.2, "status": "regression"
+    }]).splitlines()
+    assert tested[0].split() == [
+        "benchmark", "metric", "baseline", "current", "change", "status"
+    ]
+    assert tested[1].split()[-3:] == ["12.00", "+20.0%", "regression"]
+
+
+def main(args: argparse.ArgumentParser) -> int:
+    """
+    Main function of the script, returns the number of regressions
+    """
+    comparison = compare(
+        load_metrics(args.baseline), load_metrics(args.current),
+        args.tolerance
+    )
+    regressions = [row for row in comparison if row["status"] == "regression"]
+
+    print(format_table(comparison))
+    with open(args.output, "w") as output:
+        json.dump({
+            "baseline": args.baseline,
+            "current": args.current,
+            "tolerance": args.tolerance,
+            "regressions": len(regressions),
+            "comparison": comparison
+        }, output, indent=2)
+
+    logging.info(
+        "%i regression(s) beyond %s tolerance, written to %s",
+        len(regressions), args.tolerance, args.output
+    )
+    return len(regressions)
+
+
+def test_main(tmp_path: Path) -> None:
+    """
+    Test the main function above
+    """
+    header = "design\trule\twall_time_s\tmax_rss_mb\n"
+    baseline = tmp_path / "baseline.tsv"
+    baseline.write_text(header + "d1\tr\t10\t100\n")
+    current = tmp_path / "current.tsv"
+    current.write_text(header + "d1\tr\t10\t150\n")
+    output = tmp_path / "comparison.json"
+    tested = main(parse([
+        str(current), "--baseline", str(baseline), "--output", str(output)
+    ]))
+    assert tested == 1
+    assert json.loads(output.read_text())["regressions"] == 1
+
+
+# Running programm if not imported
+if __name__ == "__main__":
+    args = parse(sys.argv[1:])
+    logging.basicConfig(level=10)
+
+    try:
+        regressions = main(args)
+    except Exception as e:
+        logging.exception("%s", e)
+        raise
+
+    logging.info("Process over")
+    sys.exit(1 if regressions > 0 else 0)
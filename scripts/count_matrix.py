@@ -0,0 +1,362 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+
+"""
+This script gives a chunked view over a count matrix on disk (genes in rows,
+samples in columns), such as DESeq2 normalized counts. The matrix is never
+loaded as a whole: rows are read by chunks of a fixed number of genes, so
+memory usage depends on the chunk size, not on the cohort size.
+
+CountMatrix supports row/column selections, per-gene means and variances
+and the selection of the most variable genes. ChunkWriter writes a matrix
+chunk by chunk. Normalized values can be read as float32, halving memory.
+
+Called as a script, it writes the mean and variance of each gene, and the
+counts of the N most variable genes (variance of log2(count + 1)), e.g. to
+cluster samples.
+
+You can test this script with:
+pytest -vv count_matrix.py
+
+Usage example:
+python3.8 count_matrix.py deseq2/design/normalized_counts.tsv \
+    --top 500 \
+    --output deseq2/design/top_variable_counts.tsv \
+    --stats deseq2/design/gene_variance.tsv
+"""
+
+import argparse  # Parse command line
+import logging  # Traces and loggings
+import numpy  # Numeric operations
+import pandas  # Read count chunks
+import pytest  # Unit testing
+import shlex  # Lexical analysis
+import sys  # System related methods
+
+from pathlib import Path  # Paths related methods
+from typing import Any, Iterator, List, Optional  # Type hints
+
+
+class CountMatrix:
+    """
+    Chunked, read-only view of a TSV count matrix, genes in rows
+    """
+    def __init__(self,
+                 path: str,
+                 chunk_size: int = 10000,
+                 dtype: Any = numpy.float64) -> None:
+        self.path = path
+        self.chunk_size = chunk_size
+        self.dtype = dtype
+        with open(path) as matrix:
+            self.header = matrix.readline().rstrip("\n").split("\t")
+        self.samples = self.header[1:]
+
+    def chunks(self,
+               samples: Optional[List[str]] = None) -> Iterator[pandas.DataFrame]:
+        """
+        Yield the matrix by chunks of genes, optionally restricted to the
+        given samples (only their columns are parsed)
+        """
+        usecols = None
+        if samples is not None:
+            missing = set(samples) - set(self.samples)
+            if missing:
+                raise KeyError(f"Unknown sample(s): {sorted(missing)}")
+            usecols = [0] + [self.header.index(sample) for sample in samples]
+
+        reader = pandas.read_csv(
+            self.path, sep="\t", index_col=0, header=0, usecols=usecols,
+            chunksize=self.chunk_size, engine="c"
+        )
+        for chunk in reader:
+            chunk.index.name = None
+            if samples is not None:
+                chunk = chunk[samples]
+            yield chunk.astype(self.dtype)
+
+    def select(self,
+               genes: Optional[List[str]] = None,
+               samples: Optional[List[str]] = None) -> pandas.DataFrame:
+        """
+        Return a slice of the matrix, in file order. Only the selected
+        rows are kept in memory
+        """
+        wanted = None if genes is None else set(genes)
+        return pandas.concat([
+            chunk if wanted is None else chunk[chunk.index.isin(wanted)]
+            for chunk in self.chunks(samples)
+        ])
+
+    def reduce(self, log: bool = False) -> Iterator[pandas.DataFrame]:
+        """
+        Yield the mean and the variance (ddof=1) of each gene, by chunks
+        """
+        for chunk in self.chunks():
+            values = numpy.log2(chunk + 1) if log else chunk
+            yield pandas.DataFrame(
+                {"mean": values.mean(axis=1), "variance": values.var(axis=1)}
+            )
+
+    def mean(self, log: bool = False) -> pandas.Series:
+        """
+        Return the mean of each gene
+        """
+        return pandas.concat(stats["mean"] for stats in self.reduce(log))
+
+    def variance(self, log: bool = False) -> pandas.Series:
+        """
+        Return the variance of each gene
+        """
+        return pandas.concat(stats["variance"] for stats in self.reduce(log))
+
+    def top_variable(self, top: int, log: bool = True) -> pandas.DataFrame:
+        """
+        Return the rows of the `top` most variable genes, in file order.
+        Candidates are kept along the way: memory usage is bounded by
+        `top` plus one chunk. Ties are broken by file order
+        """
+        best = None
+        for position, chunk in enumerate(self.chunks()):
+            values = numpy.log2(chunk + 1) if log else chunk
+            candidates = chunk.assign(
+                _variance=values.var(axis=1).values,
+                _order=numpy.arange(len(chunk)) + position * self.chunk_size
+            )
+            if best is not None:
+                candidates = pandas.concat([best, candidates])
+            best = candidates.sort_values(
+                ["_variance", "_order"], ascending=[False, True],
+                kind="mergesort"
+            ).head(top)
+
+        if best is None:
+            return pandas.DataFrame(columns=self.samples)
+        return best.sort_values("_order").drop(columns=["_variance", "_order"])
+
+
+class ChunkWriter:
+    """
+    Write a TSV matrix chunk by chunk
+    """
+    def __init__(self, path: str, index_label: str = "") -> None:
+        self.path = path
+        self.index_label = index_label
+        self.handle = None
+
+    def __enter__(self) -> "ChunkWriter":
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self.handle = open(self.path, "w")
+        self.header = True
+        return self
+
+    def write(self, chunk: pandas.DataFrame) -> None:
+        """
+        Append a chunk, the header is written with the first one
+        """
+        chunk.to_csv(
+            self.handle, sep="\t", header=self.header,
+            index_label=self.index_label
+        )
+        self.header = False
+
+    def __exit__(self, *exc: Any) -> None:
+        self.handle.close()
+
+
+def write_counts(path: Path, rows: int, samples: int) -> str:
+    """
+    Write a count matrix where gene i has counts i, i+1, ... i*2, ...,
+    for tests
+    """
+    with path.open("w") as matrix:
+        matrix.write("\t" + "\t".join(f"S{j}" for j in range(samples)) + "\n")
+        for i in range(rows):
+            matrix.write(f"G{i}\t" + "\t".join(
+                str(float(i * (j % 2) + j)) for j in range(samples)
+            ) + "\n")
+    return str(path)
+
+
+def test_count_matrix(tmp_path: Path) -> None:
+    """
+    Test the class CountMatrix above
+    """
+    path = write_counts(tmp_path / "counts.tsv", 25, 4)
+    complete = pandas.read_csv(path, sep="\t", index_col=0)
+    matrix = CountMatrix(path, chunk_size=7)
+    assert matrix.samples == ["S0", "S1", "S2", "S3"]
+    assert sum(len(chunk) for chunk in matrix.chunks()) == 25
+
+    tested = matrix.select(genes=["G20", "G3"], samples=["S3", "S1"])
+    assert tested.equals(complete.loc[["G3", "G20"], ["S3", "S1"]])
+    with pytest.raises(KeyError):
+        next(matrix.chunks(["S9"]))
+
+    assert numpy.allclose(matrix.mean(), complete.mean(axis=1))
+    assert numpy.allclose(matrix.variance(), complete.var(axis=1))
+    assert numpy.allclose(
+        matrix.variance(log=True), numpy.log2(complete + 1).var(axis=1)
+    )
+    single = CountMatrix(path, chunk_size=7, dtype=numpy.float32)
+    assert next(single.chunks()).dtypes.unique().tolist() == [numpy.float32]
+    assert numpy.allclose(single.variance(), complete.var(axis=1))
+
+
+def test_top_variable(tmp_path: Path) -> None:
+    """
+    Test the method CountMatrix.top_variable above
+    """
+    path = write_counts(tmp_path / "counts.tsv", 25, 4)
+    complete = pandas.read_csv(path, sep="\t", index_col=0)
+    variance = numpy.log2(complete + 1).var(axis=1)
+    expected = variance.sort_values(ascending=False, kind="mergesort").index
+    for chunk_size in [1, 4, 100]:
+        tested = CountMatrix(path, chunk_size).top_variable(5)
+        assert sorted(tested.index) == sorted(expected[:5])
+        assert tested.equals(complete.loc[tested.index])
+        assert list(tested.index) == [
+            gene for gene in complete.index if gene in set(tested.index)
+        ]
+
+
+def test_chunk_writer(tmp_path: Path) -> None:
+    """
+    Test the class ChunkWriter above
+    """
+    path = write_counts(tmp_path / "counts.tsv", 10, 3)
+    output = tmp_path / "copy.tsv"
+    with ChunkWriter(str(output)) as writer:
+        for chunk in CountMatrix(path, 3).chunks():
+            writer.write(chunk)
+    assert output.read_text() == Path(path).read_text()
+
+
+def parser() -> argparse.ArgumentParser:
+    """
+    Build the argument parser object
+    """
+    main_parser = argparse.ArgumentParser(
+        description=sys.modules[__name__].__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    main_parser.add_argument(
+        "counts",
+        help="Path to the count matrix, genes in rows",
+        type=str,
+    )
+
+    main_parser.add_argument(
+        "--top",
+        help="Number of most variable genes to keep (default: %(default)s)",
+        default=500,
+        type=int,
+    )
+
+    main_parser.add_argument(
+        "--output",
+        help="Path to the counts of the most variable genes "
+             "(default: %(default)s)",
+        default="top_variable_counts.tsv",
+        type=str,
+    )
+
+    main_parser.add_argument(
+        "--stats",
+        help="Path to the mean and variance of each gene "
+             "(default: %(default)s)",
+        default="gene_variance.tsv",
+        type=str,
+    )
+
+    main_parser.add_argument(
+        "--chunk-size",
+        help="Number of genes read at once (default: %(default)s)",
+        default=10000,
+        type=int,
+    )
+
+    return main_parser
+
+
+def parse(args: Any) -> argparse.ArgumentParser:
+    """
+    Return an argument parser from command line
+    """
+    return parser().parse_args(args)
+
+
+def test_parse() -> None:
+    """
+    Test the argument parsing function
+    """
+    tested = parse(shlex.split("counts.tsv --top 10"))
+    expected = argparse.Namespace(
+        counts="counts.tsv",
+        top=10,
+        output="top_variable_counts.tsv",
+        stats="gene_variance.tsv",
+        chunk_size=10000,
+    )
+    assert tested == expected
+
+
+def main(args: argparse.ArgumentParser) -> None:
+    """
+    Main function of the script
+    """
+    matrix = CountMatrix(args.counts, args.chunk_size, numpy.float32)
+    with ChunkWriter(args.stats, "gene") as writer:
+        for stats in matrix.reduce(log=True):
+            writer.write(stats)
+
+    top = matrix.top_variable(args.top)
+    with ChunkWriter(args.output) as writer:
+        writer.write(top)
+    logging.info(
+        "%i most variable genes out of %s kept", len(top), args.counts
+    )
+
+
+def test_main(tmp_path: Path) -> None:
+    """
+    Test the main function above
+    """
+    path = write_counts(tmp_path / "counts.tsv", 30, 4)
+    output = tmp_path / "top.tsv"
+    stats = tmp_path / "stats.tsv"
+    main(parse([
+        path, "--top", "3", "--chunk-size", "4",
+        "--output", str(output), "--stats", str(stats)
+    ]))
+    assert len(output.read_text().splitlines()) == 4
+    assert stats.read_text().startswith("gene\tmean\tvariance\n")
+    assert len(stats.read_text().splitlines()) == 31
+
+
+# Running programm if not imported
+if __name__ == "__main__":
+    if "snakemake" in globals():
+        # Called through Snakemake's script directive
+        logging.basicConfig(
+            filename=snakemake.log[0], filemode="w", level=10
+        )
+        args = argparse.Namespace(
+            counts=snakemake.input.counts,
+            top=snakemake.params.top,
+            output=snakemake.output.counts,
+            stats=snakemake.output.stats,
+            chunk_size=snakemake.params.get("chunk_size", 10000)
+        )
+    else:
+        args = parse(sys.argv[1:])
+        logging.basicConfig(level=10)
+
+    try:
+        main(args)
+    except Exception as e:
+        logging.exception("%s", e)
+        raise
+
+    logging.info("Process over")
@@ -0,0 +1,322 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+
+"""
+This script stores count matrices (features in rows, samples in columns) in
+the most compact representation that fits their values:
+
+- exact integers (int32) when all values are integral, e.g. rounded counts,
+- float32 when precision loss is allowed, e.g. normalized values,
+- float64 otherwise,
+
+and, whatever the type, as compressed sparse columns (CSC) when this takes
+less memory than a dense matrix, e.g. transcript-level quantifications
+where most transcripts are not expressed. Matrices are packed into numpy
+arrays saved with numpy.savez, and densified on demand with `unpack`.
+
+Called as a script, it builds the transcript-level matrices of Salmon
+quantifications, stores them, and reports memory and disk footprints
+before (float64 dense, quant.sf text) and after.
+
+You can test this script with:
+pytest -vv count_store.py
+
+Usage example:
+python3.8 count_store.py S1/quant.sf S2/quant.sf \
+    --output store.npz \
+    --report footprint.tsv
+"""
+
+import argparse  # Parse command line
+import csv  # Write the footprint report
+import logging  # Traces and loggings
+import numpy  # Handle matrices
+import os  # OS related operations
+import pandas  # Read quant.sf files
+import pytest  # Unit testing
+import shlex  # Lexical analysis
+import sys  # System related methods
+
+from pathlib import Path  # Paths related methods
+from typing import Any, Dict, List  # Type hints
+
+
+# Columns of quant.sf stored as matrices
+QUANT_MATRICES = ["NumReads", "TPM", "EffectiveLength"]
+REPORT_HEADER = [
+    "matrix", "layout", "dtype", "rows", "columns", "zero_fraction",
+    "dense_mb", "stored_mb"
+]
+
+
+def choose_dtype(values: numpy.ndarray, lossy: bool = False) -> numpy.dtype:
+    """
+    Return the smallest type representing values, exactly unless lossy
+    """
+    finite = numpy.isfinite(values).all()
+    if (finite and numpy.array_equal(values, numpy.round(values))
+            and (values.size == 0 or (
+                values.min() >= numpy.iinfo(numpy.int32).min
+                and values.max() <= numpy.iinfo(numpy.int32).max))):
+        return numpy.dtype(numpy.int32)
+    if lossy:
+        return numpy.dtype(numpy.float32)
+    return numpy.dtype(numpy.float64)
+
+
+@pytest.mark.parametrize(
+    "values, lossy, expected", [
+        ([[0.0, 3.0], [12.0, 1.0]], False, numpy.int32),
+        ([[0.0, 3.5], [12.0, 1.0]], False, numpy.float64),
+        ([[0.0, 3.5], [12.0, 1.0]], True, numpy.float32),
+        ([[0.0, 3e10]], False, numpy.float64),
+        ([[numpy.nan, 1]], False, numpy.float64),
+    ]
+)
+def test_choose_dtype(values: List[List[float]],
+                      lossy: bool,
+                      expected: numpy.dtype) -> None:
+    """
+    Test the function choose_dtype above
+    """
+    assert choose_dtype(numpy.array(values), lossy) == expected
+
+
+def sparse_nbytes(nonzero: int, columns: int, dtype: numpy.dtype) -> int:
+    """
+    Return the size of a CSC matrix: values, row indices and column pointers
+    """
+    return nonzero * (dtype.itemsize + 4) + (columns + 1) * 8
+
+
+def pack(name: str,
+         values: numpy.ndarray,
+         lossy: bool = False) -> Dict[str, numpy.ndarray]:
+    """
+    Return the arrays storing a matrix in its most compact representation
+    """
+    dtype = choose_dtype(values, lossy)
+    nonzero = numpy.count_nonzero(values)
+    rows, columns = values.shape
+    if sparse_nbytes(nonzero, columns, dtype) < values.size * dtype.itemsize:
+        # Column-major traversal: samples are stored one after the other
+        mask = values.T != 0
+        return {
+            f"{name}.shape": numpy.array(values.shape, dtype=numpy.int64),
+            f"{name}.data": values.T[mask].astype(dtype),
+            f"{name}.indices": numpy.nonzero(mask)[1].astype(numpy.int32),
+            f"{name}.indptr": numpy.concatenate(
+                [[0], numpy.cumsum(mask.sum(axis=1))]
+            ).astype(numpy.int64),
+        }
+    return {f"{name}.dense": values.astype(dtype)}
+
+
+def unpack(arrays: Any, name: str) -> numpy.ndarray:
+    """
+    Densify a packed matrix, as float64
+    """
+    if f"{name}.dense" in arrays:
+        return numpy.asarray(arrays[f"{name}.dense"], dtype=numpy.float64)
+
+    rows, columns = arrays[f"{name}.shape"]
+    dense = numpy.zeros((rows, columns))
+    indptr = arrays[f"{name}.indptr"]
+    indices = arrays[f"{name}.indices"]
+    data = arrays[f"{name}.data"]
+    for column in range(columns):
+        start, end = indptr[column], indptr[column + 1]
+        dense[indices[start:end], column] = data[start:end]
+    return dense
+
+
+def describe(arrays: Dict[str, numpy.ndarray], name: str) -> Dict[str, Any]:
+    """
+    Return the layout, type and size of a packed matrix
+    """
+    if f"{name}.dense" in arrays:
+        dense = arrays[f"{name}.dense"]
+        return {"layout": "dense", "dtype": str(dense.dtype),
+                "stored_mb": dense.nbytes / 1024 ** 2}
+    return {
+        "layout": "sparse",
+        "dtype": str(arrays[f"{name}.data"].dtype),
+        "stored_mb": sum(
+            array.nbytes for key, array in arrays.items()
+            if key.startswith(f"{name}.")
+        ) / 1024 ** 2
+    }
+
+
+def test_pack() -> None:
+    """
+    Test the functions pack and unpack above
+    """
+    counts = numpy.array([[0, 0, 0], [0, 5, 0], [0, 0, 0], [0, 0, 0],
+                          [2, 0, 0], [0, 0, 0], [0, 0, 0], [0, 0, 1]],
+                         dtype=float)
+    packed = pack("counts", counts)
+    assert describe(packed, "counts")["layout"] == "sparse"
+    assert packed["counts.data"].dtype == numpy.int32
+    assert numpy.array_equal(unpack(packed, "counts"), counts)
+
+    tpm = counts + 0.5
+    packed = pack("tpm", tpm)
+    assert describe(packed, "tpm") == {
+        "layout": "dense", "dtype": "float64", "stored_mb": 192 / 1024 ** 2
+    }
+    assert numpy.array_equal(unpack(packed, "tpm"), tpm)
+
+    packed = pack("tpm", tpm, lossy=True)
+    assert packed["tpm.dense"].dtype == numpy.float32
+    assert numpy.allclose(unpack(packed, "tpm"), tpm)
+
+
+def test_pack_npz(tmp_path: Path) -> None:
+    """
+    Test that packed matrices survive numpy.savez
+    """
+    values = numpy.zeros((100, 4))
+    values[3, 1] = 0.25
+    path = tmp_path / "store.npz"
+    numpy.savez(path, **pack("tpm", values), **pack("counts", values * 4))
+    with numpy.load(path) as store:
+        assert numpy.array_equal(unpack(store, "tpm"), values)
+        assert numpy.array_equal(unpack(store, "counts"), values * 4)
+
+
+def parser() -> argparse.ArgumentParser:
+    """
+    Build the argument parser object
+    """
+    main_parser = argparse.ArgumentParser(
+        description=sys.modules[__name__].__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    main_parser.add_argument(
+        "quant",
+        help="Space separated list of quant.sf files",
+        nargs="+",
+        type=str,
+        metavar="PATH",
+    )
+
+    main_parser.add_argument(
+        "--output",
+        help="Path to the stored matrices (default: %(default)s)",
+        default="count_store.npz",
+        type=str,
+    )
+
+    main_parser.add_argument(
+        "--report",
+        help="Path to the footprint report (default: %(default)s)",
+        default="count_store_footprint.tsv",
+        type=str,
+    )
+
+    return main_parser
+
+
+def parse(args: Any) -> argparse.ArgumentParser:
+    """
+    Return an argument parser from command line
+    """
+    return parser().parse_args(args)
+
+
+def test_parse() -> None:
+    """
+    Test the argument parsing function
+    """
+    tested = parse(shlex.split("S1/quant.sf S2/quant.sf"))
+    expected = argparse.Namespace(
+        quant=["S1/quant.sf", "S2/quant.sf"],
+        output="count_store.npz",
+        report="count_store_footprint.tsv",
+    )
+    assert tested == expected
+
+
+def main(args: argparse.ArgumentParser) -> None:
+    """
+    Main function of the script
+    """
+    arrays, rows = {}, []
+    for name in QUANT_MATRICES:
+        values = numpy.column_stack([
+            pandas.read_csv(path, sep="\t", usecols=[name])[name].values
+            for path in args.quant
+        ])
+        arrays.update(pack(name, values))
+        rows.append({
+            "matrix": name,
+            "rows": values.shape[0],
+            "columns": values.shape[1],
+            "zero_fraction": round(1 - numpy.count_nonzero(values)
+                                   / max(values.size, 1), 4),
+            "dense_mb": round(values.nbytes / 1024 ** 2, 4),
+            **describe(arrays, name)
+        })
+        rows[-1]["stored_mb"] = round(rows[-1]["stored_mb"], 4)
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, "wb") as store:
+        numpy.savez(store, **arrays)
+    rows.append({
+        "matrix": "disk", "layout": "npz", "dtype": "NA",
+        "rows": "NA", "columns": len(args.quant), "zero_fraction": "NA",
+        "dense_mb": round(sum(os.path.getsize(path) for path in args.quant)
+                          / 1024 ** 2, 4),
+        "stored_mb": round(os.path.getsize(args.output) / 1024 ** 2, 4)
+    })
+
+    Path(args.report).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.report, "w", newline="") as report:
+        writer = csv.DictWriter(
+            report, fieldnames=REPORT_HEADER, delimiter="\t",
+            lineterminator="\n"
+        )
+        writer.writeheader()
+        writer.writerows(rows)
+    for row in rows:
+        logging.info(
+            "%s: %s MB before, %s MB after (%s %s)", row["matrix"],
+            row["dense_mb"], row["stored_mb"], row["layout"], row["dtype"]
+        )
+
+
+def test_main(tmp_path: Path) -> None:
+    """
+    Test the main function above
+    """
+    quant = [f"test/pseudo_mapping/{sample}.chr21.1/quant.sf"
+             for sample in "abc"]
+    report = tmp_path / "footprint.tsv"
+    main(parse(quant + ["--output", str(tmp_path / "store.npz"),
+                        "--report", str(report)]))
+    rows = list(csv.DictReader(report.open(), delimiter="\t"))
+    assert [row["matrix"] for row in rows] == [
+        "NumReads", "TPM", "EffectiveLength", "disk"
+    ]
+    assert rows[0]["layout"] == "sparse"
+    assert float(rows[0]["stored_mb"]) < float(rows[0]["dense_mb"])
+
+    expected = pandas.read_csv(quant[1], sep="\t")["TPM"].values
+    with numpy.load(tmp_path / "store.npz") as store:
+        assert numpy.array_equal(unpack(store, "TPM")[:, 1], expected)
+
+
+# Running programm if not imported
+if __name__ == "__main__":
+    args = parse(sys.argv[1:])
+    logging.basicConfig(level=10)
+
+    try:
+        main(args)
+    except Exception as e:
+        logging.exception("%s", e)
+        raise
+
+    logging.info("Process over")
@@ -0,0 +1,462 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+
+"""
+This script converts DESeq2 results into the tables expected by GSEAapp on
+ShinyGR.
+
+The gene annotation (gene2gene) is loaded once as a hash index. Then, each
+DESeq2 result table is read line by line, and the three tables (complete,
+fc_fc and padj_fc) are written at the same time, in a single pass. Memory
+usage is therefore limited to the gene index, whatever the size of the
+DESeq2 results.
+
+Multiple designs can be converted within a single call (batch mode): the
+gene index is built only once for all of them.
+
+You can test this script with:
+pytest -vv deseq2_to_gseaapp.py
+
+Usage example:
+python3.8 deseq2_to_gseaapp.py gene2gene.tsv \
+    --deseq2 DESeq2_design.tsv \
+    --complete design_complete.tsv \
+    --fc-fc design_fc_fc.tsv \
+    --padj-fc design_padj_fc.tsv
+"""
+
+import argparse  # Parse command line
+import csv  # Read/Write TSV files line by line
+import logging  # Traces and loggings
+import math  # Handle NaN values
+import pytest  # Unit testing
+import shlex  # Lexical analysis
+import sys  # System related methods
+
+from pathlib import Path  # Paths related methods
+from typing import Any, Dict, Iterator, List, Tuple, Union  # Type hints
+
+
+# Possible names of the gene name column in gene2gene tables
+GENE_NAME_COLUMNS = ["Gene_Name", "GeneName", "gene_name", "Hugo_ID", "Name"]
+
+# Headers of the three output tables
+COMPLETE_HEADER = [
+    "log2FoldChange", "GeneIdentifier", "Cluster_FC", "Cluster_Sig", "padj"
+]
+GSEAAPP_HEADER = ["GeneIdentifier", "stat_change", "cluster"]
+
+
+def parser() -> argparse.ArgumentParser:
+    """
+    Build the argument parser object
+    """
+    main_parser = argparse.ArgumentParser(
+        description=sys.modules[__name__].__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    main_parser.add_argument(
+        "gene2gene",
+        help="Path to the gene identifier to gene name table",
+        type=str,
+        metavar="PATH",
+    )
+
+    main_parser.add_argument(
+        "--deseq2",
+        help="Space separated list of DESeq2 result tables",
+        nargs="+",
+        required=True,
+        type=str,
+    )
+
+    main_parser.add_argument(
+        "--complete",
+        help="Space separated list of complete output tables, "
+             "one per DESeq2 table",
+        nargs="+",
+        required=True,
+        type=str,
+    )
+
+    main_parser.add_argument(
+        "--fc-fc",
+        help="Space separated list of fc_fc output tables, "
+             "one per DESeq2 table",
+        nargs="+",
+        required=True,
+        type=str,
+    )
+
+    main_parser.add_argument(
+        "--padj-fc",
+        help="Space separated list of padj_fc output tables, "
+             "one per DESeq2 table",
+        nargs="+",
+        required=True,
+        type=str,
+    )
+
+    main_parser.add_argument(
+        "--alpha-threshold",
+        help="The alpha error threshold (default: %(default)s)",
+        type=float,
+        default=0.05,
+    )
+
+    main_parser.add_argument(
+        "--fc-threshold",
+        help="The absolute log2(Fold Change) threshold "
+             "(default: %(default)s)",
+        type=float,
+        default=1.0,
+    )
+
+    return main_parser
+
+
+def parse(args: Any) -> argparse.ArgumentParser:
+    """
+    Return an argument parser from command line
+    """
+    return parser().parse_args(args)
+
+
+def test_parse() -> None:
+    """
+    Test the argument parsing function
+    """
+    tested = parse(shlex.split(
+        "g2g.tsv --deseq2 a.tsv --complete c.tsv "
+        "--fc-fc f.tsv --padj-fc p.tsv"
+    ))
+    expected = argparse.Namespace(
+        alpha_threshold=0.05,
+        complete=["c.tsv"],
+        deseq2=["a.tsv"],
+        fc_fc=["f.tsv"],
+        fc_threshold=1.0,
+        gene2gene="g2g.tsv",
+        padj_fc=["p.tsv"],
+    )
+    assert tested == expected
+
+
+def gene_index(gene2gene_path: str) -> Dict[str, str]:
+    """
+    Build a gene identifier -> gene name hash index from a TSV file.
+
+    Both versioned and unversioned identifiers are indexed, so that
+    DESeq2 results with or without gene versions can be annotated.
+    """
+    logging.info(f"Indexing gene names from {gene2gene_path}")
+    index = {}
+    with open(gene2gene_path, "r") as gene2gene_stream:
+        reader = csv.reader(gene2gene_stream, delimiter="\t")
+        header = next(reader, [])
+        name_col = next(
+            (header.index(col) for col in GENE_NAME_COLUMNS if col in header),
+            1 if len(header) > 1 else 0
+        )
+        for line in reader:
+            if len(line) <= name_col:
+                continue
+            gene_id, gene_name = line[0], line[name_col]
+            index[gene_id] = gene_name
+            index.setdefault(gene_id.split(".")[0], gene_name)
+
+    logging.debug(f"{len(index)} gene identifiers indexed")
+    return index
+
+
+def test_gene_index(tmp_path: Path) -> None:
+    """
+    Test the above function gene_index
+    """
+    gene2gene = tmp_path / "gene2gene.tsv"
+    gene2gene.write_text(
+        "Gene_ID\tGene_Name\tChromosome\n"
+        "ENSG01.5\tGENE1\t21\n"
+        "ENSG02\tGENE2\t21\n"
+    )
+    expected = {
+        "ENSG01.5": "GENE1",
+        "ENSG01": "GENE1",
+        "ENSG02": "GENE2",
+    }
+    assert gene_index(str(gene2gene)) == expected
+
+
+def to_float(value: str) -> float:
+    """
+    Convert a DESeq2 value into a float, NA being NaN
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return math.nan
+
+
+def read_deseq2(deseq2_path: str) -> Iterator[Tuple[str, float, float]]:
+    """
+    Iterate over a DESeq2 result table and yield
+    (gene identifier, log2FoldChange, padj) for each line
+    """
+    with open(deseq2_path, "r") as deseq2_stream:
+        reader = csv.reader(deseq2_stream, delimiter="\t")
+        header = next(reader)
+        fc_col = header.index("log2FoldChange")
+        padj_col = header.index("padj")
+        for line in reader:
+            # R writes row names without any header
+            shift = len(line) - len(header)
+            yield (
+                line[0],
+                to_float(line[fc_col + shift]),
+                to_float(line[padj_col + shift])
+            )
+
+
+def classify(log2fc: float,
+             padj: float,
+             alpha_threshold: float = 0.05,
+             fc_threshold: float = 1.0) -> Tuple[str, str, bool]:
+    """
+    Return the fold change cluster, the significance cluster and whether
+    the gene passes both alpha and fold change thresholds. Genes without
+    fold change have no fold change cluster (NA).
+    """
+    if math.isnan(log2fc):
+        cluster_fc = "NA"
+    else:
+        cluster_fc = "Up" if log2fc > 0 else "Down"
+    significant = padj <= alpha_threshold
+    cluster_sig = "Significative" if significant else "Non_Significative"
+    return (
+        cluster_fc,
+        cluster_sig,
+        significant and abs(log2fc) >= fc_threshold
+    )
+
+
+@pytest.mark.parametrize(
+    "log2fc, padj, expected", [
+        (2.0, 0.01, ("Up", "Significative", True)),
+        (-2.0, 0.01, ("Down", "Significative", True)),
+        (0.5, 0.01, ("Up", "Significative", False)),
+        (2.0, 0.5, ("Up", "Non_Significative", False)),
+        (2.0, math.nan, ("Up", "Non_Significative", False)),
+        (math.nan, 0.01, ("NA", "Significative", False)),
+        (math.nan, math.nan, ("NA", "Non_Significative", False)),
+    ]
+)
+def test_classify(log2fc: float,
+                  padj: float,
+                  expected: Tuple[str, str, bool]) -> None:
+    """
+    Test the above function classify with multiple inputs
+    """
+    assert classify(log2fc, padj) == expected
+
+
+def convert(deseq2_path: str,
+            index: Dict[str, str],
+            complete_path: str,
+            fc_fc_path: str,
+            padj_fc_path: str,
+            alpha_threshold: float = 0.05,
+            fc_threshold: float = 1.0) -> int:
+    """
+    Write the three GSEAapp tables in a single pass over the DESeq2 results.
+    Return the number of genes written in the complete table.
+    """
+    logging.info(f"Converting {deseq2_path}")
+    nb_genes = 0
+    with open(complete_path, "w", newline="") as complete_stream, \
+            open(fc_fc_path, "w", newline="") as fc_fc_stream, \
+            open(padj_fc_path, "w", newline="") as padj_fc_stream:
+        complete = csv.writer(complete_stream, delimiter="\t")
+        fc_fc = csv.writer(fc_fc_stream, delimiter="\t")
+        padj_fc = csv.writer(padj_fc_stream, delimiter="\t")
+
+        complete.writerow(COMPLETE_HEADER)
+        fc_fc.writerow(GSEAAPP_HEADER)
+        padj_fc.writerow(GSEAAPP_HEADER)
+
+        for gene_id, log2fc, padj in read_deseq2(deseq2_path):
+            gene_name = index.get(
+                gene_id, index.get(gene_id.split(".")[0], gene_id)
+            )
+            cluster_fc, cluster_sig, keep = classify(
+                log2fc, padj, alpha_threshold, fc_threshold
+            )
+            complete.writerow([
+                "NA" if math.isnan(log2fc) else log2fc,
+                gene_name,
+                cluster_fc,
+                cluster_sig,
+                "NA" if math.isnan(padj) else padj
+            ])
+            nb_genes += 1
+
+            if keep:
+                fc_fc.writerow([gene_name, log2fc, cluster_fc])
+                padj_fc.writerow([gene_name, padj, cluster_fc])
+
+    logging.debug(f"{nb_genes} genes written in {complete_path}")
+    return nb_genes
+
+
+def test_convert(tmp_path: Path) -> None:
+    """
+    Test the above function convert
+    """
+    deseq2 = tmp_path / "DESeq2.tsv"
+    deseq2.write_text(
+        "baseMean\tlog2FoldChange\tlfcSE\tstat\tpvalue\tpadj\n"
+        "ENSG01.5\t10\t2.5\t0.1\t1\t0.001\t0.01\n"
+        "ENSG02\t10\t-0.2\t0.1\t1\t0.5\t0.9\n"
+        "ENSG03\t0\tNA\tNA\tNA\tNA\tNA\n"
+    )
+    outputs = [tmp_path / f"{name}.tsv" for name in ["c", "f", "p"]]
+    tested = convert(
+        str(deseq2), {"ENSG01": "GENE1"}, *map(str, outputs)
+    )
+    assert tested == 3
+    assert outputs[0].read_text().splitlines() == [
+        "log2FoldChange\tGeneIdentifier\tCluster_FC\tCluster_Sig\tpadj",
+        "2.5\tGENE1\tUp\tSignificative\t0.01",
+        "-0.2\tENSG02\tDown\tNon_Significative\t0.9",
+        "NA\tENSG03\tNA\tNon_Significative\tNA",
+    ]
+    assert outputs[1].read_text().splitlines() == [
+        "GeneIdentifier\tstat_change\tcluster",
+        "GENE1\t2.5\tUp",
+    ]
+    assert outputs[2].read_text().splitlines() == [
+        "GeneIdentifier\tstat_change\tcluster",
+        "GENE1\t0.01\tUp",
+    ]
+
+
+def convert_batch(gene2gene_path: str,
+                  deseq2_paths: List[str],
+                  complete_paths: List[str],
+                  fc_fc_paths: List[str],
+                  padj_fc_paths: List[str],
+                  alpha_threshold: float = 0.05,
+                  fc_threshold: float = 1.0) -> Dict[str, int]:
+    """
+    Convert any number of DESeq2 result tables, indexing gene2gene only once.
+    Return the number of genes written in each complete table.
+    """
+    if not (len(deseq2_paths) == len(complete_paths)
+            == len(fc_fc_paths) == len(padj_fc_paths)):
+        raise ValueError(
+            "Each DESeq2 table requires exactly one complete, "
+            "one fc_fc and one padj_fc output table"
+        )
+
+    index = gene_index(gene2gene_path)
+    return {
+        complete: convert(
+            deseq2, index, complete, fc_fc, padj_fc,
+            alpha_threshold, fc_threshold
+        )
+        for deseq2, complete, fc_fc, padj_fc in zip(
+            deseq2_paths, complete_paths, fc_fc_paths, padj_fc_paths
+        )
+    }
+
+
+def test_convert_batch(tmp_path: Path) -> None:
+    """
+    Test the above function convert_batch
+    """
+    gene2gene = tmp_path / "gene2gene.tsv"
+    gene2gene.write_text("Gene_ID\tGene_Name\nENSG01\tGENE1\n")
+    deseq2 = tmp_path / "DESeq2.tsv"
+    deseq2.write_text(
+        "\tbaseMean\tlog2FoldChange\tlfcSE\tstat\tpvalue\tpadj\n"
+        "ENSG01\t10\t2.5\t0.1\t1\t0.001\t0.01\n"
+    )
+    outputs = {
+        design: [str(tmp_path / f"{design}_{name}.tsv")
+                 for name in ["c", "f", "p"]]
+        for design in ["d1", "d2"]
+    }
+    tested = convert_batch(
+        str(gene2gene),
+        [str(deseq2), str(deseq2)],
+        *[[outputs[design][i] for design in ["d1", "d2"]] for i in range(3)]
+    )
+    assert tested == {outputs["d1"][0]: 1, outputs["d2"][0]: 1}
+    assert (
+        Path(outputs["d1"][1]).read_text()
+        == Path(outputs["d2"][1]).read_text()
+        == "GeneIdentifier\tstat_change\tcluster\nGENE1\t2.5\tUp\n"
+    )
+
+    with pytest.raises(ValueError):
+        convert_batch(str(gene2gene), [str(deseq2)], [], [], [])
+
+
+def as_list(paths: Union[str, List[str]]) -> List[str]:
+    """
+    Snakemake provides a single path as a string, and multiple paths
+    as a list: always return a list
+    """
+    return [paths] if isinstance(paths, str) else list(paths)
+
+
+def test_as_list() -> None:
+    """
+    Test the above function as_list
+    """
+    assert as_list("a.tsv") == ["a.tsv"]
+    assert as_list(["a.tsv", "b.tsv"]) == ["a.tsv", "b.tsv"]
+
+
+def main(args: argparse.ArgumentParser) -> None:
+    """
+    Main function of the script
+    """
+    convert_batch(
+        args.gene2gene,
+        args.deseq2,
+        args.complete,
+        args.fc_fc,
+        args.padj_fc,
+        args.alpha_threshold,
+        args.fc_threshold
+    )
+
+
+# Running programm if not imported
+if __name__ == "__main__":
+    if "snakemake" in globals():
+        # Called through Snakemake's script directive
+        logging.basicConfig(
+            filename=snakemake.log[0], filemode="w", level=10
+        )
+        args = argparse.Namespace(
+            gene2gene=snakemake.input["gene2gene"],
+            deseq2=as_list(snakemake.input["tsv"]),
+            complete=as_list(snakemake.output["complete"]),
+            fc_fc=as_list(snakemake.output["fc_fc"]),
+            padj_fc=as_list(snakemake.output["padj_fc"]),
+            alpha_threshold=snakemake.params["alpha_threshold"],
+            fc_threshold=snakemake.params["fc_threshold"]
+        )
+    else:
+        args = parse(sys.argv[1:])
+        logging.basicConfig(level=10)
+
+    try:
+        main(args)
+    except Exception as e:
+        logging.exception("%s", e)
+        raise
+
+    logging.info("Process over")
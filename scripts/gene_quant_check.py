@@ -0,0 +1,326 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+
+"""
+This script checks whether the gene-level quantifications computed by
+Salmon (`quant.genes.sf`) can be imported as is, instead of summarizing
+transcript-level quantifications with tximport.
+
+Each `quant.genes.sf` has to be an intact Salmon table, to list the same
+genes in the same order as in the other samples, and all its genes have to
+be annotated in the GTF file of the analysis (versions and suffixes after
+a bar are ignored, as tximport does). The GTF is only scanned for gene
+identifiers.
+
+One line per sample is written, with its status. The gene-level import is
+used only if all samples pass.
+
+You can test this script with:
+pytest -vv gene_quant_check.py
+
+Usage example:
+python3.8 gene_quant_check.py /path/to/S1 /path/to/S2 \
+    --gtf genomes/annotation.gtf \
+    --samples S1 S2 \
+    --output qc/gene_quantification.tsv
+"""
+
+import argparse  # Parse command line
+import csv  # Read/Write TSV files line by line
+import logging  # Traces and loggings
+import os  # OS related operations
+import pytest  # Unit testing
+import re  # Regular expressions
+import shlex  # Lexical analysis
+import sys  # System related methods
+
+from pathlib import Path  # Paths related methods
+from typing import Any, Dict, List, Optional, Set  # Type hints
+
+try:
+    from scripts import salmon_quant_qc
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+    import salmon_quant_qc
+
+
+GENE_ID = re.compile(r'gene_id "([^"]+)"')
+CHECK_HEADER = [
+    "Sample_id", "status", "errors", "genes", "unknown_genes",
+    "annotated_genes", "path"
+]
+
+
+def parser() -> argparse.ArgumentParser:
+    """
+    Build the argument parser object
+    """
+    main_parser = argparse.ArgumentParser(
+        description=sys.modules[__name__].__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    main_parser.add_argument(
+        "salmon",
+        help="Space separated list of Salmon quantification directories",
+        nargs="+",
+        type=str,
+        metavar="PATH",
+    )
+
+    main_parser.add_argument(
+        "--gtf",
+        help="Path to the GTF annotation of the analysis",
+        required=True,
+        type=str,
+    )
+
+    main_parser.add_argument(
+        "--samples",
+        help="Space separated list of sample names "
+             "(default: directory names)",
+        nargs="+",
+        default=None,
+        type=str,
+    )
+
+    main_parser.add_argument(
+        "--output",
+        help="Path to the check table (default: %(default)s)",
+        default="qc/gene_quantification.tsv",
+        type=str,
+    )
+
+    return main_parser
+
+
+def parse(args: Any) -> argparse.ArgumentParser:
+    """
+    Return an argument parser from command line
+    """
+    return parser().parse_args(args)
+
+
+def test_parse() -> None:
+    """
+    Test the argument parsing function
+    """
+    tested = parse(shlex.split("S1 S2 --gtf annotation.gtf"))
+    expected = argparse.Namespace(
+        salmon=["S1", "S2"],
+        gtf="annotation.gtf",
+        samples=None,
+        output="qc/gene_quantification.tsv",
+    )
+    assert tested == expected
+
+
+def strip_id(identifier: str) -> str:
+    """
+    Remove the version and the bar-separated suffixes of an identifier
+    """
+    return identifier.split("|")[0].split(".")[0]
+
+
+@pytest.mark.parametrize(
+    "identifier, expected", [
+        ("ENSG00000160310", "ENSG00000160310"),
+        ("ENSG00000160310.18", "ENSG00000160310"),
+        ("ENSG00000160310.18|PRMT2", "ENSG00000160310"),
+    ]
+)
+def test_strip_id(identifier: str, expected: str) -> None:
+    """
+    Test the function strip_id above
+    """
+    assert strip_id(identifier) == expected
+
+
+def gtf_genes(gtf: str) -> Set[str]:
+    """
+    Return the gene identifiers annotated in a GTF file
+    """
+    genes = set()
+    with open(gtf) as annotation:
+        for line in annotation:
+            match = GENE_ID.search(line)
+            if match is not None:
+                genes.add(strip_id(match.group(1)))
+    return genes
+
+
+def write_gtf(path: Path, genes: List[str]) -> str:
+    """
+    Write a minimal GTF file annotating the given genes, for tests
+    """
+    path.write_text("".join(
+        f'chr21\tENSEMBL\tgene\t1\t100\t.\t+\t.\tgene_id "{gene}"; '
+        f'gene_name "{gene}";\n'
+        for gene in genes
+    ))
+    return str(path)
+
+
+def test_gtf_genes(tmp_path: Path) -> None:
+    """
+    Test the function gtf_genes above
+    """
+    gtf = write_gtf(tmp_path / "annotation.gtf", ["G1.2", "G2", "G2"])
+    assert gtf_genes(gtf) == {"G1", "G2"}
+
+
+def read_gene_names(path: Path) -> List[str]:
+    """
+    Return the gene identifiers of a quant.genes.sf file, in order
+    """
+    with path.open() as quant:
+        reader = csv.reader(quant, delimiter="\t")
+        next(reader, None)
+        return [row[0] for row in reader if row]
+
+
+def check_sample(sample: str,
+                 directory: str,
+                 annotated: Set[str],
+                 reference: Optional[List[str]]) -> Dict[str, Any]:
+    """
+    Check that a gene-level quantification can be imported as is
+    """
+    path = Path(directory) / "quant.genes.sf"
+    row = {"Sample_id": sample, "genes": 0, "unknown_genes": 0,
+           "annotated_genes": len(annotated), "path": str(path)}
+    if not path.exists():
+        row.update(status="fail", errors="missing quant.genes.sf")
+        return row
+
+    _, errors = salmon_quant_qc.check_quant(path, None)
+    names = read_gene_names(path) if not errors else []
+    unknown = {strip_id(name) for name in names} - annotated
+    if unknown:
+        errors.append(
+            f"{len(unknown)} gene(s) missing in the GTF, "
+            f"e.g. {sorted(unknown)[0]}"
+        )
+    if reference is not None and names and names != reference:
+        errors.append("genes differ from the first sample")
+
+    row.update(
+        status="fail" if errors else "pass",
+        errors="; ".join(errors) or "NA",
+        genes=len(names),
+        unknown_genes=len(unknown)
+    )
+    return row
+
+
+def test_check_sample(tmp_path: Path) -> None:
+    """
+    Test the function check_sample above
+    """
+    annotated = set(
+        read_gene_names(Path("test/pseudo_mapping/a.chr21.1/quant.genes.sf"))
+    )
+    tested = check_sample("a", "test/pseudo_mapping/a.chr21.1",
+                          annotated, None)
+    assert tested["status"] == "pass", tested["errors"]
+    assert tested["genes"] == 837
+
+    tested = check_sample("a", "test/pseudo_mapping/a.chr21.1",
+                          {"ENSG00000160310"}, ["ENSG00000160310"])
+    assert tested["status"] == "fail"
+    assert tested["unknown_genes"] == 836
+    assert tested["errors"].endswith("genes differ from the first sample")
+
+    assert check_sample("b", str(tmp_path), annotated, None)["errors"] == \
+        "missing quant.genes.sf"
+
+
+def check_all(salmon: Dict[str, str], gtf: str) -> List[Dict[str, Any]]:
+    """
+    Check the gene-level quantification of each sample
+    """
+    annotated = gtf_genes(gtf)
+    logging.info("%i genes annotated in %s", len(annotated), gtf)
+
+    rows, reference = [], None
+    for sample, directory in salmon.items():
+        rows.append(check_sample(sample, directory, annotated, reference))
+        if reference is None and rows[-1]["status"] == "pass":
+            reference = read_gene_names(Path(rows[-1]["path"]))
+    return rows
+
+
+def gene_level_ready(path: str) -> bool:
+    """
+    Return True if a check table allows the gene-level import
+    """
+    with open(path) as table:
+        rows = list(csv.DictReader(table, delimiter="\t"))
+    return bool(rows) and all(row["status"] == "pass" for row in rows)
+
+
+def main(args: argparse.ArgumentParser) -> None:
+    """
+    Main function of the script
+    """
+    samples = args.samples or [
+        os.path.basename(os.path.normpath(path)) for path in args.salmon
+    ]
+    rows = check_all(dict(zip(samples, args.salmon)), args.gtf)
+    salmon_quant_qc.write_table(rows, args.output, CHECK_HEADER)
+
+    for row in rows:
+        if row["status"] == "fail":
+            logging.warning("%s: %s", row["Sample_id"], row["errors"])
+    logging.info(
+        "Gene-level import %s",
+        "enabled" if gene_level_ready(args.output) else
+        "disabled, transcripts are imported"
+    )
+
+
+def test_main(tmp_path: Path) -> None:
+    """
+    Test the main function above
+    """
+    output = tmp_path / "qc" / "genes.tsv"
+    gtf = write_gtf(tmp_path / "annotation.gtf", read_gene_names(
+        Path("test/pseudo_mapping/a.chr21.1/quant.genes.sf")
+    ))
+    main(parse([
+        "test/pseudo_mapping/a.chr21.1", "test/pseudo_mapping/b.chr21.1",
+        "--gtf", gtf, "--output", str(output)
+    ]))
+    assert gene_level_ready(str(output))
+
+    main(parse([
+        "test/pseudo_mapping/a.chr21.1", str(tmp_path),
+        "--gtf", gtf, "--output", str(output)
+    ]))
+    assert not gene_level_ready(str(output))
+
+
+# Running programm if not imported
+if __name__ == "__main__":
+    if "snakemake" in globals():
+        # Called through Snakemake's script directive
+        logging.basicConfig(
+            filename=snakemake.log[0], filemode="w", level=10
+        )
+        args = argparse.Namespace(
+            salmon=[os.path.dirname(path) for path in snakemake.input.quant],
+            gtf=snakemake.input.gtf,
+            samples=list(snakemake.params.samples),
+            output=snakemake.output.check
+        )
+    else:
+        args = parse(sys.argv[1:])
+        logging.basicConfig(level=10)
+
+    try:
+        main(args)
+    except Exception as e:
+        logging.exception("%s", e)
+        raise
+
+    logging.info("Process over")
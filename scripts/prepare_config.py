@@ -146,6 +146,30 @@ def parser() -> argparse.ArgumentParser:
         type=int
     )
 
+    pcas.add_argument(
+        "--pca-intgroup-nest",
+        help="Maximum number of design columns combined in a single PCA "
+             "coloring group (default: %(default)s)",
+        default=1,
+        type=int
+    )
+
+    pcas.add_argument(
+        "--pca-max-intgroups",
+        help="Maximum number of PCA coloring groups, columns used in models "
+             "first. 0 means no limit (default: %(default)s)",
+        default=0,
+        type=int
+    )
+
+    pcas.add_argument(
+        "--clustermap-top-genes",
+        help="Number of most variable genes used to cluster samples in the "
+             "clustered heatmap. 0 means all genes (default: %(default)s)",
+        default=0,
+        type=int
+    )
+
     pipeline = main_parser.add_argument_group("Pipeline options")
     pipeline.add_argument(
         "--no-pca-explorer",
@@ -178,6 +202,52 @@ def parser() -> argparse.ArgumentParser:
         action="store_true",
         default=False
     )
+    pipeline.add_argument(
+        "--no-performance-report",
+        help="Do not aggregate the benchmarks of each job in a performance "
+             "table.",
+        action="store_true",
+        default=False
+    )
+    pipeline.add_argument(
+        "--inferential-replicates",
+        help="Summarize Salmon bootstraps: mean, variance and inferential "
+             "relative variance of each transcript and gene.",
+        action="store_true",
+        default=False
+    )
+    pipeline.add_argument(
+        "--gene-level-import",
+        help="Import Salmon gene-level quantifications (quant.genes.sf) "
+             "instead of summarizing transcripts with tximport, when they "
+             "agree with the GTF gene set.",
+        action="store_true",
+        default=False
+    )
+    pipeline.add_argument(
+        "--gseaapp-batch",
+        help="Produce gseaapp tsv files for all designs within a single "
+             "job, instead of one job per design.",
+        action="store_true",
+        default=False
+    )
+
+    resources = main_parser.add_argument_group("Resources options")
+    resources.add_argument(
+        "--resource-history",
+        help="Directory where jobs features are logged. Memory and time "
+             "requests are estimated from past jobs logged there and their "
+             "benchmarks (default: %(default)s)",
+        default=".snakemake/resource-history",
+        type=str
+    )
+    resources.add_argument(
+        "--resource-margin",
+        help="Safety margin applied to estimated memory and time "
+             "(default: %(default)s)",
+        default=1.2,
+        type=float
+    )
 
     extra = main_parser.add_argument_group("Extra parameters")
     extra.add_argument(
@@ -276,6 +346,7 @@ def test_parse_args() -> None:
     options = parse(shlex.split("/path/to/file.gtf --debug "))
     expected = argparse.Namespace(
         alpha_threshold=0.05,
+        clustermap_top_genes=0,
         cold_storage=[' '],
         columns=None,
         copy_extra='--verbose',
@@ -283,20 +354,28 @@ def test_parse_args() -> None:
         deseq2_extra='quiet=FALSE',
         design='design.tsv',
         fc_threshold=1.0,
+        gene_level_import=False,
+        gseaapp_batch=False,
         gtf='/path/to/file.gtf',
+        inferential_replicates=False,
         models=['Condition,B,A,~Condition'],
         no_additional_figures=False,
         no_gseaapp_files=False,
         no_multiqc=False,
         no_pca_explorer=False,
+        no_performance_report=False,
         output='config.yaml',
         pca_axes_depth=2,
+        pca_intgroup_nest=1,
+        pca_max_intgroups=0,
         pcaexplorer_distro_expr_extra="plot_type='density'",
         pcaexplorer_limmaquickpca2go_extra="organism = 'Hs'",
         pcaexplorer_pair_corr_extra='use_subset=TRUE, log=FALSE',
         pcaexplorer_pcacorrs_extra='pc=1',
         pcaexplorer_scree_extra="type='pev', pc_nr=10",
         quiet=False,
+        resource_history='.snakemake/resource-history',
+        resource_margin=1.2,
         singularity='docker://continuumio/miniconda3:4.4.10',
         threads=1,
         tximport_extra="type='salmon', ignoreTxVersion=TRUE, ignoreAfterBar=TRUE",
@@ -335,7 +414,9 @@ def args_to_dict(args: argparse.ArgumentParser) -> Dict[str, Any]:
             "pca_explorer": not args.no_pca_explorer,
             "gseaapp": not args.no_gseaapp_files,
             "additional_figures": not args.no_additional_figures,
-            "multiqc": not args.no_multiqc
+            "multiqc": not args.no_multiqc,
+            "performance": not args.no_performance_report,
+            "inferential_replicates": args.inferential_replicates
         },
         "params": {
             "copy_extra": args.copy_extra,
@@ -346,7 +427,14 @@ def args_to_dict(args: argparse.ArgumentParser) -> Dict[str, Any]:
             "pcaexplorer_scree": args.pcaexplorer_scree_extra,
             "pcaexplorer_pair_corr": args.pcaexplorer_pair_corr_extra,
             "pcaexplorer_pcacorrs": args.pcaexplorer_pcacorrs_extra,
-            "pca_axes_depth": args.pca_axes_depth
+            "pca_axes_depth": args.pca_axes_depth,
+            "pca_intgroup_nest": args.pca_intgroup_nest,
+            "pca_max_intgroups": args.pca_max_intgroups,
+            "clustermap_top_genes": args.clustermap_top_genes,
+            "gseaapp_batch": args.gseaapp_batch,
+            "gene_level_import": args.gene_level_import,
+            "resource_history": args.resource_history,
+            "resource_margin": args.resource_margin
         },
         "models": models,
         "columns": args.columns
@@ -378,14 +466,23 @@ def test_args_to_dict() -> None:
             "pcaexplorer_scree": "type='pev', pc_nr=10",
             "pcaexplorer_pair_corr": "use_subset=TRUE, log=FALSE",
             "pcaexplorer_pcacorrs": "pc=1",
-            "pca_axes_depth": 2
+            "pca_axes_depth": 2,
+            "pca_intgroup_nest": 1,
+            "pca_max_intgroups": 0,
+            "clustermap_top_genes": 0,
+            "gseaapp_batch": False,
+            "gene_level_import": False,
+            "resource_history": ".snakemake/resource-history",
+            "resource_margin": 1.2
         },
         "pipeline": {
             "deseq2": True,
             "pca_explorer": True,
             "gseaapp": True,
             "additional_figures": True,
-            "multiqc": True
+            "multiqc": True,
+            "performance": True,
+            "inferential_replicates": False
         },
         "models": {
             "Condition_compairing_B_vs_A": {
@@ -406,10 +503,11 @@ def main(args: argparse.ArgumentParser) -> None:
     Main function of the script
     """
     config_dict = args_to_dict(args)
-    common.write_yaml(
-        Path(args.output),
-        config_dict
-    )
+    with common.span("write_config", path=args.output):
+        common.write_yaml(
+            Path(args.output),
+            config_dict
+        )
 
 
 if __name__ == "__main__":
@@ -109,6 +109,7 @@ def test_parse_args() -> None:
     assert tested == expected
 
 
+@traced
 def design_importer(
     design_path: str, index_col: Union[str, int] = 0
 ) -> pandas.DataFrame:
@@ -130,6 +131,7 @@ def design_importer(
     return data
 
 
+@traced
 def find_quantification(salmon_path: str) -> Dict[str, str]:
     """
     Iterates through a directory and searches for salmon files
@@ -172,6 +174,7 @@ def test_find_quantification() -> None:
     assert tested.equals(expected)
 
 
+@traced
 def merge_designs(
     quant_dir: pandas.DataFrame, imported_design: pandas.DataFrame
 ) -> pandas.DataFrame:
@@ -206,7 +209,8 @@ def main(args: argparse.ArgumentParser) -> None:
         design = merge_designs(design.copy(), old)
 
     logging.info(f"Saving results to {str(args.output)}")
-    design.to_csv(args.output, sep="\t", na_rep="NA")
+    with span("write_design", path=args.output, samples=len(design)):
+        design.to_csv(args.output, sep="\t", na_rep="NA")
 
 
 if __name__ == "__main__":
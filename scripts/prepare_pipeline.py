@@ -29,7 +29,8 @@ from pathlib import Path
 from snakemake.utils import makedirs
 from typing import Dict, Any
 
-from common_script_rna_dge_salmon_deseq2 import CustomFormatter, write_yaml
+from common_script_rna_dge_salmon_deseq2 import (CustomFormatter, span,
+                                                 traced, write_yaml)
 
 
 
@@ -243,6 +244,7 @@ def parse(args: Any) -> argparse.ArgumentParser:
     return parser().parse_args(args)
 
 
+@traced
 def load_old_config(yaml_path: str) -> Dict[str, Any]:
     """
     Load rna-count-salmon configfile
@@ -301,6 +303,7 @@ def args_to_dict(args: argparse.ArgumentParser,
     return result_dict
 
 
+@traced
 def update_design(input_path: str) -> pandas.DataFrame:
     """
     This function updates existing design file
@@ -379,8 +382,10 @@ def main(args: argparse.ArgumentParser) -> None:
 
     logging.debug("Saving output files")
     makedirs(new_config["workdir"])
-    write_yaml(Path(new_config["config"]), new_config)
-    design.to_csv(new_config["design"], sep="\t")
+    with span("write_config", path=new_config["config"]):
+        write_yaml(Path(new_config["config"]), new_config)
+    with span("write_design", path=new_config["design"]):
+        design.to_csv(new_config["design"], sep="\t")
 
 
 # Running programm if not imported
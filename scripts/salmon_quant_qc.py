@@ -0,0 +1,379 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+
+"""
+This script checks the integrity of Salmon quantifications, and gathers
+their quality metrics in one table.
+
+Each `quant.sf` is expected to have the Salmon header, one row per
+transcript of the index (`num_valid_targets` in `aux_info/meta_info.json`),
+non-negative numeric values, and TPM summing up to one million. Mapping rate
+and library format are read from `aux_info/meta_info.json`,
+`lib_format_counts.json` and `cmd_info.json`. Quantifications are checked in
+parallel.
+
+Two tables are written: a QC table, and the same metrics as a MultiQC
+custom content table. The script fails if any quantification is broken,
+after having logged the errors of each sample.
+
+You can test this script with:
+pytest -vv salmon_quant_qc.py
+
+Usage example:
+python3.8 salmon_quant_qc.py /path/to/S1 /path/to/S2 \
+    --samples S1 S2 \
+    --output qc/salmon_quantification.tsv \
+    --multiqc qc/salmon_quantification_mqc.tsv
+"""
+
+import argparse  # Parse command line
+import csv  # Write TSV files line by line
+import json  # Read Salmon metadata
+import logging  # Traces and loggings
+import math  # Check numeric values
+import os  # OS related operations
+import pytest  # Unit testing
+import shlex  # Lexical analysis
+import sys  # System related methods
+
+from multiprocessing.pool import ThreadPool  # Check samples in parallel
+from pathlib import Path  # Paths related methods
+from typing import Any, Dict, List, Optional, Tuple  # Type hints
+
+
+# Columns of a quant.sf file
+QUANT_HEADER = ["Name", "Length", "EffectiveLength", "TPM", "NumReads"]
+# Columns of the QC table
+QC_HEADER = [
+    "Sample_id", "status", "errors", "num_targets", "num_rows",
+    "num_processed", "num_mapped", "percent_mapped", "library_types",
+    "expected_format", "compatible_fragment_ratio", "strand_mapping_bias",
+    "salmon_version", "index", "path"
+]
+# Columns of the QC table displayed by MultiQC
+MULTIQC_COLUMNS = [
+    "status", "percent_mapped", "num_processed", "num_mapped",
+    "library_types", "expected_format", "compatible_fragment_ratio",
+    "num_targets"
+]
+MULTIQC_HEADER = """# id: 'salmon_quantification'
+# section_name: 'Salmon quantification'
+# description: 'Integrity and mapping rate of each Salmon quantification'
+# plot_type: 'table'
+# pconfig:
+#     id: 'salmon_quantification_table'
+#     namespace: 'Salmon'
+"""
+
+
+def parser() -> argparse.ArgumentParser:
+    """
+    Build the argument parser object
+    """
+    main_parser = argparse.ArgumentParser(
+        description=sys.modules[__name__].__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    main_parser.add_argument(
+        "salmon",
+        help="Space separated list of Salmon quantification directories",
+        nargs="+",
+        type=str,
+        metavar="PATH",
+    )
+
+    main_parser.add_argument(
+        "--samples",
+        help="Space separated list of sample names "
+             "(default: directory names)",
+        nargs="+",
+        default=None,
+        type=str,
+    )
+
+    main_parser.add_argument(
+        "--output",
+        help="Path to the QC table (default: %(default)s)",
+        default="qc/salmon_quantification.tsv",
+        type=str,
+    )
+
+    main_parser.add_argument(
+        "--multiqc",
+        help="Path to the MultiQC custom content table "
+             "(default: %(default)s)",
+        default="qc/salmon_quantification_mqc.tsv",
+        type=str,
+    )
+
+    main_parser.add_argument(
+        "--threads",
+        help="Number of quantifications checked at once "
+             "(default: %(default)s)",
+        default=1,
+        type=int,
+    )
+
+    return main_parser
+
+
+def parse(args: Any) -> argparse.ArgumentParser:
+    """
+    Return an argument parser from command line
+    """
+    return parser().parse_args(args)
+
+
+def test_parse() -> None:
+    """
+    Test the argument parsing function
+    """
+    tested = parse(shlex.split("S1 S2 --samples a b --threads 2"))
+    expected = argparse.Namespace(
+        salmon=["S1", "S2"],
+        samples=["a", "b"],
+        output="qc/salmon_quantification.tsv",
+        multiqc="qc/salmon_quantification_mqc.tsv",
+        threads=2,
+    )
+    assert tested == expected
+
+
+def read_json(path: Path) -> Dict[str, Any]:
+    """
+    Load a Salmon metadata file, empty if missing
+    """
+    try:
+        with path.open() as metadata:
+            return json.load(metadata)
+    except FileNotFoundError:
+        return {}
+
+
+def check_quant(path: Path,
+                expected_rows: Optional[int]) -> Tuple[int, List[str]]:
+    """
+    Return the number of rows of a quant.sf file, and its integrity errors
+    """
+    errors = []
+    rows, tpm = 0, 0.0
+    with path.open() as quant:
+        header = quant.readline()
+        if header.rstrip("\n").split("\t") != QUANT_HEADER:
+            return 0, [f"unexpected header: {header.strip()[:80]!r}"]
+
+        line = header
+        for rows, line in enumerate(quant, 1):
+            fields = line.rstrip("\n").split("\t")
+            try:
+                values = [float(field) for field in fields[1:]]
+            except ValueError:
+                values = []
+            if len(fields) != 5 or len(values) != 4 or not all(
+                    math.isfinite(value) and value >= 0 for value in values):
+                errors.append(f"malformed row {rows + 1}: {line.strip()!r}")
+                break
+            tpm += values[2]
+
+    if not line.endswith("\n"):
+        errors.append("truncated file: no end of line")
+    if expected_rows is not None and rows != expected_rows:
+        errors.append(f"{rows} rows, {expected_rows} targets in the index")
+    if tpm > 0 and abs(tpm - 1e6) > 1e6 * 0.01:
+        errors.append(f"TPM sum up to {tpm:.0f} instead of one million")
+    return rows, errors
+
+
+def test_check_quant(tmp_path: Path) -> None:
+    """
+    Test the function check_quant above
+    """
+    header = "\t".join(QUANT_HEADER) + "\n"
+    quant = tmp_path / "quant.sf"
+    quant.write_text(header + "T1\t100\t80\t600000\t12\nT2\t50\t30\t400000\t4\n")
+    assert check_quant(quant, 2) == (2, [])
+    assert check_quant(quant, 3)[1] == ["2 rows, 3 targets in the index"]
+
+    quant.write_text(header + "T1\t100\t80\t1000000\t12\nT2\t50\t3")
+    assert check_quant(quant, None)[1] == [
+        "malformed row 3: 'T2\\t50\\t3'", "truncated file: no end of line"
+    ]
+
+    quant.write_text("Name\tNumReads\n")
+    assert check_quant(quant, 1)[1][0].startswith("unexpected header")
+
+
+def harvest(sample: str, directory: str) -> Dict[str, Any]:
+    """
+    Check a Salmon quantification, and gather its quality metrics
+    """
+    path = Path(directory)
+    meta_info = read_json(path / "aux_info" / "meta_info.json")
+    lib_format = read_json(path / "lib_format_counts.json")
+    cmd_info = read_json(path / "cmd_info.json")
+    expected_rows = meta_info.get(
+        "num_valid_targets", meta_info.get("num_targets")
+    )
+
+    try:
+        rows, errors = check_quant(path / "quant.sf", expected_rows)
+    except (OSError, UnicodeDecodeError) as error:
+        rows, errors = 0, [str(error)]
+    if not meta_info:
+        errors.append("missing aux_info/meta_info.json")
+
+    percent_mapped = meta_info.get("percent_mapped")
+    return {
+        "Sample_id": sample,
+        "status": "fail" if errors else "pass",
+        "errors": "; ".join(errors) or "NA",
+        "num_targets": expected_rows,
+        "num_rows": rows,
+        "num_processed": meta_info.get("num_processed"),
+        "num_mapped": meta_info.get("num_mapped"),
+        "percent_mapped": (
+            None if percent_mapped is None else round(percent_mapped, 2)
+        ),
+        "library_types": ",".join(meta_info.get("library_types", [])) or None,
+        "expected_format": lib_format.get("expected_format"),
+        "compatible_fragment_ratio": lib_format.get(
+            "compatible_fragment_ratio"
+        ),
+        "strand_mapping_bias": lib_format.get("strand_mapping_bias"),
+        "salmon_version": (
+            meta_info.get("salmon_version") or cmd_info.get("salmon_version")
+        ),
+        "index": cmd_info.get("index"),
+        "path": directory,
+    }
+
+
+def test_harvest() -> None:
+    """
+    Test the function harvest above
+    """
+    tested = harvest("d.chr21.1", "test/pseudo_mapping/d.chr21.1")
+    assert tested["status"] == "pass", tested["errors"]
+    assert tested["num_rows"] == tested["num_targets"] == 2412
+    assert tested["percent_mapped"] == 20.69
+    assert tested["library_types"] == "IU"
+    assert tested["index"] == "salmon_index/genome_index"
+
+    tested = harvest("missing", "test/pseudo_mapping/missing")
+    assert tested["status"] == "fail"
+    assert "missing aux_info/meta_info.json" in tested["errors"]
+
+
+def harvest_all(salmon: Dict[str, str], threads: int) -> List[Dict[str, Any]]:
+    """
+    Check all Salmon quantifications in parallel, in the given order
+    """
+    with ThreadPool(max(min(threads, len(salmon)), 1)) as pool:
+        return pool.starmap(harvest, salmon.items())
+
+
+def write_table(rows: List[Dict[str, Any]],
+                output: str,
+                columns: List[str],
+                header: str = "") -> None:
+    """
+    Save the given columns of the QC table as TSV
+    """
+    Path(output).parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", newline="") as table:
+        table.write(header)
+        writer = csv.DictWriter(
+            table, fieldnames=columns, delimiter="\t", lineterminator="\n",
+            extrasaction="ignore"
+        )
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({
+                key: "NA" if value is None else value
+                for key, value in row.items()
+            })
+
+
+def main(args: argparse.ArgumentParser) -> None:
+    """
+    Main function of the script
+    """
+    samples = args.samples or [
+        os.path.basename(os.path.normpath(path)) for path in args.salmon
+    ]
+    if len(samples) != len(args.salmon):
+        raise ValueError(
+            f"{len(samples)} sample names for {len(args.salmon)} "
+            "Salmon directories"
+        )
+
+    rows = harvest_all(dict(zip(samples, args.salmon)), args.threads)
+    write_table(rows, args.output, QC_HEADER)
+    write_table(
+        rows, args.multiqc, ["Sample_id"] + MULTIQC_COLUMNS, MULTIQC_HEADER
+    )
+
+    failed = [row for row in rows if row["status"] == "fail"]
+    for row in failed:
+        logging.error("%s (%s): %s", row["Sample_id"], row["path"],
+                      row["errors"])
+    logging.info("%i quantification(s) checked, %i broken",
+                 len(rows), len(failed))
+    if failed:
+        raise ValueError(
+            "Broken Salmon quantification(s): "
+            + ", ".join(row["Sample_id"] for row in failed)
+        )
+
+
+def test_main(tmp_path: Path) -> None:
+    """
+    Test the main function above
+    """
+    output = tmp_path / "qc" / "salmon.tsv"
+    multiqc = tmp_path / "qc" / "salmon_mqc.tsv"
+    main(parse([
+        "test/pseudo_mapping/a.chr21.1", "test/pseudo_mapping/b.chr21.1",
+        "--output", str(output), "--multiqc", str(multiqc), "--threads", "2"
+    ]))
+    lines = output.read_text().splitlines()
+    assert lines[0].split("\t") == QC_HEADER
+    assert [line.split("\t")[:2] for line in lines[1:]] == [
+        ["a.chr21.1", "pass"], ["b.chr21.1", "pass"]
+    ]
+    assert multiqc.read_text().startswith(MULTIQC_HEADER + "Sample_id\t")
+
+    with pytest.raises(ValueError, match="missing"):
+        main(parse([
+            "test/pseudo_mapping/missing", "--output", str(output),
+            "--multiqc", str(multiqc)
+        ]))
+    assert "\tfail\t" in output.read_text()
+
+
+# Running programm if not imported
+if __name__ == "__main__":
+    if "snakemake" in globals():
+        # Called through Snakemake's script directive
+        logging.basicConfig(
+            filename=snakemake.log[0], filemode="w", level=10
+        )
+        args = argparse.Namespace(
+            salmon=[os.path.dirname(path) for path in snakemake.input.quant],
+            samples=list(snakemake.params.samples),
+            output=snakemake.output.qc,
+            multiqc=snakemake.output.multiqc,
+            threads=snakemake.threads
+        )
+    else:
+        args = parse(sys.argv[1:])
+        logging.basicConfig(level=10)
+
+    try:
+        main(args)
+    except Exception as e:
+        logging.exception("%s", e)
+        raise
+
+    logging.info("Process over")
@@ -0,0 +1,447 @@
+#!/usr/bin/python3.8
+# -*- coding: utf-8 -*-
+
+"""
+This script stages input files (GTF, Salmon quantifications, ...) into the
+working directory, with the cheapest method available:
+
+1. a hard link, when source and destination share the same file system,
+   and the source is not on cold storage,
+2. a kernel-side copy (copy_file_range), which clones the file on file
+   systems supporting reflinks,
+3. a chunked parallel copy, where each chunk is verified with a checksum
+   once written.
+
+Each staged file is recorded in a manifest. Files whose source did not
+change since they were staged are never copied again.
+
+Optional files are staged only if their source exists.
+
+You can test this script with:
+pytest -vv stage_files.py
+
+Usage example:
+python3.8 stage_files.py /path/to/annotation.gtf \
+    --destinations genomes/annotation.gtf \
+    --cold-storage /mnt/isilon /mnt/archivage \
+    --threads 4
+"""
+
+import argparse  # Parse command line
+import fcntl  # Lock the manifest
+import hashlib  # Checksum copied chunks
+import json  # Read/Write manifest
+import logging  # Traces and loggings
+import os  # OS related operations
+import pytest  # Unit testing
+import shlex  # Lexical analysis
+import sys  # System related methods
+import time  # Time staging
+
+from multiprocessing.pool import ThreadPool  # Copy chunks in parallel
+from pathlib import Path  # Paths related methods
+from typing import Any, Dict, List, Tuple  # Type hints
+
+
+MANIFEST = os.path.join(".snakemake", "staging", "manifest.json")
+
+
+def parser() -> argparse.ArgumentParser:
+    """
+    Build the argument parser object
+    """
+    main_parser = argparse.ArgumentParser(
+        description=sys.modules[__name__].__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    main_parser.add_argument(
+        "sources",
+        help="Space separated list of files to stage",
+        nargs="+",
+        type=str,
+        metavar="PATH",
+    )
+
+    main_parser.add_argument(
+        "--destinations",
+        help="Space separated list of destinations, one per source",
+        nargs="+",
+        required=True,
+        type=str,
+    )
+
+    main_parser.add_argument(
+        "--optional",
+        help="A source and its destination, staged only if the source "
+             "exists. This argument can be repeated.",
+        nargs=2,
+        action="append",
+        default=[],
+        metavar=("SOURCE", "DESTINATION"),
+    )
+
+    main_parser.add_argument(
+        "--cold-storage",
+        help="Space separated list of cold storage mount points. Files "
+             "there are always copied.",
+        nargs="*",
+        default=[],
+        type=str,
+    )
+
+    main_parser.add_argument(
+        "--manifest",
+        help="Path to the staging manifest (default: %(default)s)",
+        default=MANIFEST,
+        type=str,
+    )
+
+    main_parser.add_argument(
+        "--threads",
+        help="Number of chunks copied in parallel (default: %(default)s)",
+        default=1,
+        type=int,
+    )
+
+    main_parser.add_argument(
+        "--chunk-mb",
+        help="Size of copied chunks, in MB (default: %(default)s)",
+        default=64,
+        type=int,
+    )
+
+    return main_parser
+
+
+def parse(args: Any) -> argparse.ArgumentParser:
+    """
+    Return an argument parser from command line
+    """
+    return parser().parse_args(args)
+
+
+def test_parse() -> None:
+    """
+    Test the argument parsing function
+    """
+    tested = parse(shlex.split(
+        "a.gtf --destinations genomes/a.gtf --optional b.json genomes/b.json"
+    ))
+    expected = argparse.Namespace(
+        chunk_mb=64,
+        cold_storage=[],
+        destinations=["genomes/a.gtf"],
+        manifest=MANIFEST,
+        optional=[["b.json", "genomes/b.json"]],
+        sources=["a.gtf"],
+        threads=1,
+    )
+    assert tested == expected
+
+
+def is_cold(path: str, cold_storage: List[str]) -> bool:
+    """
+    Return wether a path lies on one of the cold storage mount points
+    """
+    path = os.path.realpath(path)
+    return any(
+        mount.strip() not in ("", "NONE")
+        and os.path.commonpath([path, os.path.realpath(mount)])
+        == os.path.realpath(mount)
+        for mount in cold_storage
+    )
+
+
+@pytest.mark.parametrize(
+    "path, tested", [
+        ("/mnt/isilon/project/a.gtf", True),
+        ("/mnt/isilonic/a.gtf", False),
+        ("/home/user/a.gtf", False),
+    ]
+)
+def test_is_cold(path: str, tested: bool) -> None:
+    """
+    Test the function is_cold above
+    """
+    assert is_cold(path, ["/mnt/isilon", "NONE", " "]) is tested
+
+
+def source_state(source: str) -> Dict[str, int]:
+    """
+    Return what identifies a version of a source file
+    """
+    stat = os.stat(source)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def chunk_digest(path: str, offset: int, size: int) -> str:
+    """
+    Return the checksum of a chunk of file
+    """
+    with open(path, "rb") as stream:
+        stream.seek(offset)
+        return hashlib.blake2b(stream.read(size)).hexdigest()
+
+
+def copy_chunk(source: str, destination: str, offset: int, size: int) -> str:
+    """
+    Copy a chunk of file, verify it, and return its checksum
+    """
+    source_fd = os.open(source, os.O_RDONLY)
+    destination_fd = os.open(destination, os.O_WRONLY)
+    try:
+        data = os.pread(source_fd, size, offset)
+        written = 0
+        while written < len(data):
+            written += os.pwrite(
+                destination_fd, data[written:], offset + written
+            )
+    finally:
+        os.close(source_fd)
+        os.close(destination_fd)
+
+    digest = hashlib.blake2b(data).hexdigest()
+    if chunk_digest(destination, offset, size) != digest:
+        raise IOError(
+            f"Checksum mismatch while copying {source} at offset {offset}"
+        )
+    return digest
+
+
+def chunked_copy(source: str,
+                 destination: str,
+                 threads: int = 1,
+                 chunk_mb: int = 64) -> str:
+    """
+    Copy a file by chunks, in parallel, and return its checksum
+    """
+    size = os.path.getsize(source)
+    chunk = chunk_mb * 1024 ** 2
+    with open(destination, "wb") as stream:
+        stream.truncate(size)
+
+    offsets = range(0, size, chunk)
+    with ThreadPool(max(threads, 1)) as pool:
+        digests = pool.starmap(
+            copy_chunk,
+            [(source, destination, offset, chunk) for offset in offsets]
+        )
+    return hashlib.blake2b("".join(digests).encode()).hexdigest()
+
+
+def test_chunked_copy(tmp_path: Path) -> None:
+    """
+    Test the function chunked_copy above
+    """
+    source = tmp_path / "source.bin"
+    source.write_bytes(os.urandom(3 * 1024 ** 2 + 17))
+    destination = tmp_path / "destination.bin"
+    checksum = chunked_copy(str(source), str(destination), 3, 1)
+    assert destination.read_bytes() == source.read_bytes()
+    assert checksum == chunked_copy(str(source), str(destination), 1, 1)
+
+
+def kernel_copy(source: str, destination: str) -> None:
+    """
+    Copy a file within the kernel, cloning it when the file system can
+    """
+    size = os.path.getsize(source)
+    with open(source, "rb") as source_stream, \
+            open(destination, "wb") as destination_stream:
+        copied = 0
+        while copied < size:
+            count = os.copy_file_range(
+                source_stream.fileno(), destination_stream.fileno(),
+                size - copied
+            )
+            if count == 0:
+                raise IOError(f"Unexpected end of file: {source}")
+            copied += count
+
+
+def stage_file(source: str,
+               destination: str,
+               cold_storage: List[str],
+               threads: int = 1,
+               chunk_mb: int = 64) -> Dict[str, Any]:
+    """
+    Stage a file with the cheapest method available, and return how
+    """
+    os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+    tmp_path = f"{destination}.{os.getpid()}.staging"
+    start = time.time()
+    record = {"source": os.path.abspath(source), **source_state(source)}
+
+    methods = ["copy_file_range", "chunked_copy"]
+    if not is_cold(source, cold_storage):
+        methods.insert(0, "hardlink")
+
+    for method in methods:
+        try:
+            if method == "hardlink":
+                os.link(source, tmp_path)
+            elif method == "copy_file_range":
+                kernel_copy(source, tmp_path)
+            else:
+                record["checksum"] = chunked_copy(
+                    source, tmp_path, threads, chunk_mb
+                )
+            break
+        except (OSError, AttributeError) as error:
+            logging.info(f"{method} failed for {source}: {error}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if method == methods[-1]:
+                raise
+
+    os.replace(tmp_path, destination)
+    record["method"] = method
+    record["seconds"] = round(time.time() - start, 3)
+    logging.info(f"{source} staged to {destination} with {method}")
+    return record
+
+
+def test_stage_file(tmp_path: Path) -> None:
+    """
+    Test the function stage_file above
+    """
+    source = tmp_path / "source.gtf"
+    source.write_text("chr21\tgene\n")
+    tested = stage_file(str(source), str(tmp_path / "hot" / "a.gtf"), [])
+    assert tested["method"] == "hardlink"
+    assert (tmp_path / "hot" / "a.gtf").read_text() == "chr21\tgene\n"
+
+    tested = stage_file(
+        str(source), str(tmp_path / "hot" / "b.gtf"), [str(tmp_path)]
+    )
+    assert tested["method"] in ("copy_file_range", "chunked_copy")
+    assert (tmp_path / "hot" / "b.gtf").stat().st_ino != source.stat().st_ino
+
+
+def stage(pairs: List[Tuple[str, str]],
+          cold_storage: List[str],
+          manifest: str = MANIFEST,
+          threads: int = 1,
+          chunk_mb: int = 64) -> Dict[str, Dict[str, Any]]:
+    """
+    Stage files that are not already staged in their current version, and
+    record them in the manifest
+    """
+    os.makedirs(os.path.dirname(manifest) or ".", exist_ok=True)
+    with open(f"{manifest}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(manifest) as stream:
+                records = json.load(stream)
+        except (OSError, ValueError):
+            records = {}
+
+    staged = {}
+    for source, destination in pairs:
+        key = os.path.abspath(destination)
+        known = records.get(key, {})
+        if os.path.exists(destination) and (
+            # Hard links share their modification time with their source,
+            # which is touched by Snakemake along with the staged file
+            os.path.samefile(source, destination)
+            or (known.get("source") == os.path.abspath(source)
+                and all(known.get(name) == value
+                        for name, value in source_state(source).items()))
+        ):
+            logging.info(f"{destination} is up to date, not staged again")
+            continue
+        staged[key] = stage_file(
+            source, destination, cold_storage, threads, chunk_mb
+        )
+
+    with open(f"{manifest}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(manifest) as stream:
+                records = json.load(stream)
+        except (OSError, ValueError):
+            records = {}
+        records.update(staged)
+        tmp_path = f"{manifest}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as stream:
+            json.dump(records, stream, indent=2)
+        os.replace(tmp_path, manifest)
+    return staged
+
+
+def test_stage(tmp_path: Path) -> None:
+    """
+    Test the function stage above
+    """
+    source = tmp_path / "quant.sf"
+    source.write_text("Name\tLength\n")
+    manifest = str(tmp_path / "manifest.json")
+    pairs = [(str(source), str(tmp_path / "salmon" / "quant.sf"))]
+
+    assert len(stage(pairs, [], manifest)) == 1
+    # Unchanged sources are not staged again
+    os.utime(source)
+    assert stage(pairs, [], manifest) == {}
+
+    cold = [str(tmp_path)]
+    assert len(stage(pairs, cold, manifest)) == 0
+    os.remove(pairs[0][1])
+    assert len(stage(pairs, cold, manifest)) == 1
+    assert stage(pairs, cold, manifest) == {}
+    source.write_text("Name\tLength\tEffectiveLength\n")
+    assert len(stage(pairs, cold, manifest)) == 1
+    with open(manifest) as stream:
+        assert list(json.load(stream)) == [os.path.abspath(pairs[0][1])]
+
+
+def main(args: argparse.ArgumentParser) -> None:
+    """
+    Main function of the script
+    """
+    if len(args.sources) != len(args.destinations):
+        raise ValueError("Expected one destination per source")
+
+    pairs = list(zip(args.sources, args.destinations)) + [
+        (source, destination)
+        for source, destination in args.optional
+        if os.path.exists(source)
+    ]
+    staged = stage(
+        pairs, args.cold_storage, args.manifest, args.threads, args.chunk_mb
+    )
+    logging.info(
+        "%i file(s) staged, %.1f MB in %.1f seconds",
+        len(staged),
+        sum(record["size"] for record in staged.values()) / 1024 ** 2,
+        sum(record["seconds"] for record in staged.values())
+    )
+
+
+# Running programm if not imported
+if __name__ == "__main__":
+    if "snakemake" in globals():
+        # Called through Snakemake's script directive
+        logging.basicConfig(
+            filename=snakemake.log[0], filemode="w", level=10
+        )
+        args = argparse.Namespace(
+            sources=list(snakemake.input),
+            destinations=list(snakemake.output),
+            optional=snakemake.params.get("optional", []),
+            cold_storage=snakemake.params.get("cold_storage", []),
+            manifest=snakemake.params.get("manifest", MANIFEST),
+            threads=snakemake.threads,
+            chunk_mb=snakemake.params.get("chunk_mb", 64)
+        )
+    else:
+        args = parse(sys.argv[1:])
+        logging.basicConfig(level=10)
+
+    try:
+        main(args)
+    except Exception as e:
+        logging.exception("%s", e)
+        raise
+
+    logging.info("Process over")